@@ -262,6 +262,7 @@ try:
     from epycon.iou import LogParser, EntryPlanter, readentries
     from epycon.iou.parsers import _readmaster
     from epycon.utils.person import Tokenize
+    from epycon.conversion import needs_entries
 except ImportError as e:
     print(f"无法加载 Epycon。\n{e}")
     if __name__ == "__main__":
@@ -542,7 +543,6 @@ def execute_epycon_conversion(cfg):
     
     try:
         with utf8_guard:
-            output_fmt = cfg["data"]["output_format"]
             # 兼容 "00000000" 和 "00000000.log" 两种格式
             valid_datalogs = set(
                 f.rstrip(".log") if f.endswith(".log") else f
@@ -606,7 +606,7 @@ def execute_epycon_conversion(cfg):
                 # --- [Step 1] 读取并清洗 Entries ---
                 all_entries_norm = []
                 epath = os.path.join(study_path, ENTRIES_FILENAME)
-                need_entries = cfg["entries"]["convert"] or (cfg["data"]["output_format"] == "h5" and cfg["data"]["pin_entries"])
+                need_entries = needs_entries(cfg)
                 conv_logger.info(f"📋 Entries 配置: convert={cfg['entries']['convert']}, pin_entries={cfg['data']['pin_entries']}, need_entries={need_entries}")
                 
                 if need_entries:
@@ -849,8 +849,14 @@ def run_direct():
             "data": {
                 "type": "object",
                 "properties": {
-                    "output_format": {"type": "string", "enum": ["h5", "csv"]},
+                    "output_format": {
+                        "anyOf": [
+                            {"type": "string", "enum": ["h5", "csv"]},
+                            {"type": "array", "items": {"type": ["string", "object"]}},
+                        ]
+                    },
                     "merge_logs": {"type": "boolean"},
+                    "windows": {"type": ["object", "null"]},
                     "pin_entries": {"type": "boolean"},
                     "compression": {"type": ["string", "null"]},
                     "compression_opts": {"type": ["integer", "null"]}
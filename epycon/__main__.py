@@ -53,6 +53,11 @@ def main():
         if value is not None:
             cfg = deep_override(cfg, arg.split("."), value)
 
+    # 窗口转换：CLI 给出的项覆盖配置中的同名项
+    windows = batch.windows_from_args(args)
+    if windows:
+        cfg["data"]["windows"] = {**(cfg["data"].get("windows") or {}), **windows}
+
     # Load and validate jsonschema
     try:
         with open(jsonschema_path, "r") as f:
@@ -71,7 +76,7 @@ def main():
 
     from epycon.config.byteschema import ENTRIES_FILENAME
     from epycon.iou import EntryPlanter, readentries
-    from epycon.conversion import convert_study, resolve_subject
+    from epycon.conversion import convert_study, needs_entries, resolve_subject
 
     input_folder = _validate_path(cfg["paths"]["input_folder"], name='input folder')
     output_folder = _validate_path(cfg["paths"]["output_folder"], name='output folder')
@@ -93,10 +98,8 @@ def main():
         # ----------------------- subject & entries -----------------------
         subject_id, subject_name = resolve_subject(study_path, cfg, logger=logger)
 
-        # 标注既服务于导出 (entries.convert)，也服务于 H5 嵌入 (pin_entries)
-        need_entries = cfg["entries"]["convert"] or (
-            cfg["data"]["output_format"] == "h5" and cfg["data"]["pin_entries"]
-        )
+        # 标注服务于导出 (entries.convert)、H5 嵌入 (pin_entries) 与按标注锚定的窗口
+        need_entries = needs_entries(cfg)
         entries = list()
         if need_entries:
             try:
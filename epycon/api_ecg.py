@@ -4,13 +4,20 @@ ECG 数据查看器 API 模块
 """
 import os
 import json
+import time
 import uuid
 import base64
+import shutil
+import hashlib
 import tempfile
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from contextlib import contextmanager
 from datetime import datetime
 from functools import lru_cache
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, Response, request, jsonify, send_file
 import numpy as np
 
 from epycon.core import units as units_mod
@@ -36,8 +43,350 @@ ecg_api = Blueprint('ecg_api', __name__, url_prefix='/api/ecg')
 TEMP_DIR = os.path.join(tempfile.gettempdir(), 'epycon_ecg_viewer')
 os.makedirs(TEMP_DIR, exist_ok=True)
 
-# 文件信息缓存
-FILE_CACHE = {}  # file_id -> {path, metadata, ...}
+# 文件信息缓存（FILE_CACHE，file_id -> {path, metadata, annotations, ...}）：按估算字节 LRU
+# + 空闲过期；TEMP_DIR 由后台清理线程按配额回收。环境变量可覆盖
+FILE_CACHE_BYTES = int(float(os.environ.get('EPYCON_FILE_CACHE_MB', '256')) * 1024 * 1024)
+FILE_IDLE_SEC = float(os.environ.get('EPYCON_FILE_IDLE_HOURS', '12')) * 3600
+TEMP_QUOTA_BYTES = int(float(os.environ.get('EPYCON_TEMP_QUOTA_MB', '4096')) * 1024 * 1024)
+JANITOR_INTERVAL_SEC = float(os.environ.get('EPYCON_JANITOR_SEC', '300'))
+EXPORT_IMAGE_TTL_SEC = 3600    # 导出后一直未下载的 PNG 保留时长
+TEMP_GRACE_SEC = 60            # 更新的文件可能正在写入（上传、解压），清理时跳过
+
+# 按时间戳提取的长驻会话（/extract 首次调用时创建，缓存已加载的 study）
+_EXTRACT_SESSION = None
+
+# HDF5 句柄池参数（环境变量可覆盖）：每个句柄的 raw chunk cache 大小、同时打开的
+# 句柄上限（文件描述符）与空闲关闭时间
+H5_RDCC_NBYTES = int(float(os.environ.get('EPYCON_H5_RDCC_MB', '64')) * 1024 * 1024)
+H5_RDCC_NSLOTS = 10007  # 质数；远大于缓存可容纳的 chunk 数，降低哈希冲突
+H5_MAX_OPEN_HANDLES = int(os.environ.get('EPYCON_H5_MAX_HANDLES', '16'))
+H5_HANDLE_IDLE_SEC = float(os.environ.get('EPYCON_H5_IDLE_SEC', '300'))
+# 通道子集读取：连续下标段合并为一个 hyperslab；段数超过上限时改读包络段再取列
+H5_MAX_HYPERSLABS = 16
+
+# min/max 多分辨率金字塔（KNOWN_ISSUES #14 第 2 层）：打开文件后后台构建，
+# 落盘为 TEMP_DIR/pyramid/<键>/ 下每层一个 memmap .npy；EPYCON_PYRAMID=0 关闭
+PYRAMID_ENABLED = os.environ.get('EPYCON_PYRAMID', '1') != '0'
+PYRAMID_DIR = os.path.join(TEMP_DIR, 'pyramid')
+PYRAMID_BUCKETS = (64, 512, 4096, 32768, 262144)  # 各层桶宽（样本），相邻层 8 倍
+PYRAMID_CHUNK = PYRAMID_BUCKETS[-1]               # 构建时每次读取的样本数（最粗桶宽）
+PYRAMID_MIN_SAMPLES = PYRAMID_BUCKETS[0] * 8      # 更短的文件原始读取已足够快
+PYRAMID_FORMAT = 1                                # 落盘布局版本，变更即作废旧缓存
+PYRAMID_LTTB_OVERSAMPLE = 4                       # LTTB 取包络点数为 max_points 的倍数，再选点
+
+# .npz 打开时解压一次，落盘为 NPZ_DIR/<键>.npy（连续、可 memmap）+ <键>.json（npz_info）
+NPZ_DIR = os.path.join(TEMP_DIR, 'npz')
+NPZ_DECODE_FORMAT = 1
+
+# 本地 HDF5 的元数据/标注落盘缓存 META_DIR/<键>.json（键 = 真实路径 + size + mtime + 读取器版本），
+# 重新打开免去树遍历与逐字段解析；读取逻辑变更时递增 METADATA_READER_VERSION。EPYCON_META_CACHE=0 关闭。
+# 缓存含患者姓名/ID 与标注：目录 0o700、文件 0o600，仅运行服务的用户可读
+META_CACHE_ENABLED = os.environ.get('EPYCON_META_CACHE', '1') != '0'
+META_DIR = os.path.join(TEMP_DIR, 'meta')
+METADATA_READER_VERSION = 1
+
+# 滤波分块缓存：固定分块 + 两侧重叠填充（填充 = 最慢滤波器时间常数 × FILTER_SETTLE_TAU，
+# e^-12 ≈ 6e-6 的残余边缘瞬态），按字节预算 LRU 淘汰；EPYCON_FILTER_CACHE_MB 可覆盖。
+# 填充从不截短：所需填充超过 FILTER_TILE_MAX_PAD_SEC（如 0.05 Hz 高通约 38 s）时分块
+# 读放大过大，改为对请求窗口连同完整填充直接滤波、不入缓存
+FILTER_TILE_SAMPLES = 16384
+FILTER_SETTLE_TAU = 12.0
+FILTER_TILE_MAX_PAD_SEC = 10.0
+FILTER_CACHE_BYTES = int(float(os.environ.get('EPYCON_FILTER_CACHE_MB', '256')) * 1024 * 1024)
+
+# /data 响应缓存与相邻窗口预取：EPYCON_PREFETCH=0 关闭，EPYCON_RESPONSE_CACHE_MB 为缓存预算
+PREFETCH_ENABLED = os.environ.get('EPYCON_PREFETCH', '1') != '0'
+RESPONSE_CACHE_BYTES = int(float(os.environ.get('EPYCON_RESPONSE_CACHE_MB', '64')) * 1024 * 1024)
+
+
+class _H5Handle:
+    __slots__ = ('path', 'file', 'stamp', 'lock', 'users', 'last_used', 'retired')
+
+    def __init__(self, path, h5file, stamp):
+        self.path = path
+        self.file = h5file
+        self.stamp = stamp          # (mtime_ns, size)：文件被改写即失效
+        self.lock = threading.Lock()
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.retired = False
+
+
+class H5HandlePool:
+    """只读 HDF5 句柄池：按真实路径复用已打开的 h5py.File。
+
+    每帧平移/缩放都重新打开文件会重读超级块、B 树与属性，并丢掉 h5py 的 chunk cache；
+    池内句柄常驻，连续滚动时命中已解压的热 chunk。
+
+    - LRU + 句柄数上限：超限时关闭最久未用且空闲的句柄（全部在用时暂时超限）；
+    - 空闲超时：每次 acquire 顺带关闭空闲超过 idle_sec 的句柄；
+    - 每句柄一把锁：同一文件的读串行化，不同文件互不阻塞；
+    - mtime/size 变化即换新句柄；旧句柄在最后一个使用者释放后关闭。
+    """
+
+    def __init__(self, max_open=H5_MAX_OPEN_HANDLES, idle_sec=H5_HANDLE_IDLE_SEC,
+                 rdcc_nbytes=H5_RDCC_NBYTES, rdcc_nslots=H5_RDCC_NSLOTS):
+        self.max_open = max(1, int(max_open))
+        self.idle_sec = float(idle_sec)
+        self.rdcc_nbytes = int(rdcc_nbytes)
+        self.rdcc_nslots = int(rdcc_nslots)
+        self._handles = OrderedDict()  # realpath -> _H5Handle
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'opens': 0, 'reopens': 0, 'evictions': 0, 'idle_closed': 0}
+
+    def _retire(self, key):
+        handle = self._handles.pop(key)
+        handle.retired = True
+        if handle.users == 0:
+            handle.file.close()
+
+    def _sweep(self, now):
+        for key in [k for k, h in self._handles.items()
+                    if h.users == 0 and now - h.last_used > self.idle_sec]:
+            self._retire(key)
+            self._stats['idle_closed'] += 1
+        while len(self._handles) > self.max_open:
+            idle = next((k for k, h in self._handles.items() if h.users == 0), None)
+            if idle is None:
+                break
+            self._retire(idle)
+            self._stats['evictions'] += 1
+
+    @contextmanager
+    def acquire(self, path):
+        """借出 path 的只读句柄（持有该句柄的锁），用毕自动归还。"""
+        key = os.path.realpath(path)
+        st = os.stat(key)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None and handle.stamp != stamp:
+                self._retire(key)
+                self._stats['reopens'] += 1
+                handle = None
+            if handle is None:
+                h5file = h5py.File(key, 'r', rdcc_nbytes=self.rdcc_nbytes,
+                                   rdcc_nslots=self.rdcc_nslots)
+                handle = self._handles[key] = _H5Handle(key, h5file, stamp)
+                self._stats['opens'] += 1
+            else:
+                self._stats['hits'] += 1
+            self._handles.move_to_end(key)
+            handle.users += 1
+            self._sweep(time.monotonic())
+        try:
+            with handle.lock:
+                yield handle.file
+        finally:
+            with self._lock:
+                handle.users -= 1
+                handle.last_used = time.monotonic()
+                if handle.retired and handle.users == 0:
+                    handle.file.close()
+
+    def close(self, path=None):
+        """关闭 path 的句柄（删除/覆盖文件前调用）；path 为 None 时关闭全部。"""
+        with self._lock:
+            keys = list(self._handles) if path is None else [os.path.realpath(path)]
+            for key in keys:
+                if key in self._handles:
+                    self._retire(key)
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'open': len(self._handles), 'max_open': self.max_open,
+                    'rdcc_nbytes': self.rdcc_nbytes}
+
+
+H5_HANDLES = H5HandlePool()
+
+
+class _Pyramid:
+    """单个文件的 min/max 金字塔：每层 (桶数, 2, 显示通道) float32，[:, 0] 为 min、[:, 1] 为 max。
+
+    `built` 是已覆盖的样本水位线（按 PYRAMID_CHUNK 推进，所有层同步），
+    构建中的金字塔可以服务水位线以内的窗口。
+    """
+
+    def __init__(self, key, directory, num_samples, num_columns):
+        self.key = key
+        self.directory = directory
+        self.num_samples = int(num_samples)
+        self.num_columns = int(num_columns)
+        self.levels = OrderedDict()  # 桶宽 -> memmap，由细到粗
+        self.built = 0
+        self.error = None
+        self.done = threading.Event()
+        self.cancelled = threading.Event()
+        self.thread = None
+
+    def _manifest(self):
+        return {'format': PYRAMID_FORMAT, 'num_samples': self.num_samples,
+                'num_columns': self.num_columns, 'buckets': list(PYRAMID_BUCKETS)}
+
+    def _level_path(self, bucket):
+        return os.path.join(self.directory, f'level_{bucket}.npy')
+
+    def load(self):
+        """已完成的落盘金字塔（清单一致）→ 只读 memmap，返回是否可用。"""
+        try:
+            with open(os.path.join(self.directory, 'manifest.json'), encoding='utf-8') as f:
+                if json.load(f) != self._manifest():
+                    return False
+            for bucket in PYRAMID_BUCKETS:
+                self.levels[bucket] = np.load(self._level_path(bucket), mmap_mode='r')
+        except (OSError, ValueError):
+            self.levels.clear()
+            return False
+        self.built = self.num_samples
+        self.done.set()
+        return True
+
+    def build(self, info):
+        """后台线程入口：逐块读取原始数据，写出各层 min/max，推进水位线。"""
+        try:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory)
+            for bucket in PYRAMID_BUCKETS:
+                shape = (-(-self.num_samples // bucket), 2, self.num_columns)
+                self.levels[bucket] = np.lib.format.open_memmap(
+                    self._level_path(bucket), mode='w+', dtype=np.float32, shape=shape)
+            metadata = info['metadata']
+            for start in range(0, self.num_samples, PYRAMID_CHUNK):
+                if self.cancelled.is_set():
+                    return
+                stop = min(self.num_samples, start + PYRAMID_CHUNK)
+                block = _display_matrix(_read_raw_window(info, start, stop), metadata)
+                mins = maxs = block.astype(np.float32, copy=False)
+                width = 1
+                for bucket, level in self.levels.items():
+                    # 粗层由上一层归并（chunk 对齐最粗桶宽，各层桶边界一致）
+                    edges = np.arange(0, mins.shape[0], bucket // width)
+                    mins = np.minimum.reduceat(mins, edges, axis=0)
+                    maxs = np.maximum.reduceat(maxs, edges, axis=0)
+                    first = start // bucket
+                    level[first:first + mins.shape[0], 0] = mins
+                    level[first:first + maxs.shape[0], 1] = maxs
+                    width = bucket
+                self.built = stop
+            for level in self.levels.values():
+                level.flush()
+            with open(os.path.join(self.directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+                json.dump(self._manifest(), f)
+            logger.info(f"金字塔构建完成: {self.directory}")
+        except Exception as e:
+            self.error = str(e)
+            logger.warning(f"金字塔构建失败（回退原始读取）: {e}")
+        finally:
+            self.done.set()
+
+    def window(self, start_idx, end_idx, columns, max_points):
+        """从最粗的「足够细」的层取 [start_idx, end_idx) 的 min/max，合并到 max_points 以内。
+
+        足够细 = 该层在窗口内的点数不少于 max_points；再把相邻 g 个桶归并成一个，
+        结果与按 `bucket × g` 因子对原始数据做 `minmax_downsample` 相同。
+
+        Returns:
+            (data, factor, first_sample) 或 None（窗口超出水位线 / 窗口太短，最细层也不够）；
+            data 为 (2 × 桶数, len(columns))，min/max 交错。
+        """
+        if self.error is not None or end_idx > self.built or end_idx <= start_idx:
+            return None
+        for bucket, level in reversed(self.levels.items()):
+            first = start_idx // bucket
+            last = -(-end_idx // bucket)
+            if 2 * (last - first) < max_points:
+                continue
+            tile = np.asarray(level[first:last][:, :, columns])
+            group = -(-2 * (last - first) // max(2, max_points - 2))
+            edges = np.arange(0, tile.shape[0], group)
+            out = np.empty((len(edges), 2, len(columns)), dtype=tile.dtype)
+            out[:, 0] = np.minimum.reduceat(tile[:, 0], edges, axis=0)
+            out[:, 1] = np.maximum.reduceat(tile[:, 1], edges, axis=0)
+            return out.reshape(-1, len(columns)), bucket * group, first * bucket
+        return None
+
+
+class PyramidCache:
+    """按 (真实路径, mtime, size) 管理后台金字塔；同一文件多次打开共享一份。"""
+
+    def __init__(self, root=PYRAMID_DIR):
+        self.root = root
+        self._items = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path):
+        real = os.path.realpath(path)
+        st = os.stat(real)
+        raw = f"{real}|{st.st_mtime_ns}|{st.st_size}|{PYRAMID_FORMAT}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+
+    def ensure(self, info):
+        """打开文件后调用：已有完整落盘金字塔则直接加载，否则启动后台构建。"""
+        metadata = info['metadata']
+        num_samples = int(metadata.get('num_samples', 0))
+        if not PYRAMID_ENABLED or num_samples < PYRAMID_MIN_SAMPLES:
+            return None
+        key = self._key(info['path'])
+        with self._lock:
+            pyramid = self._items.get(key)
+            if pyramid is not None:
+                return pyramid
+            num_columns = metadata.get('display_num_channels', metadata['num_channels'])
+            pyramid = _Pyramid(key, os.path.join(self.root, key), num_samples, num_columns)
+            self._items[key] = pyramid
+            if not pyramid.load():
+                pyramid.thread = threading.Thread(
+                    target=pyramid.build, args=(info,), name=f'pyramid-{key}', daemon=True)
+                pyramid.thread.start()
+        return pyramid
+
+    def get(self, path):
+        """当前文件版本对应的金字塔（mtime/size 变了即视为没有）。"""
+        try:
+            key = self._key(path)
+        except OSError:
+            return None
+        with self._lock:
+            return self._items.get(key)
+
+    def close(self, path=None, remove=False):
+        """停止构建并释放 memmap；remove=True 时连落盘文件一起删除（上传的临时文件）。"""
+        with self._lock:
+            if path is None:
+                keys = list(self._items)
+            else:
+                try:
+                    keys = [self._key(path)]
+                except OSError:
+                    return
+            pyramids = [self._items.pop(k) for k in keys if k in self._items]
+        for pyramid in pyramids:
+            pyramid.cancelled.set()
+            if pyramid.thread is not None:
+                pyramid.thread.join()
+            pyramid.levels.clear()
+            if remove or pyramid.error is not None or pyramid.built < pyramid.num_samples:
+                shutil.rmtree(pyramid.directory, ignore_errors=True)
+
+    def directories(self):
+        """当前在用的金字塔目录（TEMP_DIR 清理时跳过）。"""
+        with self._lock:
+            return [p.directory for p in self._items.values()]
+
+    def stats(self):
+        with self._lock:
+            pyramids = list(self._items.values())
+        return {
+            'count': len(pyramids),
+            'building': sum(1 for p in pyramids if not p.done.is_set()),
+            'failed': sum(1 for p in pyramids if p.error is not None),
+            'bytes': sum(level.nbytes for p in pyramids for level in list(p.levels.values())),
+        }
+
+
+PYRAMIDS = PyramidCache()
 
 
 def _convert_numpy_types(obj):
@@ -68,22 +417,52 @@ def _iirnotch_coeffs(freq, q, fs):
 
 
 @lru_cache(maxsize=64)
-def _butter_coeffs(order, normal_cutoff, btype):
-    """Butterworth 系数缓存"""
-    return scipy_signal.butter(order, normal_cutoff, btype=btype, analog=False)
+def _butter_sos(order, normal_cutoff, btype):
+    """Butterworth 二阶节（SOS）系数缓存：低截止高通下比 (b, a) 形式数值稳定"""
+    return scipy_signal.butter(order, normal_cutoff, btype=btype, analog=False, output='sos')
+
+
+@lru_cache(maxsize=64)
+def _filter_cascade(fs, notch_freq, q, enhanced, lp_cutoff, hp_cutoff, method):
+    """
+    整条滤波链（陷波谐波 → 低通 → 高通）合成一个 SOS 级联，按参数缓存
 
+    各级参数与 apply_notch_filter / apply_lowpass_filter / apply_highpass_filter 的默认值一致：
+    增强陷波 = 50/100/150 Hz 各两节，低通 1 阶，高通因果 1 阶、零相位 2 阶；
+    超出奈奎斯特频率的级跳过。一次 sosfiltfilt/sosfilt 遍历代替逐级 filtfilt。
 
-def _apply_iir(b, a, data, method):
-    """对 1D/2D 数据整体应用 IIR 滤波（2D 沿 axis=0 向量化，免逐通道 Python 循环）"""
+    Returns:
+        (sos, zi)：zi 为单位阶跃稳态初值（causal 时乘首样本）；没有任何有效级时为 (None, None)
+    """
+    sections = []
+    nyq = 0.5 * fs
+    if notch_freq:
+        passes = 2 if enhanced else 1
+        for k in ([1, 2, 3] if enhanced else [1]):
+            if notch_freq * k >= nyq:
+                continue  # 超过奈奎斯特频率
+            b, a = _iirnotch_coeffs(float(notch_freq * k), float(q), float(fs))
+            sections.extend([scipy_signal.tf2sos(b, a)] * passes)
+    if lp_cutoff and lp_cutoff / nyq < 1.0:
+        sections.append(_butter_sos(1, float(lp_cutoff / nyq), 'low'))
+    if hp_cutoff and 0 < hp_cutoff / nyq < 1.0:
+        sections.append(_butter_sos(1 if method == 'causal' else 2, float(hp_cutoff / nyq), 'high'))
+    if not sections:
+        return None, None
+    sos = np.vstack(sections)
+    return sos, scipy_signal.sosfilt_zi(sos)
+
+
+def _apply_sos(sos, data, method, zi=None):
+    """对 1D/2D 数据整体应用 SOS 级联（2D 沿 axis=0），float32 输入保持 float32 输出"""
     if method == 'causal':
-        zi = scipy_signal.lfilter_zi(b, a)
-        if data.ndim == 1:
-            filtered, _ = scipy_signal.lfilter(b, a, data, zi=zi * data[0])
-        else:
-            filtered, _ = scipy_signal.lfilter(b, a, data, axis=0, zi=zi[:, np.newaxis] * data[0])
-        return filtered
-    axis = 0 if data.ndim > 1 else -1
-    return scipy_signal.filtfilt(b, a, data, axis=axis)
+        if zi is None:
+            zi = scipy_signal.sosfilt_zi(sos)
+        zi = zi * data[0] if data.ndim == 1 else zi[:, :, np.newaxis] * data[0]
+        filtered, _ = scipy_signal.sosfilt(sos, data, axis=0, zi=zi)
+    else:
+        filtered = scipy_signal.sosfiltfilt(sos, data, axis=0)
+    return filtered.astype(data.dtype, copy=False) if data.dtype == np.float32 else filtered
 
 
 def apply_notch_filter(data, fs, freq=50.0, q=35.0, method='zero_phase', enhanced=False):
@@ -111,26 +490,10 @@ def apply_notch_filter(data, fs, freq=50.0, q=35.0, method='zero_phase', enhance
         logger.warning("scipy 不可用，跳过滤波")
         return data, False
 
-    # 根据模式决定处理的频率列表
-    if enhanced:
-        harmonics = [1, 2, 3]  # 增强模式：基频 + 2/3次谐波
-    else:
-        harmonics = [1]       # 标准模式：仅基频
-
-    current_data = data
-
-    for k in harmonics:
-        target_freq = freq * k
-        if target_freq >= fs / 2:
-            continue  # 超过奈奎斯特频率
-
-        # 设计单级陷波滤波器（系数按参数缓存）
-        b, a = _iirnotch_coeffs(float(target_freq), float(q), float(fs))
-
-        # 增强模式双重级联；1D/2D 统一向量化应用
-        passes = 2 if enhanced else 1
-        for _ in range(passes):
-            current_data = _apply_iir(b, a, current_data, method)
+    # 增强模式：基频 + 2/3次谐波，各两节级联；整条级联按参数缓存，一次遍历
+    harmonics = [1, 2, 3] if enhanced else [1]
+    sos, zi = _filter_cascade(float(fs), float(freq), float(q), bool(enhanced), None, None, method)
+    current_data = data if sos is None else _apply_sos(sos, data, method, zi)
 
     mode_str = "ActiveNotch™ Enhanced" if enhanced else "Standard Scipy"
     logger.info(f"{mode_str} 完成 ({method}): Freq={freq}Hz, Harmonics={harmonics}, fs={fs}Hz")
@@ -166,9 +529,8 @@ def apply_lowpass_filter(data, fs, cutoff=35.0, order=None, method='zero_phase')
     if normal_cutoff >= 1.0:
         return data
 
-    # 设计滤波器（系数按参数缓存），1D/2D 统一向量化应用
-    b, a = _butter_coeffs(int(order), float(normal_cutoff), 'low')
-    return _apply_iir(b, a, data, method)
+    # 设计滤波器（SOS 系数按参数缓存），1D/2D 统一向量化应用
+    return _apply_sos(_butter_sos(int(order), float(normal_cutoff), 'low'), data, method)
 
 
 def apply_highpass_filter(data, fs, cutoff=0.5, order=None, method='zero_phase'):
@@ -189,9 +551,8 @@ def apply_highpass_filter(data, fs, cutoff=0.5, order=None, method='zero_phase')
     if normal_cutoff <= 0 or normal_cutoff >= 1.0:
         return data
 
-    # 设计滤波器（系数按参数缓存），1D/2D 统一向量化应用
-    b, a = _butter_coeffs(int(order), float(normal_cutoff), 'high')
-    return _apply_iir(b, a, data, method)
+    # 设计滤波器（SOS 系数按参数缓存），1D/2D 统一向量化应用
+    return _apply_sos(_butter_sos(int(order), float(normal_cutoff), 'high'), data, method)
 
 
 def minmax_downsample(data, factor):
@@ -244,6 +605,89 @@ def minmax_downsample(data, factor):
     return result
 
 
+def lttb_indices(data, n_out):
+    """
+    LTTB（Largest Triangle Three Buckets）选点：逐通道独立选点，跨通道向量化
+
+    首末样本固定保留，中间 n_out-2 个桶各选一个与「上一选中点、下一桶均值」
+    构成三角形面积最大的样本。桶间存在顺序依赖（上一选中点），因此按桶循环，
+    每步在 (桶长, 通道) 上整体求 argmax——循环次数只与 n_out 有关，与窗口长度无关。
+
+    Args:
+        data: 2D numpy array, shape (samples, channels)
+        n_out: 每通道输出点数 (>= 3)
+
+    Returns:
+        选中样本下标，shape (n_out, channels)，每列升序
+    """
+    n_samples, n_channels = data.shape
+    if n_out >= n_samples or n_out < 3:
+        return np.repeat(np.arange(n_samples)[:, np.newaxis], n_channels, axis=1)
+
+    y = np.asarray(data, dtype=np.float64)
+    edges = np.linspace(1, n_samples - 1, n_out - 1).astype(np.int64)
+    # 下一桶均值（最后一个桶的「下一桶」是末样本）
+    sums = np.add.reduceat(y[1:n_samples - 1], edges[:-1] - 1, axis=0)
+    counts = np.diff(edges)[:, np.newaxis]
+    avg_y = np.vstack([sums / counts, y[-1:]])
+    avg_x = np.append((edges[:-1] + edges[1:] - 1) / 2.0, n_samples - 1)
+
+    selected = np.empty((n_out, n_channels), dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n_samples - 1
+    cols = np.arange(n_channels)
+    a_x = np.zeros(n_channels)
+    a_y = y[0].copy()
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        c_x, c_y = avg_x[b + 1], avg_y[b + 1]
+        x = np.arange(lo, hi, dtype=np.float64)[:, np.newaxis]
+        area = np.abs((a_x - c_x) * (y[lo:hi] - a_y) - (a_x - x) * (c_y - a_y))
+        pick = lo + area.argmax(axis=0)
+        selected[b + 1] = pick
+        a_x = pick.astype(np.float64)
+        a_y = y[pick, cols]
+    return selected
+
+
+def decimate_to_points(data, max_points, method='minmax'):
+    """
+    按目标点数自动降采样（像素感知）：输出点数以 max_points 为上界，与窗口长度无关
+
+    Args:
+        data: 2D numpy array, shape (samples, channels)
+        max_points: 每通道最多输出的点数（屏幕宽度 × 密度）
+        method: 'minmax'（峰值保留）或 'lttb'（视觉保形）
+
+    Returns:
+        (decimated, sample_index, factor)
+        - minmax: sample_index 为 None，factor 为等效 downsample 因子（时间轴等距重建）
+        - lttb: sample_index 为 (points, channels) 的窗口内样本下标，factor 为 1
+        - 样本数不超过 max_points 时原样返回 (data, None, 1)
+    """
+    n_samples = data.shape[0]
+    if n_samples <= max_points:
+        return data, None, 1
+    if method == 'lttb':
+        index = lttb_indices(data, max_points)
+        return np.take_along_axis(data, index, axis=0), index, 1
+    # 每窗口输出 min+max 两点，余数再占两点：留出余量保证总数 <= max_points
+    factor = -(-2 * n_samples // max(2, max_points - 2))
+    return minmax_downsample(data, factor), None, factor
+
+
+def _envelope_lttb(envelope, factor, max_points):
+    """
+    在金字塔的 min/max 包络上做 LTTB：返回 (data, sample_index)
+
+    包络第 i 行取所在桶前/后半的位置（i × factor / 2，与 minmax 时间轴重建一致），
+    sample_index 为相对包络首桶起点的样本下标，形状同 `decimate_to_points` 的 LTTB 结果。
+    """
+    positions = np.arange(envelope.shape[0], dtype=np.int64) * factor // 2
+    index = lttb_indices(envelope, max_points)
+    return np.take_along_axis(envelope, index, axis=0), positions[index]
+
+
 def _build_computed_leads(metadata):
     """
     自动识别 u+X 和 u-X 电极配对，生成计算导联映射。
@@ -672,6 +1116,55 @@ def load_npz(npz_file):
     return npz_file[keys[0]], None
 
 
+def _decode_npz(path):
+    """
+    .npz → (memmap 的波形矩阵, npz_info, 解压文件路径)，每个文件版本只解压一次
+
+    npz 成员是压缩/分散存储的，无法按窗口切片；此前每次 /data 都整包 `load_npz`。
+    这里把 `load_npz` 的结果写成连续 .npy（键同金字塔：真实路径 + mtime + size），
+    之后的打开与每次读取只对 memmap 切片，开销随窗口而非文件大小增长。
+    空波形不落盘，解压文件路径返回 None。
+    """
+    real = os.path.realpath(path)
+    st = os.stat(real)
+    raw = f"{real}|{st.st_mtime_ns}|{st.st_size}|{NPZ_DECODE_FORMAT}"
+    key = hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+    data_file = os.path.join(NPZ_DIR, f'{key}.npy')
+    info_file = os.path.join(NPZ_DIR, f'{key}.json')
+    if not (os.path.exists(info_file) and os.path.exists(data_file)):
+        with np.load(real) as npz_file:
+            data, npz_info = load_npz(npz_file)
+        if data.size == 0:
+            return data, npz_info, None
+        os.makedirs(NPZ_DIR, exist_ok=True)
+        # 先写临时文件再改名：并发打开或中途失败都不会留下半截缓存
+        suffix = f'.{uuid.uuid4().hex[:8]}.tmp'
+        with open(info_file + suffix, 'w', encoding='utf-8') as f:
+            json.dump(npz_info, f, ensure_ascii=False)
+        with open(data_file + suffix, 'wb') as f:
+            np.save(f, np.ascontiguousarray(data))
+        os.replace(info_file + suffix, info_file)
+        os.replace(data_file + suffix, data_file)
+        logger.info(f"npz 已解压缓存: {path} -> {data_file}")
+    with open(info_file, encoding='utf-8') as f:
+        npz_info = json.load(f)
+    return np.load(data_file, mmap_mode='r'), npz_info, data_file
+
+
+def _remove_decoded(info):
+    """删除上传文件的 npz 解压缓存（本地文件的留在磁盘供下次打开复用）。"""
+    data_file = info.get('data_file')
+    if not data_file or info.get('is_local', False):
+        return
+    if any(other.get('data_file') == data_file for other in FILE_CACHE.values()):
+        return
+    for stale in (data_file, os.path.splitext(data_file)[0] + '.json'):
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+
+
 def _extract_npy_metadata(data, filename, npz_info=None):
     """从 NumPy 数组中提取元数据。
 
@@ -728,8 +1221,98 @@ def _extract_npy_metadata(data, filename, npz_info=None):
     return _convert_numpy_types(metadata)
 
 
+class AnnotationIndex:
+    """
+    标注的列式索引：按采样点排序的时间列 + 标签编码，区间查询走 `np.searchsorted`
+
+    rows 为按采样点稳定排序后的原标注字典（响应载荷）；labels 为去重后的标签，
+    codes 为每行的标签编码；by_label 为每个标签的行号（升序），按标签筛选时
+    只在该标签的行号上二分，不扫描其它标注。
+    """
+
+    def __init__(self, annotations, fs):
+        samples = np.array([a.get('sample', a.get('position', 0)) for a in annotations],
+                           dtype=np.float64)
+        order = np.argsort(samples, kind='stable')
+        self.rows = [annotations[i] for i in order]
+        self.times = samples[order] / fs if fs > 0 else np.zeros(len(order))
+        labels = [str(a.get('label', '')) for a in self.rows]
+        if labels:
+            unique, codes = np.unique(np.array(labels), return_inverse=True)
+            self.labels = unique.tolist()
+            self.codes = codes.reshape(-1).astype(np.int32)
+        else:
+            self.labels, self.codes = [], np.empty(0, dtype=np.int32)
+        by_code = np.argsort(self.codes, kind='stable')
+        bounds = np.searchsorted(self.codes[by_code], np.arange(len(self.labels) + 1))
+        self.by_label = {label: by_code[bounds[k]:bounds[k + 1]] for k, label in enumerate(self.labels)}
+
+    def nbytes(self):
+        """索引自身的内存估算：各数组 + rows 的引用表 + 标签字符串（行字典与标注共享，不重复计）。"""
+        arrays = [self.times, self.codes, *self.by_label.values()]
+        return (sum(a.nbytes for a in arrays) + 8 * len(self.rows)
+                + sum(len(label) + 64 for label in self.labels))
+
+    def query(self, start_sec=None, end_sec=None, label=None):
+        """
+        时间闭区间 [start_sec, end_sec] 内（可按 label 筛选）的行号，以及该区间按标签的计数
+
+        Returns:
+            (positions, counts)：positions 为升序行号数组；counts 为 {label: 数量}，
+            统计区间内全部标注（不受 label 筛选影响，供前端构建筛选项）
+        """
+        lo = 0 if start_sec is None else int(np.searchsorted(self.times, start_sec, side='left'))
+        hi = len(self.rows) if end_sec is None else int(np.searchsorted(self.times, end_sec, side='right'))
+        hi = max(lo, hi)
+        if label is None:
+            positions = np.arange(lo, hi)
+        else:
+            rows = self.by_label.get(label, np.empty(0, dtype=np.int64))
+            positions = rows[np.searchsorted(rows, lo):np.searchsorted(rows, hi)]
+        counts = np.bincount(self.codes[lo:hi], minlength=len(self.labels))
+        return positions, {self.labels[k]: int(c) for k, c in enumerate(counts) if c}
+
+    def records(self, positions):
+        """行号 → 响应记录（附 time_sec）。"""
+        return [{**self.rows[i], 'time_sec': float(self.times[i])} for i in positions.tolist()]
+
+
+def _annotation_index(file_id, info):
+    """FILE_CACHE 条目的标注索引：首次查询时构建并挂在条目上，随即重估该条目的占用。"""
+    index = info.get('annotation_index')
+    if index is None:
+        index = AnnotationIndex(info['annotations'], info['metadata']['sampling_freq'])
+        info['annotation_index'] = index
+        FILE_CACHE.refresh(file_id)
+    return index
+
+
+def _decode_column(values):
+    """标注的一列 → Python 原生值列表；定长字节串整列解码，不逐行判断类型。"""
+    values = np.asarray(values)
+    if values.dtype.kind == 'S':
+        return np.char.decode(values, 'utf-8', errors='replace').tolist()
+    if values.dtype.kind == 'O':
+        return [v.decode('utf-8', errors='replace') if isinstance(v, bytes) else v
+                for v in values.tolist()]
+    return values.tolist()
+
+
+def _marks_labels(info_values, group_values):
+    """Epycon Marks 的 label：Info 非空且不只是 0/1 时用 Info（去首尾空白），否则用 Group。"""
+    labels = []
+    for info_val, group in zip(info_values, group_values):
+        text = info_val.strip() if isinstance(info_val, str) else str(info_val)
+        labels.append(text if text and text not in ('0', '1') else group)
+    return labels
+
+
 def _extract_annotations(h5file, annot_path):
-    """提取标注数据"""
+    """
+    提取标注数据
+
+    按列读取、整列解码后再拼成逐行字典（查询时由 `AnnotationIndex` 建列式索引）。
+    """
     annotations = []
 
     if not annot_path or annot_path not in h5file:
@@ -743,42 +1326,30 @@ def _extract_annotations(h5file, annot_path):
 
             # 处理结构化数组
             if data.dtype.names:
-                logger.info(f"标注数据集字段: {data.dtype.names}")
-                for i, row in enumerate(data):
-                    annot = {'index': i}
-                    for name in data.dtype.names:
-                        val = row[name]
-                        if isinstance(val, bytes):
-                            val = val.decode('utf-8', errors='replace')
-                        elif isinstance(val, np.ndarray):
-                            val = val.tolist()
-                        annot[name] = val
-
-                    # 兼容 Epycon 的 Marks 格式：使用 SampleLeft 和 SampleRight 的中点
-                    if 'SampleLeft' in annot:
-                        left = annot['SampleLeft']
-                        right = annot.get('SampleRight', left)  # 如果没有 SampleRight，使用 SampleLeft
-                        annot['sample'] = (left + right) // 2  # 使用中点
-                    if 'Group' in annot:
-                        annot['group'] = annot['Group']
-                    if 'Info' in annot:
-                        annot['message'] = annot['Info']
-                        # label 优先使用 Info 内容，如果 Info 为空或只有数字则使用 Group
-                        info_val = annot['Info'].strip() if isinstance(annot['Info'], str) else str(annot['Info'])
-                        if info_val and info_val not in ('0', '1', ''):
-                            annot['label'] = info_val
-                        else:
-                            annot['label'] = annot.get('Group', 'Mark')
-
-                    annotations.append(annot)
+                names = data.dtype.names
+                logger.info(f"标注数据集字段: {names}")
+                columns = {name: _decode_column(data[name]) for name in names}
+                extra = {}
+                # 兼容 Epycon 的 Marks 格式：使用 SampleLeft 和 SampleRight 的中点
+                # （如果没有 SampleRight，使用 SampleLeft）；int64 相加避免无符号溢出
+                if 'SampleLeft' in names:
+                    left = data['SampleLeft'].astype(np.int64)
+                    right = data['SampleRight'].astype(np.int64) if 'SampleRight' in names else left
+                    extra['sample'] = ((left + right) // 2).tolist()
+                if 'Group' in names:
+                    extra['group'] = columns['Group']
+                if 'Info' in names:
+                    extra['message'] = columns['Info']
+                    # label 优先使用 Info 内容，如果 Info 为空或只有数字则使用 Group
+                    extra['label'] = _marks_labels(
+                        columns['Info'], columns.get('Group', ['Mark'] * len(data)))
+                keys = ('index',) + names + tuple(extra)
+                annotations = [dict(zip(keys, row)) for row in zip(
+                    range(len(data)), *columns.values(), *extra.values())]
             else:
                 # 简单数组，可能是采样点索引
-                for i, val in enumerate(data):
-                    annotations.append({
-                        'index': i,
-                        'sample': int(val),
-                        'label': f'Mark {i + 1}'
-                    })
+                annotations = [{'index': i, 'sample': int(val), 'label': f'Mark {i + 1}'}
+                               for i, val in enumerate(np.asarray(data).astype(np.int64).tolist())]
         except Exception as e:
             logger.warning(f"读取标注失败: {e}")
 
@@ -790,21 +1361,12 @@ def _extract_annotations(h5file, annot_path):
             messages = obj.get('message', obj.get('text', obj.get('description', None)))
 
             if samples is not None:
-                samples_data = samples[:]
-                labels_data = labels[:] if labels else ['' for _ in samples_data]
-                messages_data = messages[:] if messages else ['' for _ in samples_data]
-
-                for i, (s, lab, m) in enumerate(zip(samples_data, labels_data, messages_data)):
-                    if isinstance(lab, bytes):
-                        lab = lab.decode('utf-8', errors='replace')
-                    if isinstance(m, bytes):
-                        m = m.decode('utf-8', errors='replace')
-                    annotations.append({
-                        'index': i,
-                        'sample': int(s),
-                        'label': str(lab),
-                        'message': str(m)
-                    })
+                samples_data = np.asarray(samples[:]).astype(np.int64).tolist()
+                labels_data = _decode_column(labels[:]) if labels else [''] * len(samples_data)
+                messages_data = _decode_column(messages[:]) if messages else [''] * len(samples_data)
+
+                annotations = [{'index': i, 'sample': s, 'label': str(lab), 'message': str(m)}
+                               for i, (s, lab, m) in enumerate(zip(samples_data, labels_data, messages_data))]
         except Exception as e:
             logger.warning(f"读取标注组失败: {e}")
 
@@ -812,6 +1374,50 @@ def _extract_annotations(h5file, annot_path):
     return _convert_numpy_types(annotations)
 
 
+def _read_h5_info(file_path):
+    """
+    HDF5 → (data_path, annot_path, metadata, annotations)，优先取磁盘缓存
+
+    缓存命中时不打开文件；文件被改写（size/mtime 变化）或读取器升级后键变化，
+    旧缓存自然失效（由 TEMP_DIR 清理线程回收）。无法 JSON 序列化的结果不缓存。
+    缓存含患者标识，目录与文件只对当前用户开放（0o700 / 0o600）。
+    """
+    real = os.path.realpath(file_path)
+    st = os.stat(real)
+    raw = f"{real}|{st.st_size}|{st.st_mtime_ns}|{METADATA_READER_VERSION}"
+    cache_file = os.path.join(META_DIR, hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20] + '.json')
+    if META_CACHE_ENABLED:
+        try:
+            with open(cache_file, encoding='utf-8') as f:
+                cached = json.load(f)
+            return cached['data_path'], cached['annot_path'], cached['metadata'], cached['annotations']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    with h5py.File(file_path, 'r') as h5f:
+        data_path = _get_dataset_path(h5f)
+        annot_path = _get_annotations_path(h5f)
+        metadata = _extract_metadata(h5f, data_path)
+        annotations = _extract_annotations(h5f, annot_path)
+
+    if META_CACHE_ENABLED:
+        entry = {'data_path': data_path, 'annot_path': annot_path,
+                 'metadata': metadata, 'annotations': annotations}
+        tmp = f'{cache_file}.{uuid.uuid4().hex[:8]}.tmp'
+        try:
+            os.makedirs(META_DIR, mode=0o700, exist_ok=True)
+            os.chmod(META_DIR, 0o700)  # 已存在或受 umask 影响时 makedirs 不保证权限
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp, cache_file)
+        except (OSError, TypeError, ValueError) as e:
+            logger.debug(f"元数据缓存写入失败 {file_path}: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return data_path, annot_path, metadata, annotations
+
+
 @ecg_api.route('/check', methods=['GET'])
 def check_availability():
     """检查 API 可用性和依赖状态"""
@@ -819,10 +1425,33 @@ def check_availability():
         'available': True,
         'h5py_available': H5PY_AVAILABLE,
         'temp_dir': TEMP_DIR,
-        'cached_files': len(FILE_CACHE)
+        'cached_files': len(FILE_CACHE),
+        'file_cache': FILE_CACHE.stats(),
+        'temp_dir_janitor': JANITOR.stats(),
+        'h5_handles': H5_HANDLES.stats(),
+        'pyramids': PYRAMIDS.stats(),
+        'filter_tiles': FILTER_TILES.stats(),
+        'prefetch': PREFETCHER.stats(),
     })
 
 
+@ecg_api.route('/extract', methods=['POST'])
+def extract_waveforms():
+    """
+    按时间戳提取导联波形（与 `python -m epycon.cli.extract --serve` 同一请求/响应格式）
+    study 在进程内缓存，重复查询免去重新解析段头与 entries.log
+    """
+    global _EXTRACT_SESSION
+    from epycon.cli.extract import handle_request
+    from epycon.extraction import ExtractionSession
+
+    if _EXTRACT_SESSION is None:
+        _EXTRACT_SESSION = ExtractionSession()
+    # allow_out 保持默认 False：HTTP 客户端不得让服务端写任意路径
+    response = handle_request(_EXTRACT_SESSION, request.get_json(silent=True))
+    return jsonify(response), (400 if 'error' in response else 200)
+
+
 @ecg_api.route('/browse', methods=['GET'])
 def browse_file():
     """
@@ -890,11 +1519,11 @@ def open_local_file():
         # 根据文件类型处理
         if ext in supported_npy:
             # 处理 NumPy 文件
-            npz_info = None
+            npz_info = data_file = None
             if ext == '.npy':
                 data = np.load(file_path, mmap_mode='r')  # 使用 mmap 避免全量加载
-            else:  # .npz
-                data, npz_info = load_npz(np.load(file_path))
+            else:  # .npz：解压一次，之后按 memmap 切片
+                data, npz_info, data_file = _decode_npz(file_path)
 
             metadata = _extract_npy_metadata(data, os.path.basename(file_path), npz_info)
             annotations = []
@@ -902,28 +1531,29 @@ def open_local_file():
             annot_path = None
             file_type = 'npy'
         else:
-            # HDF5
-            with h5py.File(file_path, 'r') as h5f:
-                data_path = _get_dataset_path(h5f)
-                annot_path = _get_annotations_path(h5f)
-                metadata = _extract_metadata(h5f, data_path)
-                annotations = _extract_annotations(h5f, annot_path)
+            # HDF5（重新打开走元数据磁盘缓存）
+            data_path, annot_path, metadata, annotations = _read_h5_info(file_path)
             file_type = 'hdf5'
+            data_file = None
 
         # 缓存文件信息（标记为 local，清理时不删除文件）
-        FILE_CACHE[file_id] = {
+        info = {
             'path': file_path,
             'is_local': True,
             'filename': os.path.basename(file_path),
             'file_type': file_type,
+            'data_file': data_file,
             'data_path': data_path,
             'annot_path': annot_path,
             'metadata': metadata,
             'annotations': annotations,
             'upload_time': datetime.now().isoformat()
         }
+        FILE_CACHE[file_id] = info
 
         logger.info(f"本地文件已打开: {file_id} -> {file_path}")
+        PYRAMIDS.ensure(info)
+        JANITOR.start()
 
         return jsonify({
             'file_id': file_id,
@@ -973,11 +1603,11 @@ def upload_file():
         # 根据文件类型处理
         if ext in supported_npy:
             # 处理 NumPy 文件
-            npz_info = None
+            npz_info = data_file = None
             if ext == '.npy':
-                data = np.load(save_path)
+                data = np.load(save_path, mmap_mode='r')
             else:  # .npz
-                data, npz_info = load_npz(np.load(save_path))
+                data, npz_info, data_file = _decode_npz(save_path)
 
             # 提取元数据
             metadata = _extract_npy_metadata(data, file.filename, npz_info)
@@ -1002,20 +1632,25 @@ def upload_file():
                 metadata = _extract_metadata(h5f, data_path)
                 annotations = _extract_annotations(h5f, annot_path)
             file_type = 'hdf5'
+            data_file = None
 
         # 缓存文件信息
-        FILE_CACHE[file_id] = {
+        info = {
             'path': save_path,
             'filename': file.filename,
             'file_type': file_type,
+            'data_file': data_file,
             'data_path': data_path,
             'annot_path': annot_path,
             'metadata': metadata,
             'annotations': annotations,
             'upload_time': datetime.now().isoformat()
         }
+        FILE_CACHE[file_id] = info
 
         logger.info(f"文件上传成功: {file_id} -> {file.filename}")
+        PYRAMIDS.ensure(info)
+        JANITOR.start()
 
         return jsonify({
             'file_id': file_id,
@@ -1046,6 +1681,896 @@ def get_metadata(file_id):
     })
 
 
+BINARY_MIMETYPE = 'application/octet-stream'
+
+# max_points 像素感知降采样（/data?max_points=&decimate=）
+DECIMATION_METHODS = ('minmax', 'lttb')
+MIN_MAX_POINTS = 4
+
+
+def _binary_response(payload, data, sample_index=None):
+    """二进制波形响应：JSON 元数据前导 + 小端 float32 通道优先样本。
+
+    布局：uint32 LE 前导长度 n | n 字节 UTF-8 JSON（空格补齐，使样本从 4 字节边界开始）|
+    float32 LE，通道优先（channel0 全部样本，channel1 ...）。前端可直接
+    `new Float32Array(buffer, 4 + n)` 按通道切 subarray，免去 JSON 数字解析。
+    LTTB 降采样时样本块之后再跟同形状的 int32 LE 窗口内样本下标（前导 `index_dtype`）。
+    """
+    samples = np.ascontiguousarray(np.asarray(data, dtype='<f4').T)
+    meta = {**payload, 'layout': 'channel_major', 'dtype': 'float32',
+            'num_channels': samples.shape[0]}
+    blocks = [samples.tobytes()]
+    if sample_index is not None:
+        meta['index_dtype'] = 'int32'
+        blocks.append(np.ascontiguousarray(np.asarray(sample_index, dtype='<i4').T).tobytes())
+    header = json.dumps(_convert_numpy_types(meta), ensure_ascii=False).encode('utf-8')
+    header += b' ' * (-(4 + len(header)) % 4)
+    body = len(header).to_bytes(4, 'little') + header + b''.join(blocks)
+    return Response(body, mimetype=BINARY_MIMETYPE,
+                    headers={'X-ECG-Header-Length': str(len(header))})
+
+
+def _filter_spec(notch_freq=None, enhanced_notch=False, lp_cutoff=None, hp_cutoff=None,
+                 filter_method='zero_phase', channel_filters=None):
+    """/data 的滤波参数 → 规格字典（`_filter_window` 的输入，也是滤波分块缓存键的一部分）。"""
+    return {'notch': notch_freq, 'enhanced_notch': bool(enhanced_notch), 'lp': lp_cutoff,
+            'hp': hp_cutoff, 'method': filter_method, 'channel_filters': channel_filters or {}}
+
+
+def _has_filters(spec):
+    return bool(spec['notch'] or spec['lp'] or spec['hp'] or spec['channel_filters'])
+
+
+def _output_channel_names(metadata, display_channels):
+    """请求的显示通道索引 → 输出通道名（越界的计算模式通道记为 ChN）。"""
+    display_channel_names = metadata.get('display_channel_names', metadata['channel_names'])
+    if metadata.get('is_computed_mode') and metadata.get('computed_leads'):
+        return [display_channel_names[c] if c < len(display_channel_names) else f"Ch{c + 1}"
+                for c in display_channels]
+    return [display_channel_names[c] for c in display_channels if c < len(display_channel_names)]
+
+
+def _filter_window(raw_data, metadata, display_channels, fs, spec, source=None):
+    """
+    在原始采样率上完成全部滤波，并把原始通道映射为请求的显示通道
+
+    Args:
+        raw_data: 原始通道 (samples, channels)；给出 source 时只含这些通道的列
+        metadata: 文件元数据（计算导联配对）
+        display_channels: 显示通道索引列表
+        fs: 采样频率 (Hz)
+        spec: `_filter_spec` 规格
+        source: raw_data 各列对应的原始通道下标（`_source_channels`），None 表示全部通道
+
+    Returns:
+        (samples, len(display_channels)) 的滤波结果
+    """
+    notch_freq, enhanced_notch = spec['notch'], spec['enhanced_notch']
+    lp_cutoff, hp_cutoff = spec['lp'], spec['hp']
+    filter_method, channel_filters = spec['method'], spec['channel_filters']
+    is_computed_mode = metadata.get('is_computed_mode', False)
+    computed_leads = metadata.get('computed_leads', [])
+    other_channel_indices = metadata.get('other_channel_indices', [])
+    display_channel_names = metadata.get('display_channel_names', metadata['channel_names'])
+    position = {idx: col for col, idx in enumerate(source)} if source is not None else None
+
+    def raw_column(idx):
+        return raw_data[:, idx if position is None else position[idx]]
+
+    # 陷波与低通/高通合成一个级联在显示通道上一次完成。滤波是线性的，
+    # 先做计算导联差分再陷波与先陷波再差分结果相同
+    notch = None
+    if notch_freq:
+        try:
+            notch = (float(notch_freq), enhanced_notch)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"陷波滤波失败: {e}")
+
+    # 如果是计算导联模式，进行差分计算
+    if is_computed_mode and computed_leads:
+        num_samples = raw_data.shape[0]
+        output_data = np.zeros((num_samples, len(display_channels)), dtype=np.float32)
+
+        for out_idx, disp_ch in enumerate(display_channels):
+            if disp_ch < len(computed_leads):
+                # 计算导联：差分计算 (u+ - u-)
+                lead = computed_leads[disp_ch]
+                plus_data = raw_column(lead['plus_idx'])
+                minus_data = raw_column(lead['minus_idx'])
+                output_data[:, out_idx] = plus_data - minus_data
+            else:
+                # 非计算导联：直接使用原始数据
+                other_idx = disp_ch - len(computed_leads)
+                if other_idx < len(other_channel_indices):
+                    raw_ch_idx = other_channel_indices[other_idx]
+                    output_data[:, out_idx] = raw_column(raw_ch_idx)
+                else:
+                    logger.warning(f"通道索引越界: {disp_ch}")
+
+        # 计算导联模式不支持通道级滤波：全部列共用全局设置
+        column_settings = [(lp_cutoff, hp_cutoff)] * len(display_channels)
+        return _apply_grouped_filters(output_data, fs, column_settings, filter_method, notch)
+
+    # 非计算模式：直接返回请求的通道（整数源数据先转浮点，滤波结果才能原位写回；
+    # float32 源数据保持 float32，滤波内部仍以 float64 计算）
+    data = raw_data[:, display_channels if position is None else [position[c] for c in display_channels]]
+    if not np.issubdtype(data.dtype, np.floating):
+        data = data.astype(np.float64)
+
+    # 每列的有效设置：有通道级配置的列只用自己的 lp/hp（覆盖全局），其余用全局
+    column_settings = [(lp_cutoff, hp_cutoff)] * len(display_channels)
+    for ch_idx_str, filter_settings in (channel_filters or {}).items():
+        try:
+            ch_idx = int(ch_idx_str)
+        except (ValueError, TypeError):
+            continue
+        if ch_idx in display_channels and isinstance(filter_settings, dict):
+            column_settings[display_channels.index(ch_idx)] = (
+                filter_settings.get('lp'), filter_settings.get('hp'))
+            ch_name = display_channel_names[ch_idx] if ch_idx < len(
+                display_channel_names) else f"Ch{ch_idx}"
+            logger.info(f"通道 {ch_name}: LP={filter_settings.get('lp') or '∞'}, "
+                        f"HP={filter_settings.get('hp') or 'DC'}")
+    return _apply_grouped_filters(data, fs, column_settings, filter_method, notch)
+
+
+def _apply_grouped_filters(data, fs, column_settings, method, notch=None):
+    """
+    按有效 (lp, hp) 设置分组滤波：同设置的列合成一个 2D 块沿 axis=0 一次滤完
+
+    每组的陷波（全局）+ 低通 + 高通取 `_filter_cascade` 的缓存级联，单次遍历完成；
+    耗时随「不同设置的组数」而非通道数增长；所有列同设置时直接整块滤波、免拷贝。
+
+    Args:
+        data: (samples, columns)，结果原位写回（保持 data 的 dtype）
+        column_settings: 每列一个 (lp_cutoff, hp_cutoff)，值为 None/空 表示不滤
+        method: 'zero_phase' 或 'causal'
+        notch: (freq, enhanced) 或 None，作用于所有列
+    """
+    notch_freq, enhanced = notch if notch else (None, False)
+    groups = {}
+    for col, (lp, hp) in enumerate(column_settings):
+        groups.setdefault((lp or None, hp or None), []).append(col)
+    for (lp, hp), cols in groups.items():
+        if not (notch_freq or lp or hp) or data.shape[0] == 0:
+            continue
+        try:
+            sos, zi = _filter_cascade(float(fs), notch_freq, 35.0, bool(enhanced),
+                                      float(lp) if lp else None, float(hp) if hp else None, method)
+        except Exception as e:
+            logger.warning(f"滤波失败 (LP={lp}, HP={hp}): {e}")
+            continue
+        if sos is None:
+            continue
+        if len(cols) == data.shape[1]:
+            data[:] = _apply_sos(sos, data, method, zi)
+        else:
+            data[:, cols] = _apply_sos(sos, data[:, cols], method, zi)
+        mode = "ActiveNotch™" if enhanced else "Standard"
+        logger.info(f"已应用 {len(sos)} 节级联滤波 (notch={notch_freq or '-'} {mode}, "
+                    f"LP={lp or '∞'}, HP={hp or 'DC'}, {method})，{len(cols)} 个通道")
+    return data
+
+
+def _filter_pad_samples(fs, spec):
+    """滤波分块两侧的重叠填充：最慢滤波器时间常数的 FILTER_SETTLE_TAU 倍。
+
+    Butterworth 截止 fc 的时间常数约 1/(2π·fc)，陷波器约 Q/(π·f0)；
+    0.5 Hz 高通约 3.8 s，50 Hz 陷波约 2.7 s。不设上限：填充不足会在分块接缝处留下瞬态。
+    """
+    cutoffs = [spec['lp'], spec['hp']]
+    for settings in spec['channel_filters'].values():
+        if isinstance(settings, dict):
+            cutoffs.extend([settings.get('lp'), settings.get('hp')])
+    taus = [0.0]
+    for cutoff in cutoffs:
+        try:
+            taus.append(1.0 / (2 * np.pi * float(cutoff)))
+        except (TypeError, ValueError, ZeroDivisionError):
+            pass
+    try:
+        taus.append(35.0 / (np.pi * float(spec['notch'])))
+    except (TypeError, ValueError, ZeroDivisionError):
+        pass
+    return int(np.ceil(FILTER_SETTLE_TAU * max(taus) * fs))
+
+
+class FilteredTileCache:
+    """滤波结果的分块 LRU 缓存。
+
+    文件按 `tile_samples` 切成固定分块，每块连同两侧 `_filter_pad_samples` 的原始上下文
+    一起滤波、只保留中间部分（overlap-save），所以请求窗口的边缘不是滤波边界。
+    键为 (文件版本, 分块号, 滤波规格, 通道集合)，值为 float32；总字节数超出预算时
+    淘汰最久未用的分块。文件被改写（mtime/size 变化）后旧键自然不再命中。
+    所需填充超过 FILTER_TILE_MAX_PAD_SEC 时不分块，整窗带完整填充直接滤波（计入 `direct`）。
+    """
+
+    def __init__(self, budget_bytes=FILTER_CACHE_BYTES, tile_samples=FILTER_TILE_SAMPLES):
+        self.budget_bytes = int(budget_bytes)
+        self.tile_samples = int(tile_samples)
+        self._tiles = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'direct': 0}
+
+    def _compute(self, info, tile, display_channels, spec):
+        first = tile * self.tile_samples
+        last = min(info['metadata']['num_samples'], first + self.tile_samples)
+        return self._filter_range(info, first, last, display_channels, spec)
+
+    @staticmethod
+    def _filter_range(info, first, last, display_channels, spec):
+        """[first, last) 连同两侧完整填充读原始数据、滤波，只保留中间部分。"""
+        metadata = info['metadata']
+        fs = metadata['sampling_freq']
+        num_samples = metadata['num_samples']
+        pad = _filter_pad_samples(fs, spec)
+        lo, hi = max(0, first - pad), min(num_samples, last + pad)
+        source = _source_channels(metadata, display_channels)
+        filtered = _filter_window(_read_raw_window(info, lo, hi, source), metadata,
+                                  display_channels, fs, spec, source)
+        return np.ascontiguousarray(filtered[first - lo:last - lo], dtype=np.float32)
+
+    def window(self, info, start_idx, end_idx, display_channels, spec):
+        """拼出 [start_idx, end_idx) 的滤波结果 (samples, len(display_channels))。"""
+        if end_idx <= start_idx:
+            return np.empty((0, len(display_channels)), dtype=np.float32)
+        fs = info['metadata']['sampling_freq']
+        if _filter_pad_samples(fs, spec) > FILTER_TILE_MAX_PAD_SEC * fs:
+            with self._lock:
+                self._stats['direct'] += 1
+            return self._filter_range(info, start_idx, end_idx, display_channels, spec)
+        real = os.path.realpath(info['path'])
+        st = os.stat(real)
+        base = (real, st.st_mtime_ns, st.st_size,
+                json.dumps(spec, sort_keys=True), tuple(display_channels))
+        first_tile = start_idx // self.tile_samples
+        last_tile = (end_idx - 1) // self.tile_samples
+        parts = []
+        for tile in range(first_tile, last_tile + 1):
+            key = base + (tile,)
+            with self._lock:
+                data = self._tiles.get(key)
+                if data is not None:
+                    self._tiles.move_to_end(key)
+                    self._stats['hits'] += 1
+            if data is None:
+                data = self._compute(info, tile, display_channels, spec)
+                self._put(key, data)
+            parts.append(data)
+        joined = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        offset = first_tile * self.tile_samples
+        return joined[start_idx - offset:end_idx - offset]
+
+    def _put(self, key, data):
+        with self._lock:
+            self._stats['misses'] += 1
+            if key in self._tiles:
+                return
+            self._tiles[key] = data
+            self._bytes += data.nbytes
+            while self._bytes > self.budget_bytes and len(self._tiles) > 1:
+                _, evicted = self._tiles.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self._stats['evictions'] += 1
+
+    def close(self, path=None):
+        """丢弃 path 的全部分块；path 为 None 时清空。"""
+        real = None if path is None else os.path.realpath(path)
+        with self._lock:
+            for key in [k for k in self._tiles if real is None or k[0] == real]:
+                self._bytes -= self._tiles.pop(key).nbytes
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'tiles': len(self._tiles), 'bytes': self._bytes,
+                    'budget_bytes': self.budget_bytes}
+
+
+FILTER_TILES = FilteredTileCache()
+
+
+class WindowPrefetcher:
+    """/data 的有界响应缓存 + 相邻窗口后台预取。
+
+    服务完 [t0, t1) 后，把同参数的下一页 [t1, t1+w) 与上一页 [t0-w, t0)（按前端平移规则
+    贴边）交给单个后台线程计算，结果按字节预算 LRU 缓存，翻页命中即时返回。预取走同一条
+    计算路径，顺带预热滤波分块与 HDF5 chunk cache，小步平移也受益。
+
+    每个文件只保留最近一次请求安排的预取：新请求到来时取消尚未开始的旧预取（用户跳到
+    别处）。请求恰好落在正在计算的预取窗口上时等待它完成，不重复计算。
+    """
+
+    def __init__(self, budget_bytes=RESPONSE_CACHE_BYTES, enabled=PREFETCH_ENABLED):
+        self.budget_bytes = int(budget_bytes)
+        self.enabled = bool(enabled)
+        self._cache = OrderedDict()  # key -> (payload, output, sample_index)
+        self._bytes = 0
+        self._inflight = {}          # key -> Future
+        self._pending = {}           # file_id -> [(key, Future)]
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'inflight_waits': 0, 'prefetched': 0,
+                       'cancelled': 0, 'evictions': 0}
+
+    @staticmethod
+    def _key(file_id, info, params):
+        st = os.stat(info['path'])
+        rest = {k: v for k, v in params.items() if k not in ('start_sec', 'end_sec')}
+        # 微秒取整：前端累加出的时间与服务端推算的相邻窗口只差浮点尾数
+        return (file_id, st.st_mtime_ns, st.st_size, round(params['start_sec'], 6),
+                round(params['end_sec'], 6), json.dumps(rest, sort_keys=True))
+
+    @staticmethod
+    def _nbytes(result):
+        _, output, sample_index = result
+        return output.nbytes + (sample_index.nbytes if sample_index is not None else 0)
+
+    def _store(self, key, result):
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = result
+            self._bytes += self._nbytes(result)
+            while self._bytes > self.budget_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._bytes -= self._nbytes(evicted)
+                self._stats['evictions'] += 1
+
+    def fetch(self, file_id, info, params):
+        """返回 `_compute_data` 的结果（缓存 / 等待进行中的预取 / 现算），并安排相邻预取。"""
+        if not self.enabled:
+            return _compute_data(file_id, info, params)
+        key = self._key(file_id, info, params)
+        with self._lock:
+            result = self._cache.get(key)
+            future = None if result is not None else self._inflight.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                self._stats['hits'] += 1
+        if result is None and future is not None and not future.cancelled():
+            try:
+                result = future.result()
+                with self._lock:
+                    self._stats['inflight_waits'] += 1
+            except Exception:
+                result = None
+        if result is None:
+            with self._lock:
+                self._stats['misses'] += 1
+            result = _compute_data(file_id, info, params)
+            self._store(key, result)
+        self._schedule(file_id, info, params)
+        return result
+
+    def _neighbours(self, info, start, end):
+        metadata = info['metadata']
+        duration = metadata['num_samples'] / metadata['sampling_freq']
+        width = end - start
+        windows = []
+        if width <= 0:
+            return windows
+        if end < duration:
+            next_end = min(duration, end + width)
+            windows.append((next_end - width, next_end))
+        if start > 0:
+            prev_start = max(0.0, start - width)
+            windows.append((prev_start, prev_start + width))
+        return windows
+
+    def _schedule(self, file_id, info, params):
+        with self._lock:
+            for key, future in self._pending.pop(file_id, []):
+                if future.cancel():
+                    self._inflight.pop(key, None)
+                    self._stats['cancelled'] += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ecg-prefetch')
+            scheduled = []
+            for start, end in self._neighbours(info, params['start_sec'], params['end_sec']):
+                window = {**params, 'start_sec': start, 'end_sec': end}
+                key = self._key(file_id, info, window)
+                if key in self._cache or key in self._inflight:
+                    continue
+                future = self._executor.submit(self._prefetch, key, file_id, info, window)
+                self._inflight[key] = future
+                scheduled.append((key, future))
+            self._pending[file_id] = scheduled
+
+    def _prefetch(self, key, file_id, info, params):
+        try:
+            result = _compute_data(file_id, info, params)
+            self._store(key, result)
+            with self._lock:
+                self._stats['prefetched'] += 1
+            return result
+        except Exception as e:
+            logger.debug(f"预取失败 {file_id} [{params['start_sec']}, {params['end_sec']}): {e}")
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def wait(self, file_id=None):
+        """等待进行中的预取结束（测试与关闭时使用）；给出 file_id 时只等该文件的。"""
+        with self._lock:
+            futures = [future for key, future in self._inflight.items()
+                       if file_id is None or key[0] == file_id]
+        wait_futures(futures)
+
+    def close(self, file_id=None):
+        """取消 file_id 的预取并丢弃其缓存响应；file_id 为 None 时全部清空。
+
+        只等待该文件正在计算的预取（其它文件的预取不阻塞释放），等完再清缓存，
+        以免刚算完的预取把响应写回已清空的缓存。"""
+        with self._lock:
+            ids = list(self._pending) if file_id is None else [file_id]
+            for fid in ids:
+                for key, future in self._pending.pop(fid, []):
+                    if future.cancel():
+                        self._inflight.pop(key, None)
+        self.wait(file_id)
+        with self._lock:
+            for key in [k for k in self._cache if file_id is None or k[0] == file_id]:
+                self._bytes -= self._nbytes(self._cache.pop(key))
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'enabled': self.enabled, 'entries': len(self._cache),
+                    'bytes': self._bytes, 'budget_bytes': self.budget_bytes,
+                    'inflight': len(self._inflight)}
+
+
+PREFETCHER = WindowPrefetcher()
+
+
+def _estimate_info_bytes(info):
+    """FILE_CACHE 条目的内存估算：元数据与标注按 JSON 长度计，Python 小对象开销约 4 倍；
+    已构建的标注索引另加其数组占用。"""
+    try:
+        size = len(json.dumps([info.get('metadata'), info.get('annotations')], default=str))
+    except (TypeError, ValueError):
+        size = 0
+    index = info.get('annotation_index')
+    return 4 * size + (index.nbytes() if index is not None else 0)
+
+
+class FileCache:
+    """已打开文件的缓存：按估算字节 LRU 淘汰 + 空闲过期。
+
+    用法同 dict（`in` / `[]` / pop / values）。命中即刷新 LRU 位置与最近访问时间；
+    超出字节预算时淘汰最久未用的条目（刚放入的不淘汰），空闲超过 `idle_sec` 的条目在
+    下次访问或清理线程巡检时过期。被淘汰/过期的条目与 /cleanup 一样释放：停预取、关闭
+    金字塔与句柄、删除上传的临时文件。values()/keys() 返回快照，不计命中。
+    """
+
+    def __init__(self, budget_bytes=FILE_CACHE_BYTES, idle_sec=FILE_IDLE_SEC):
+        self.budget_bytes = int(budget_bytes)
+        self.idle_sec = float(idle_sec)
+        self._items = OrderedDict()  # file_id -> [info, nbytes, last_access]
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+
+    def _expired(self, entry, now):
+        return now - entry[2] > self.idle_sec
+
+    def _drop(self, file_id):
+        info, nbytes, _ = self._items.pop(file_id)
+        self._bytes -= nbytes
+        return info
+
+    def _release(self, dropped):
+        for file_id, info in dropped:
+            try:
+                _release_file(file_id, info)
+            except Exception as e:
+                logger.warning(f"释放缓存文件失败 {file_id}: {e}")
+
+    def __setitem__(self, file_id, info):
+        dropped = []
+        with self._lock:
+            if file_id in self._items:
+                self._drop(file_id)
+            nbytes = _estimate_info_bytes(info)
+            self._items[file_id] = [info, nbytes, time.monotonic()]
+            self._bytes += nbytes
+            dropped = self._shrink(file_id)
+        self._release(dropped)
+
+    def _shrink(self, keep):
+        """超出预算时从最久未用起淘汰（keep 除外），返回 [(file_id, info), ...] 待释放。"""
+        dropped = []
+        for file_id in list(self._items):
+            if self._bytes <= self.budget_bytes:
+                break
+            if file_id != keep:
+                dropped.append((file_id, self._drop(file_id)))
+                self._stats['evictions'] += 1
+        if dropped:
+            logger.info(f"文件缓存超出预算，已淘汰 {len(dropped)} 个条目")
+        return dropped
+
+    def refresh(self, file_id):
+        """条目在缓存中长大后（如懒建的标注索引）重新估算其字节并按预算淘汰其它条目。"""
+        with self._lock:
+            entry = self._items.get(file_id)
+            if entry is None:
+                return
+            nbytes = _estimate_info_bytes(entry[0])
+            self._bytes += nbytes - entry[1]
+            entry[1] = nbytes
+            dropped = self._shrink(file_id)
+        self._release(dropped)
+
+    def _lookup(self, file_id):
+        """命中返回 info 并刷新；不存在或已过期返回 None（过期条目随即释放）。"""
+        dropped = []
+        with self._lock:
+            entry = self._items.get(file_id)
+            now = time.monotonic()
+            if entry is not None and self._expired(entry, now):
+                dropped.append((file_id, self._drop(file_id)))
+                self._stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+            else:
+                entry[2] = now
+                self._items.move_to_end(file_id)
+                self._stats['hits'] += 1
+        self._release(dropped)
+        return None if entry is None else entry[0]
+
+    def __contains__(self, file_id):
+        with self._lock:
+            entry = self._items.get(file_id)
+            if entry is not None and not self._expired(entry, time.monotonic()):
+                return True
+        # 缺失或过期：走 _lookup 计未命中并释放
+        return self._lookup(file_id) is not None
+
+    def __getitem__(self, file_id):
+        info = self._lookup(file_id)
+        if info is None:
+            raise KeyError(file_id)
+        return info
+
+    def get(self, file_id, default=None):
+        info = self._lookup(file_id)
+        return default if info is None else info
+
+    def pop(self, file_id, *default):
+        with self._lock:
+            if file_id in self._items:
+                return self._drop(file_id)
+        if default:
+            return default[0]
+        raise KeyError(file_id)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        with self._lock:
+            return list(self._items)
+
+    def values(self):
+        with self._lock:
+            return [entry[0] for entry in self._items.values()]
+
+    def items(self):
+        with self._lock:
+            return [(file_id, entry[0]) for file_id, entry in self._items.items()]
+
+    def clear(self):
+        """清空条目并归零计数，不释放资源（测试隔离用；正常清理走 /cleanup-all）。"""
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+            self._stats = dict.fromkeys(self._stats, 0)
+
+    def expire(self):
+        """释放所有空闲过期的条目，返回数量。"""
+        dropped = []
+        with self._lock:
+            now = time.monotonic()
+            for file_id in [k for k, entry in self._items.items() if self._expired(entry, now)]:
+                dropped.append((file_id, self._drop(file_id)))
+            self._stats['expired'] += len(dropped)
+        self._release(dropped)
+        return len(dropped)
+
+    def evict_lru(self, predicate):
+        """淘汰满足 predicate(info) 的最久未用条目（最近使用的一个除外），返回 info 或 None。"""
+        with self._lock:
+            candidates = list(self._items)[:-1]
+            file_id = next((k for k in candidates if predicate(self._items[k][0])), None)
+            if file_id is None:
+                return None
+            info = self._drop(file_id)
+            self._stats['evictions'] += 1
+        self._release([(file_id, info)])
+        return info
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {**self._stats, 'entries': len(self._items), 'bytes': self._bytes,
+                    'budget_bytes': self.budget_bytes, 'idle_sec': self.idle_sec,
+                    'hit_rate': round(self._stats['hits'] / lookups, 4) if lookups else None}
+
+
+FILE_CACHE = FileCache()
+
+
+def _release_file(file_id, info):
+    """释放一个已移出 FILE_CACHE 的条目：停预取，关闭金字塔/句柄/滤波分块，删除上传的临时文件。"""
+    PREFETCHER.close(file_id)
+    _remove_decoded(info)
+    if not any(other['path'] == info['path'] for other in FILE_CACHE.values()):
+        # 先停金字塔构建（它也经句柄池读取），再关句柄。本地文件的金字塔留在磁盘
+        # 供下次打开复用；上传的临时文件连同金字塔删除
+        PYRAMIDS.close(info['path'], remove=not info.get('is_local', False))
+        H5_HANDLES.close(info['path'])
+        FILTER_TILES.close(info['path'])
+    # 只有在非本地文件（即上传的临时文件）时才物理删除
+    if not info.get('is_local', False) and os.path.exists(info['path']):
+        os.remove(info['path'])
+
+
+class TempJanitor:
+    """TEMP_DIR 后台清理：过期 FILE_CACHE 条目、回收未下载的导出图片、执行磁盘配额。
+
+    每 `interval_sec` 巡检一次（首次打开文件时启动，守护线程）。配额超出时先删
+    未被引用的文件（旧的金字塔目录、解压缓存、孤立上传）、由旧到新，仍超出再淘汰
+    最久未用的上传条目。正在使用的文件与 `TEMP_GRACE_SEC` 内新写的文件不动。
+    """
+
+    def __init__(self, root=TEMP_DIR, quota_bytes=TEMP_QUOTA_BYTES,
+                 interval_sec=JANITOR_INTERVAL_SEC, export_ttl_sec=EXPORT_IMAGE_TTL_SEC):
+        self.root = root
+        self.quota_bytes = int(quota_bytes)
+        self.interval_sec = float(interval_sec)
+        self.export_ttl_sec = float(export_ttl_sec)
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {'sweeps': 0, 'exports_removed': 0, 'files_removed': 0,
+                       'bytes_freed': 0, 'temp_bytes': 0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is None and self.interval_sec > 0:
+                self._thread = threading.Thread(target=self._run, name='ecg-temp-janitor', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_sec):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"临时目录清理失败: {e}")
+
+    def _units(self):
+        """可独立删除的单元 → (字节数, 最近修改时间)：金字塔目录整体一个，其余按文件。"""
+        pyramid_root = os.path.realpath(PYRAMIDS.root)
+        units = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            real_dir = os.path.realpath(dirpath)
+            unit_dir = real_dir if os.path.dirname(real_dir) == pyramid_root else None
+            for name in filenames:
+                path = os.path.join(real_dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                key = unit_dir or path
+                size, mtime = units.get(key, (0, 0.0))
+                units[key] = (size + st.st_size, max(mtime, st.st_mtime))
+        return units
+
+    @staticmethod
+    def _in_use():
+        paths = set()
+        for info in FILE_CACHE.values():
+            paths.add(os.path.realpath(info['path']))
+            if info.get('data_file'):
+                paths.add(os.path.realpath(info['data_file']))
+        paths.update(os.path.realpath(d) for d in PYRAMIDS.directories())
+        return paths
+
+    def _remove(self, path, size):
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            logger.warning(f"删除临时文件失败 {path}: {e}")
+            return False
+        with self._lock:
+            self._stats['files_removed'] += 1
+            self._stats['bytes_freed'] += size
+        return True
+
+    def sweep(self):
+        """巡检一次，返回清理后 TEMP_DIR 的字节数。"""
+        FILE_CACHE.expire()
+        now = time.time()
+        root = os.path.realpath(self.root)
+        units = self._units()
+        in_use = self._in_use()
+        idle = sorted((mtime, path, size) for path, (size, mtime) in units.items()
+                      if path not in in_use and now - mtime > TEMP_GRACE_SEC)
+        total = sum(size for size, _ in units.values())
+
+        # 导出图片只在下载时删除；从未下载的按时限回收
+        for mtime, path, size in list(idle):
+            if (os.path.dirname(path) == root and path.endswith('.png')
+                    and now - mtime > self.export_ttl_sec and self._remove(path, size)):
+                total -= size
+                idle.remove((mtime, path, size))
+                with self._lock:
+                    self._stats['exports_removed'] += 1
+
+        for mtime, path, size in idle:
+            if total <= self.quota_bytes:
+                break
+            if self._remove(path, size):
+                total -= size
+
+        while total > self.quota_bytes:
+            info = FILE_CACHE.evict_lru(lambda item: not item.get('is_local', False))
+            if info is None:
+                logger.warning(f"临时目录超出配额且无可淘汰的上传文件: {total} > {self.quota_bytes} 字节")
+                break
+            total = sum(size for size, _ in self._units().values())
+
+        with self._lock:
+            self._stats['sweeps'] += 1
+            self._stats['temp_bytes'] = total
+        return total
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'quota_bytes': self.quota_bytes,
+                    'interval_sec': self.interval_sec, 'running': self._thread is not None}
+
+
+JANITOR = TempJanitor()
+
+
+def _data_payload(file_id, metadata, start_sec, end_sec, display_channels,
+                  output_channel_names, output, downsample, decimation, source='raw'):
+    """/data 响应的元数据部分（样本另由 `_data_response` 按 format 编码）。"""
+    is_computed_mode = metadata.get('is_computed_mode', False)
+    return {
+        'file_id': file_id,
+        'start_sec': start_sec,
+        'end_sec': end_sec,
+        'channels': display_channels,
+        'channel_names': output_channel_names,
+        'downsample': downsample,
+        'decimation': decimation,
+        'source': source,
+        'num_samples': output.shape[0],
+        'is_computed_mode': is_computed_mode,
+        # 数值与单位声明必须同源：后端路径的 currentData 此前不带 units，
+        # 导致 exportCSV 即便元数据已解析出 uV 也只能写"单位未知"（#27 入口 B）
+        'units': metadata.get('units', units_mod.UNKNOWN),
+        'channel_units': _output_units(metadata, output_channel_names,
+                                       display_channels, is_computed_mode)
+    }
+
+
+def _data_response(wire_format, payload, output, sample_index=None):
+    """按 format 编码一个窗口；payload 可能来自响应缓存，只读不改。"""
+    if wire_format == 'bin':
+        return _binary_response(payload, output, sample_index)
+    body = {**payload, 'data': output.tolist()}
+    if sample_index is not None:
+        body['sample_index'] = sample_index.T.tolist()
+    return jsonify(body)
+
+
+def _source_channels(metadata, display_channels):
+    """
+    显示通道 → 需要读取的原始通道下标（升序、去重）
+
+    计算导联取 plus/minus 两路，其余通道经 other_channel_indices 映射；
+    有越界或负下标时返回 None（读全部通道，越界处理保持原行为）。
+    """
+    num_channels = metadata['num_channels']
+    computed_leads = metadata.get('computed_leads', [])
+    if metadata.get('is_computed_mode') and computed_leads:
+        other_channel_indices = metadata.get('other_channel_indices', [])
+        needed = set()
+        for disp_ch in display_channels:
+            if 0 <= disp_ch < len(computed_leads):
+                lead = computed_leads[disp_ch]
+                needed.update((lead['plus_idx'], lead['minus_idx']))
+            elif 0 <= disp_ch - len(computed_leads) < len(other_channel_indices):
+                needed.add(other_channel_indices[disp_ch - len(computed_leads)])
+    else:
+        needed = set(display_channels)
+    if not needed or any(not 0 <= idx < num_channels for idx in needed):
+        return None
+    return sorted(needed)
+
+
+def _channel_runs(channels):
+    """升序下标 → 连续段 [(first, stop), ...]。"""
+    runs = []
+    for idx in channels:
+        if runs and runs[-1][1] == idx:
+            runs[-1][1] = idx + 1
+        else:
+            runs.append([idx, idx + 1])
+    return [tuple(run) for run in runs]
+
+
+def _read_raw_window(info, start_idx, end_idx, channels=None):
+    """
+    读取 [start_idx, end_idx) 的原始通道，统一为 (samples, channels)
+
+    Args:
+        channels: `_source_channels` 给出的升序原始下标；None 表示全部通道。
+            HDF5 只读这些行（连续段合并为 hyperslab），读取量随显示通道数而非总通道数增长
+    """
+    metadata = info['metadata']
+    samples_first = metadata['data_orientation'] == 'samples_first'
+    if info.get('file_type', 'hdf5') == 'npy':
+        is_npz = os.path.splitext(info['path'])[1].lower() == '.npz'
+        if is_npz and not (info.get('data_file') and os.path.exists(info['data_file'])):
+            # 解压缓存缺失（被清理或旧条目）：重新解压。必须与 open_local/upload 走同一条
+            # load_npz——否则元数据入口通过、波形端点仍取到 _meta 的 JSON 字符串（#28）
+            full_data, _, info['data_file'] = _decode_npz(info['path'])
+        else:
+            full_data = np.load(info['data_file'] if is_npz else info['path'], mmap_mode='r')
+        if full_data.ndim == 1:
+            return np.asarray(full_data[start_idx:end_idx]).reshape(-1, 1)
+        cols = slice(None) if channels is None else channels
+        if samples_first:
+            return np.asarray(full_data[start_idx:end_idx, cols])
+        return np.asarray(full_data[cols, start_idx:end_idx]).T
+
+    # 句柄池复用已打开的文件与其 chunk cache；只在读取期间持有句柄
+    with H5_HANDLES.acquire(info['path']) as h5f:
+        dataset = h5f[info['data_path']]
+        runs = [(0, None)] if channels is None else _channel_runs(channels)
+        if len(runs) > H5_MAX_HYPERSLABS:
+            # 过于零散：一次读包络段，再在内存中取列
+            first = runs[0][0]
+            runs, pick = [(first, runs[-1][1])], [idx - first for idx in channels]
+        else:
+            pick = None
+        if samples_first:
+            blocks = [dataset[start_idx:end_idx, a:b] for a, b in runs]
+        else:
+            blocks = [dataset[a:b, start_idx:end_idx].T for a, b in runs]
+        raw = blocks[0] if len(blocks) == 1 else np.concatenate(blocks, axis=1)
+        return raw if pick is None else raw[:, pick]
+
+
+def _display_matrix(raw, metadata):
+    """原始通道 (samples, channels) → 全部显示通道（计算导联差分 + 其余通道，顺序同 display_channel_names）。"""
+    if not (metadata.get('is_computed_mode') and metadata.get('computed_leads')):
+        return raw
+    columns = [raw[:, lead['plus_idx']] - raw[:, lead['minus_idx']]
+               for lead in metadata['computed_leads']]
+    columns.extend(raw[:, idx] for idx in metadata.get('other_channel_indices', []))
+    return np.column_stack(columns).astype(np.float32, copy=False)
+
+
 @ecg_api.route('/data/<file_id>', methods=['GET'])
 def get_data(file_id):
     """
@@ -1055,21 +2580,44 @@ def get_data(file_id):
     - start: 起始时间（秒），默认 0
     - end: 结束时间（秒），默认 10
     - channels: 通道索引列表，逗号分隔，默认全部
-    - downsample: 降采样因子，默认 1（不降采样）
+    - downsample: 降采样因子，默认 1（不降采样）；与 max_points 同给时忽略
+    - max_points: 每通道最多返回的点数（屏幕宽度 × 密度）；给出后在全部滤波之后
+      自动选择降采样，响应大小只取决于像素数而与窗口长度无关
+    - decimate: max_points 的降采样算法，minmax（默认，峰值保留）或 lttb（视觉保形，
+      响应附带逐通道 sample_index）
+    - format: json（默认，data 为 [样本][通道] 列表）或 bin（见 `_binary_response`）
+
+    结果进入有界响应缓存，并在后台预取前后相邻的等宽窗口（见 `WindowPrefetcher`）。
     """
     if file_id not in FILE_CACHE:
         return jsonify({'error': '文件不存在或已过期'}), 404
 
     info = FILE_CACHE[file_id]
     metadata = info['metadata']
-    fs = metadata['sampling_freq']
     file_type = info.get('file_type', 'hdf5')
+    wire_format = request.args.get('format', 'json')
+    if wire_format not in ('json', 'bin'):
+        return jsonify({'error': f'不支持的 format: {wire_format}（可选 json / bin）'}), 400
 
     # 解析参数
     start_sec = float(request.args.get('start', 0))
     end_sec = float(request.args.get('end', 10))
     channels_str = request.args.get('channels', '')
     downsample = int(request.args.get('downsample', 1))
+    max_points = request.args.get('max_points', None)
+    decimate = request.args.get('decimate', 'minmax')
+    if decimate not in DECIMATION_METHODS:
+        return jsonify({'error': f'不支持的 decimate: {decimate}（可选 minmax / lttb）'}), 400
+    if max_points is not None:
+        try:
+            max_points = int(max_points)
+        except ValueError:
+            max_points = 0
+        if max_points < MIN_MAX_POINTS:
+            return jsonify({'error': f'max_points 须为不小于 {MIN_MAX_POINTS} 的整数'}), 400
+        # 按像素降采样放到滤波之后：先在原始采样率上完成全部滤波，避免低通/高通
+        # 在抽取后的序列上按原 fs 设计而错位
+        downsample = 1
     notch_freq = request.args.get('notch', None)  # 陷波滤波频率，如 "50" 或 "60"
     enhanced_notch = request.args.get('enhanced_notch') == 'true'  # ActiveNotch 增强模式标志
     lp_cutoff = request.args.get('lp', None)     # 低通滤波截止频率，如 "35"
@@ -1088,15 +2636,8 @@ def get_data(file_id):
         except Exception as e:
             logger.warning(f"解析 channel_filters 失败: {e}")
 
-    # 转换为采样点索引
-    start_idx = max(0, int(start_sec * fs))
-    end_idx = min(metadata['num_samples'], int(end_sec * fs))
-
-    # 检查是否为计算导联模式
-    is_computed_mode = metadata.get('is_computed_mode', False)
-    computed_leads = metadata.get('computed_leads', [])
-    other_channel_indices = metadata.get('other_channel_indices', [])
-    display_channel_names = metadata.get('display_channel_names', metadata['channel_names'])
+    filter_spec = _filter_spec(notch_freq, enhanced_notch, lp_cutoff, hp_cutoff,
+                               filter_method, channel_filters)
 
     # 解析请求的通道（这里的 channels 是 display 通道索引）
     if channels_str:
@@ -1104,239 +2645,91 @@ def get_data(file_id):
     else:
         display_channels = list(range(metadata.get('display_num_channels', metadata['num_channels'])))
 
-    try:
-        if file_type == 'npy':
-            # 读取 NumPy 文件（需要读取所有原始通道以便计算差分）
-            ext = os.path.splitext(info['filename'])[1].lower()
-            if ext == '.npz':
-                # 必须与 open_local/upload 走同一条 load_npz——否则元数据入口通过、
-                # 波形端点仍取到 _meta 的 JSON 字符串并在切片时 500（#28）
-                full_data, _ = load_npz(np.load(info['path']))
-            else:
-                full_data = np.load(info['path'])
-
-            # 根据数据方向切片（读取所有通道，先读取完整数据再降采样）
-            if metadata['data_orientation'] == 'samples_first':
-                if len(full_data.shape) == 1:
-                    raw_data_full = full_data[start_idx:end_idx].reshape(-1, 1)
-                else:
-                    raw_data_full = full_data[start_idx:end_idx, :]
-            else:
-                raw_data_full = full_data[:, start_idx:end_idx].T
-
-            # ★ 先滤波（使用原始采样率），再降采样 ★
-            # Notch 滤波（必须在降采样前）
-            if notch_freq:
-                try:
-                    freq = float(notch_freq)
-                    raw_data_full, applied = apply_notch_filter(
-                        raw_data_full, fs, freq=freq, method=filter_method, enhanced=enhanced_notch)
-                    if applied:
-                        logger.info(f"[NPY预降采样] 已应用 {freq}Hz 陷波滤波 ({filter_method})")
-                except Exception as e:
-                    logger.warning(f"[NPY预降采样] 陷波滤波失败: {e}")
-
-            # 使用 Min-Max 降采样保留峰值
-            raw_data = minmax_downsample(raw_data_full, downsample)
-        else:
-            # 读取 HDF5 文件（读取所有原始通道以便计算差分）
-            if not H5PY_AVAILABLE:
-                return jsonify({'error': 'h5py 未安装'}), 500
-
-            with h5py.File(info['path'], 'r') as h5f:
-                dataset = h5f[info['data_path']]
+    if file_type != 'npy' and not H5PY_AVAILABLE:
+        return jsonify({'error': 'h5py 未安装'}), 500
 
-                # 先读取完整数据
-                if metadata['data_orientation'] == 'samples_first':
-                    raw_data_full = dataset[start_idx:end_idx, :]
-                else:
-                    raw_data_full = dataset[:, start_idx:end_idx].T
-
-                # ★ 先滤波（使用原始采样率），再降采样 ★
-                # Notch 滤波（必须在降采样前，否则 50Hz 信号会被 MinMax 破坏）
-                if notch_freq:
-                    try:
-                        freq = float(notch_freq)
-                        raw_data_full, applied = apply_notch_filter(
-                            raw_data_full,
-                            fs,
-                            freq=freq,
-                            method=filter_method,
-                            enhanced=enhanced_notch  # 传递增强标志
-                        )
-                        if applied:
-                            mode = "ActiveNotch™" if enhanced_notch else "Standard"
-                            logger.info(f"[预降采样] 已应用 {freq}Hz 陷波滤波 ({mode}, {filter_method})")
-                    except Exception as e:
-                        logger.warning(f"[预降采样] 陷波滤波失败: {e}")
-
-                # 使用 Min-Max 降采样保留峰值
-                raw_data = minmax_downsample(raw_data_full, downsample)
-
-        # 如果是计算导联模式，进行差分计算
-        if is_computed_mode and computed_leads:
-            num_samples = raw_data.shape[0]
-            output_data = np.zeros((num_samples, len(display_channels)), dtype=np.float32)
-            output_channel_names = []
-
-            for out_idx, disp_ch in enumerate(display_channels):
-                if disp_ch < len(computed_leads):
-                    # 计算导联：差分计算 (u+ - u-)
-                    lead = computed_leads[disp_ch]
-                    plus_data = raw_data[:, lead['plus_idx']]
-                    minus_data = raw_data[:, lead['minus_idx']]
-                    output_data[:, out_idx] = plus_data - minus_data
-                    output_channel_names.append(lead['name'])
-                else:
-                    # 非计算导联：直接使用原始数据
-                    other_idx = disp_ch - len(computed_leads)
-                    if other_idx < len(other_channel_indices):
-                        raw_ch_idx = other_channel_indices[other_idx]
-                        output_data[:, out_idx] = raw_data[:, raw_ch_idx]
-                        output_channel_names.append(display_channel_names[disp_ch])
-                    else:
-                        logger.warning(f"通道索引越界: {disp_ch}")
-                        output_channel_names.append(f"Ch{disp_ch + 1}")
-            # Notch 滤波已在降采样前应用，此处无需重复
-
-            # 应用低通滤波
-            if lp_cutoff:
-                try:
-                    cutoff = float(lp_cutoff)
-                    output_data = apply_lowpass_filter(output_data, fs, cutoff=cutoff, method=filter_method)
-                    logger.info(f"已应用 {cutoff}Hz 低通滤波 ({filter_method})")
-                except Exception as e:
-                    logger.warning(f"低通滤波失败: {e}")
+    params = {'start_sec': start_sec, 'end_sec': end_sec, 'channels': display_channels,
+              'downsample': downsample, 'max_points': max_points, 'decimate': decimate,
+              'filters': filter_spec}
+    try:
+        payload, output, sample_index = PREFETCHER.fetch(file_id, info, params)
+    except Exception as e:
+        logger.error(f"数据读取失败: {e}")
+        return jsonify({'error': f'数据读取失败: {str(e)}'}), 500
+    return _data_response(wire_format, payload, output, sample_index)
 
-            # 应用高通滤波
-            if hp_cutoff:
-                try:
-                    cutoff = float(hp_cutoff)
-                    output_data = apply_highpass_filter(output_data, fs, cutoff=cutoff, method=filter_method)
-                    logger.info(f"已应用 {cutoff}Hz 高通滤波 ({filter_method})")
-                except Exception as e:
-                    logger.warning(f"高通滤波失败: {e}")
 
-            data_list = output_data.tolist()
-        else:
-            # 非计算模式：直接返回请求的通道
-            data = raw_data[:, display_channels] if len(raw_data.shape) > 1 else raw_data
-
-            # Notch 滤波已在降采样前应用，此处无需重复
-
-            # 收集哪些通道有独立滤波设置（用于跳过全局滤波）
-            channels_with_local_filter = set()
-            if channel_filters:
-                for ch_idx_str in channel_filters.keys():
-                    try:
-                        ch_idx = int(ch_idx_str)
-                        if ch_idx in display_channels:
-                            channels_with_local_filter.add(display_channels.index(ch_idx))
-                    except (ValueError, TypeError):
-                        pass
-
-            # 应用全局低通滤波（跳过有独立设置的通道）
-            if lp_cutoff:
-                try:
-                    cutoff = float(lp_cutoff)
-                    if len(data.shape) > 1:
-                        for col_idx in range(data.shape[1]):
-                            if col_idx not in channels_with_local_filter:
-                                data[:, col_idx] = apply_lowpass_filter(
-                                    data[:, col_idx], fs, cutoff=cutoff, method=filter_method)
-                        logger.info(
-                            f"已应用 {cutoff}Hz 全局低通滤波 ({filter_method}) (跳过 {len(channels_with_local_filter)} 个独立配置通道)")
-                    else:
-                        if not channels_with_local_filter:
-                            data = apply_lowpass_filter(data, fs, cutoff=cutoff, method=filter_method)
-                            logger.info(f"已应用 {cutoff}Hz 低通滤波 ({filter_method})")
-                except Exception as e:
-                    logger.warning(f"低通滤波失败: {e}")
+def _compute_data(file_id, info, params):
+    """
+    计算一个 /data 窗口（请求路径与后台预取共用，不依赖 flask request）
 
-            # 应用全局高通滤波（跳过有独立设置的通道）
-            if hp_cutoff:
-                try:
-                    cutoff = float(hp_cutoff)
-                    if len(data.shape) > 1:
-                        for col_idx in range(data.shape[1]):
-                            if col_idx not in channels_with_local_filter:
-                                data[:, col_idx] = apply_highpass_filter(
-                                    data[:, col_idx], fs, cutoff=cutoff, method=filter_method)
-                        logger.info(
-                            f"已应用 {cutoff}Hz 全局高通滤波 ({filter_method}) (跳过 {len(channels_with_local_filter)} 个独立配置通道)")
-                    else:
-                        if not channels_with_local_filter:
-                            data = apply_highpass_filter(data, fs, cutoff=cutoff, method=filter_method)
-                            logger.info(f"已应用 {cutoff}Hz 高通滤波 ({filter_method})")
-                except Exception as e:
-                    logger.warning(f"高通滤波失败: {e}")
-
-            # 应用通道级滤波（覆盖全局滤波）
-            if channel_filters and SCIPY_AVAILABLE:
-                for ch_idx_str, filter_settings in channel_filters.items():
-                    try:
-                        # 找到该通道在 display_channels 中的位置
-                        ch_idx = int(ch_idx_str)
-                        if ch_idx in display_channels:
-                            data_col_idx = display_channels.index(ch_idx)
-                            ch_lp = filter_settings.get('lp')
-                            ch_hp = filter_settings.get('hp')
-                            ch_name = display_channel_names[ch_idx] if ch_idx < len(
-                                display_channel_names) else f"Ch{ch_idx}"
-
-                            # 提取单通道数据
-                            if len(data.shape) > 1:
-                                ch_data = data[:, data_col_idx].copy()
-                            else:
-                                ch_data = data.copy()
-
-                            # 应用通道级低通
-                            if ch_lp:
-                                ch_data = apply_lowpass_filter(ch_data.reshape(-1), fs,
-                                                               cutoff=float(ch_lp), method=filter_method)
-
-                            # 应用通道级高通
-                            if ch_hp:
-                                ch_data = apply_highpass_filter(ch_data.reshape(-1), fs,
-                                                                cutoff=float(ch_hp), method=filter_method)
-
-                            # 写回
-                            if len(data.shape) > 1:
-                                data[:, data_col_idx] = ch_data.reshape(-1)
-                            else:
-                                data = ch_data
-
-                            logger.info(f"通道 {ch_name}: LP={ch_lp or '∞'}, HP={ch_hp or 'DC'}")
-                    except Exception as e:
-                        logger.warning(f"通道级滤波失败 (ch {ch_idx_str}): {e}")
-
-            data_list = data.tolist()
-            output_channel_names = [display_channel_names[c]
-                                    for c in display_channels if c < len(display_channel_names)]
-
-        # 时间轴为等差数列，由前端按 start_sec/downsample/fs 重建（payload 减半）
-        actual_samples = len(data_list)
+    Returns:
+        (payload, output, sample_index)：payload 为响应元数据，output 为 (samples, channels)，
+        sample_index 仅 LTTB 降采样时非 None
+    """
+    metadata = info['metadata']
+    fs = metadata['sampling_freq']
+    start_sec, end_sec = params['start_sec'], params['end_sec']
+    display_channels = params['channels']
+    downsample, max_points, decimate = params['downsample'], params['max_points'], params['decimate']
+    filter_spec = params['filters']
 
-        return jsonify({
-            'file_id': file_id,
-            'start_sec': start_sec,
-            'end_sec': end_sec,
-            'channels': display_channels,
-            'channel_names': output_channel_names,
-            'downsample': downsample,
-            'num_samples': actual_samples,
-            'data': data_list,
-            'is_computed_mode': is_computed_mode,
-            # 数值与单位声明必须同源：后端路径的 currentData 此前不带 units，
-            # 导致 exportCSV 即便元数据已解析出 uV 也只能写"单位未知"（#27 入口 B）
-            'units': metadata.get('units', units_mod.UNKNOWN),
-            'channel_units': _output_units(metadata, output_channel_names,
-                                           display_channels, is_computed_mode)
-        })
+    # 转换为采样点索引
+    start_idx = max(0, int(start_sec * fs))
+    end_idx = min(metadata['num_samples'], int(end_sec * fs))
 
-    except Exception as e:
-        logger.error(f"数据读取失败: {e}")
-        return jsonify({'error': f'数据读取失败: {str(e)}'}), 500
+    # 缩小视图：无滤波的 minmax / lttb 请求直接取金字塔（构建中只服务水位线以内的窗口，
+    # 其余回退原始读取）。滤波不能作用在 min/max 包络上，有滤波时一律原始读取
+    num_display = metadata.get('display_num_channels', metadata['num_channels'])
+    if (max_points and decimate in ('minmax', 'lttb') and end_idx - start_idx > max_points
+            and not _has_filters(filter_spec)
+            and all(0 <= c < num_display for c in display_channels)):
+        pyramid = PYRAMIDS.get(info['path'])
+        tile = None
+        if pyramid is not None and decimate == 'lttb':
+            # LTTB 在更细的包络上选点；窗口不够长时退回 max_points 以内的包络
+            tile = pyramid.window(start_idx, end_idx, display_channels,
+                                  max_points * PYRAMID_LTTB_OVERSAMPLE)
+        if pyramid is not None and tile is None:
+            tile = pyramid.window(start_idx, end_idx, display_channels, max_points)
+        if tile is not None:
+            output, factor, first = tile
+            output_channel_names = _output_channel_names(metadata, display_channels)
+            sample_index = None
+            if decimate == 'lttb':
+                output, sample_index = _envelope_lttb(output, factor, max_points)
+                factor = 1
+            # 时间轴从对齐后的首桶起算（每桶 min+max 两点，间距 factor/(2*fs)；
+            # LTTB 的 sample_index 同样相对首桶）
+            payload = _data_payload(file_id, metadata, first / fs, end_sec,
+                                    display_channels, output_channel_names, output,
+                                    factor, decimate, source='pyramid')
+            return payload, output, sample_index
+
+    # 只读显示通道（及计算导联差分所需的 plus/minus 源通道）
+    if _has_filters(filter_spec):
+        # ★ 先滤波（使用原始采样率），再降采样 ★ 滤波结果按固定分块缓存，
+        # 分块两侧带重叠填充：来回平移命中缓存，窗口边缘也不再有滤波瞬态
+        output = FILTER_TILES.window(info, start_idx, end_idx, display_channels, filter_spec)
+    else:
+        source = _source_channels(metadata, display_channels)
+        output = _filter_window(_read_raw_window(info, start_idx, end_idx, source),
+                                metadata, display_channels, fs, filter_spec, source)
+    output_channel_names = _output_channel_names(metadata, display_channels)
+
+    # 使用 Min-Max 降采样保留峰值
+    output = minmax_downsample(output, downsample)
+
+    # 时间轴为等差数列，由前端按 start_sec/downsample/fs 重建（payload 减半）
+    output = np.asarray(output)
+    output = output.reshape(output.shape[0], -1)
+    sample_index = None
+    if max_points:
+        output, sample_index, downsample = decimate_to_points(output, max_points, decimate)
+    payload = _data_payload(file_id, metadata, start_sec, end_sec, display_channels,
+                            output_channel_names, output, downsample,
+                            decimate if max_points else ('minmax' if downsample > 1 else 'none'))
+    return payload, output, sample_index
 
 
 @ecg_api.route('/annotations/<file_id>', methods=['GET'])
@@ -1348,49 +2741,49 @@ def get_annotations(file_id):
     - start: 起始时间（秒），默认全部
     - end: 结束时间（秒），默认全部
     - type: 标注类型筛选
+    - offset / limit: 分页（在筛选之后），默认返回全部
+
+    返回按采样点排序；total 为分页前的匹配数，counts 为时间范围内各标签的数量。
     """
     if file_id not in FILE_CACHE:
         return jsonify({'error': '文件不存在或已过期'}), 404
 
     info = FILE_CACHE[file_id]
-    metadata = info['metadata']
-    annotations = info['annotations']
-    fs = metadata['sampling_freq']
 
     # 解析参数（滤波参数与标注无关，相关解析已移至 get_data）
-    start_sec = request.args.get('start')
-    end_sec = request.args.get('end')
-    annot_type = request.args.get('type')
-
-    # 筛选
-    result = []
-    for annot in annotations:
-        # 计算时间
-        sample = annot.get('sample', annot.get('position', 0))
-        time_sec = sample / fs if fs > 0 else 0
-
-        # 时间范围筛选
-        if start_sec is not None and time_sec < float(start_sec):
-            continue
-        if end_sec is not None and time_sec > float(end_sec):
-            continue
-
-        # 类型筛选
-        if annot_type and annot.get('label', '') != annot_type:
-            continue
-
-        result.append({
-            **annot,
-            'time_sec': time_sec
-        })
+    try:
+        start_sec, end_sec = (None if request.args.get(k) is None else float(request.args[k])
+                              for k in ('start', 'end'))
+        offset, limit = (_page_arg(request.args.get(k)) for k in ('offset', 'limit'))
+    except ValueError:
+        return jsonify({'error': 'start/end 须为数字，offset/limit 须为非负整数'}), 400
+    offset = offset or 0
+    annot_type = request.args.get('type') or None
+
+    index = _annotation_index(file_id, info)
+    positions, counts = index.query(start_sec, end_sec, annot_type)
+    page = positions[offset:] if limit is None else positions[offset:offset + limit]
 
     return jsonify({
         'file_id': file_id,
-        'annotations': result,
-        'total': len(result)
+        'annotations': index.records(page),
+        'total': int(len(positions)),
+        'offset': offset,
+        'limit': limit,
+        'counts': counts
     })
 
 
+def _page_arg(value):
+    """分页参数：未给出为 None，否则须为非负整数（ValueError）。"""
+    if value is None:
+        return None
+    count = int(value)
+    if count < 0:
+        raise ValueError(value)
+    return count
+
+
 @ecg_api.route('/cleanup/<file_id>', methods=['DELETE'])
 def cleanup_file(file_id):
     """清理临时文件"""
@@ -1398,12 +2791,8 @@ def cleanup_file(file_id):
         return jsonify({'message': '文件不存在'}), 200
 
     info = FILE_CACHE.pop(file_id)
-
     try:
-        # 只有在非本地文件（即上传的临时文件）时才物理删除
-        if not info.get('is_local', False) and os.path.exists(info['path']):
-            os.remove(info['path'])
-
+        _release_file(file_id, info)
         logger.info(f"文件已清理: {file_id}")
         return jsonify({'message': '文件已清理'})
     except Exception as e:
@@ -1415,8 +2804,16 @@ def cleanup_file(file_id):
 def cleanup_all():
     """清理所有临时文件"""
     count = 0
+    PREFETCHER.close()
+    for info in FILE_CACHE.values():
+        if not info.get('is_local', False):
+            PYRAMIDS.close(info['path'], remove=True)
+    PYRAMIDS.close()
+    H5_HANDLES.close()
+    FILTER_TILES.close()
     for file_id in list(FILE_CACHE.keys()):
         info = FILE_CACHE.pop(file_id)
+        _remove_decoded(info)
         try:
             # 本地文件（用户原始数据）只清缓存，不物理删除
             if not info.get('is_local', False) and os.path.exists(info['path']):
@@ -1,6 +1,42 @@
 import argparse
 
 
+def _output_formats(value):
+    """-fmt 接受逗号分隔的多个格式（如 h5,csv），一次读取多路写出；单个格式保持字符串。"""
+    formats = [item.strip() for item in value.split(",") if item.strip()]
+    return formats[0] if len(formats) == 1 else formats
+
+
+def _elapsed_seconds(value):
+    """流逝时刻：接受秒数或 H:MM:SS[.sss]。"""
+    if ":" in value:
+        from epycon.extraction import ExtractionError, parse_elapsed
+        try:
+            return parse_elapsed(value)
+        except ExtractionError as e:
+            raise argparse.ArgumentTypeError(str(e))
+    return float(value)
+
+
+def windows_from_args(args):
+    """窗口相关参数 → `data.windows` 片段（未给出任何窗口参数时为空字典）。"""
+    windows = {}
+    if getattr(args, "epoch_range", None):
+        windows["epoch_ranges"] = [list(r) for r in args.epoch_range]
+    if getattr(args, "elapsed_range", None):
+        windows["elapsed_ranges"] = [list(r) for r in args.elapsed_range]
+    if getattr(args, "around_group", None) or getattr(args, "around_pattern", None):
+        around = {"groups": args.around_group or []}
+        if args.around_pattern:
+            around["pattern"] = args.around_pattern
+        if args.before is not None:
+            around["before"] = args.before
+        if args.after is not None:
+            around["after"] = args.after
+        windows["around_entries"] = around
+    return windows
+
+
 def parse_arguments():
     """ Custom CLI definition
 
@@ -18,7 +54,7 @@ def parse_arguments():
     parser.add_argument("-s", "--studies", type=list,)
 
     # Output format of the waveforms
-    parser.add_argument("-fmt", "--output_format", type=str)
+    parser.add_argument("-fmt", "--output_format", type=_output_formats)
 
     # Output format of the entries/annotations
     parser.add_argument("-e", "--entries", type=bool,)
@@ -27,6 +63,17 @@ def parse_arguments():
     # Merge mode - combine multiple log files into one output
     parser.add_argument("--merge", action="store_true", help="Merge multiple log files into a single output file")
 
+    # Windowed conversion - convert only selected time ranges (union of all options)
+    parser.add_argument("--epoch-range", nargs=2, type=float, action="append", metavar=("START", "END"),
+                        help="Absolute epoch-second range to convert (repeatable)")
+    parser.add_argument("--elapsed-range", nargs=2, type=_elapsed_seconds, action="append",
+                        metavar=("START", "END"),
+                        help="Elapsed range (seconds or H:MM:SS) from the first log of the study (repeatable)")
+    parser.add_argument("--around-group", action="append", help="Convert windows around entries of this group")
+    parser.add_argument("--around-pattern", type=str, help="Convert windows around entries whose message matches")
+    parser.add_argument("--before", type=float, help="Seconds before each matching entry (default 10)")
+    parser.add_argument("--after", type=float, help="Seconds after each matching entry (default 10)")
+
     # Overwrite settings with custom config file
     parser.add_argument("--custom_config_path", type=str, help="Path to configuration file")
 
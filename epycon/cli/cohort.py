@@ -0,0 +1,311 @@
+"""多 study 批量提取（队列数据集构建）：按 CSV 清单并行提取，写入单个分块 HDF5。
+
+python -m epycon.cli.cohort --manifest cohort.csv --out cohort.h5 --leads II,V6 --window 2 --workers 8
+
+清单列：`study`（.log 目录或合并 HDF5，相对路径以清单所在目录为基准）、`time`
+（H:MM:SS 流逝时刻，或不含冒号的 epoch 秒；也接受列名 `at` / `epoch`），可选
+`leads`（逗号分隔，缺省用 --leads）。同一 study、同一导联集的行合为一个任务，
+交给进程池中的 `extract_windows`——study 只加载、校验一次，fail-closed 规则与单次
+提取完全相同。
+
+输出布局（按导联不等长存放，窗口可能被段边界裁剪）：
+- `Samples`：一维可扩展数据集（float32 µV，--raw-counts 时 int32），按块压缩；
+- `Windows`：每个 (清单行, 导联) 一条记录，`Offset`/`Count` 指向 `Samples` 中的切片；
+  `Study` / `Message` 为变长字符串，不截断。行级失败（含清单行缺列、时间无法识别）
+  记一条 `Status=error`、`Lead` 为空的记录，不中止其余行。
+
+断点续跑：每写完一个任务，向 `<out>.ledger` 追加一行 JSON（已完成行号与两个数据集的
+长度）。重跑时跳过账本中的行，并把数据集截回账本记录的长度，丢弃崩溃时写了一半的数据；
+`--restart` 丢弃已有输出从头开始。
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import h5py
+import numpy as np
+
+from epycon.cli.extract import _split_leads
+from epycon.extraction import ExtractionError, extract_windows
+
+SAMPLES_DNAME = "Samples"
+WINDOWS_DNAME = "Windows"
+SAMPLES_CHUNK = 1 << 16
+
+WINDOW_DTYPES = [
+    ("Row", "<i8"),
+    ("Study", h5py.string_dtype()),
+    ("Target", "S64"),
+    ("Epoch", "<f8"),
+    ("Log", "S16"),
+    ("Fs", "<f8"),
+    ("Lead", "S64"),
+    ("Status", "S16"),
+    ("Clipped", "?"),
+    ("Offset", "<i8"),
+    ("Count", "<i8"),
+    ("Message", h5py.string_dtype()),
+]
+
+
+def _bytes(text, size):
+    """定长 S 字段：UTF-8 编码后按字节截断（不截断半个多字节字符）。"""
+    return str(text).encode("utf-8")[:size].decode("utf-8", errors="ignore").encode("utf-8")
+
+
+def read_manifest(path, default_leads):
+    """清单 CSV → [(行号, study, 目标, 导联列表), ...]；行号从 0 起，供账本引用。
+
+    缺 study / time 或时间无法识别的行不抛错：目标记为 {"error", "raw"}，
+    由 `run_task` 转成该行的错误记录，其余行照常提取。"""
+    base = os.path.dirname(os.path.abspath(path))
+    rows = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        for i, rec in enumerate(reader):
+            rec = {(k or "").strip().lower(): (v or "").strip() for k, v in rec.items()}
+            study = rec.get("study")
+            when = rec.get("time") or rec.get("at") or rec.get("epoch")
+            if not study or not when:
+                target = {"error": f"清单第 {i + 2} 行缺少 study 或 time", "raw": when or ""}
+            elif ":" in when:
+                target = {"at": when}
+            else:
+                try:
+                    target = {"epoch": float(when)}
+                except ValueError:
+                    target = {"error": f"清单第 {i + 2} 行无法识别的时间 {when!r}", "raw": when}
+            leads = _split_leads(rec.get("leads")) or list(default_leads)
+            rows.append((i, os.path.normpath(os.path.join(base, study)) if study else "",
+                         target, leads))
+    return rows
+
+
+def plan_tasks(rows, done=()):
+    """按 (study, 导联集) 分组为任务，跳过账本中已完成的行。"""
+    done = set(done)
+    tasks = {}
+    for row, study, target, leads in rows:
+        if row in done:
+            continue
+        tasks.setdefault((study, tuple(leads)), []).append((row, target))
+    return [(study, list(leads), items) for (study, leads), items in tasks.items()]
+
+
+def run_task(task, options):
+    """进程池工作函数：一个 study 的一组目标 → (task, 逐行结果)。
+
+    清单阶段已判无效的行直接记错；study 级失败（段表、一致性、导联名，乃至任何
+    意外异常）转为该任务其余行的错误，不让单个 study 中止整次构建。"""
+    study, leads, items = task
+    results = [{"error": target["error"]} if "error" in target else None
+               for _, target in items]
+    targets = [target for _, target in items if "error" not in target]
+    if targets:
+        try:
+            found = iter(extract_windows(study, targets, leads=leads, **options)["results"])
+        except (ExtractionError, OSError) as e:
+            found = iter([{"error": str(e)}] * len(targets))
+        except Exception as e:
+            found = iter([{"error": f"{type(e).__name__}: {e}"}] * len(targets))
+        results = [r if r is not None else next(found) for r in results]
+    return task, results
+
+
+def _target_text(target):
+    if "at" in target:
+        return target["at"]
+    return repr(target["epoch"]) if "epoch" in target else target.get("raw", "")
+
+
+def _records(study, items, results, offset):
+    """逐行结果 → (Windows 记录列表, 待追加的样本数组列表)。"""
+    records, arrays = [], []
+    for (row, target), result in zip(items, results):
+        common = (row, study, _bytes(_target_text(target), 64))
+        if "error" in result:
+            records.append(common + (np.nan, b"", 0.0, b"", b"error", False, offset, 0,
+                                     result["error"]))
+            continue
+        head = (result["target"]["epoch"], _bytes(result["log"], 16), float(result["fs"]))
+        clipped = bool(result["returned_window"]["clipped"])
+        for ld in result["leads"]:
+            if ld["status"] != "ok":
+                records.append(common + head + (_bytes(ld["name"], 64), _bytes(ld["status"], 16),
+                                                clipped, offset, 0, ld.get("reason", "")))
+                continue
+            n = int(ld["n"])
+            records.append(common + head + (_bytes(ld["name"], 64), b"ok", clipped,
+                                            offset, n, ""))
+            arrays.append(ld["samples"])
+            offset += n
+    return np.array(records, dtype=WINDOW_DTYPES), arrays
+
+
+class CohortWriter:
+    """单写者：主进程按任务完成顺序追加到 HDF5，并在数据落盘后写账本。"""
+
+    def __init__(self, out_path, raw_counts, restart=False):
+        self.out_path = out_path
+        self.ledger_path = out_path + ".ledger"
+        if restart:
+            for p in (out_path, self.ledger_path):
+                if os.path.exists(p):
+                    os.remove(p)
+        resume = os.path.exists(out_path) and os.path.exists(self.ledger_path)
+        if not resume and os.path.exists(self.ledger_path):
+            os.remove(self.ledger_path)  # 输出已不在，账本作废
+        self.done, lengths = self._read_ledger() if resume else (set(), (0, 0))
+        self.h5 = h5py.File(out_path, "a" if resume else "w")
+        dtype = np.int32 if raw_counts else np.float32
+        if SAMPLES_DNAME not in self.h5:
+            self.h5.create_dataset(SAMPLES_DNAME, shape=(0,), maxshape=(None,), dtype=dtype,
+                                   chunks=(SAMPLES_CHUNK,), compression="gzip", shuffle=True)
+            self.h5.create_dataset(WINDOWS_DNAME, shape=(0,), maxshape=(None,),
+                                   dtype=WINDOW_DTYPES, chunks=(1024,))
+            self.h5.attrs["units"] = "counts" if raw_counts else "uV"
+        elif self.h5[SAMPLES_DNAME].dtype != dtype:
+            found = self.h5[SAMPLES_DNAME].dtype
+            self.h5.close()
+            raise ExtractionError(
+                f"{out_path} 的样本类型为 {found}，与本次 "
+                f"--raw-counts 设置不符；请使用 --restart 或换输出文件")
+        elif self.h5[WINDOWS_DNAME].dtype != np.dtype(WINDOW_DTYPES):
+            self.h5.close()
+            raise ExtractionError(
+                f"{out_path} 的 {WINDOWS_DNAME} 表为旧版布局（定长 Study/Message）；"
+                f"请使用 --restart 或换输出文件")
+        # 崩溃时可能已写入数据但未记账：截回账本记录的长度
+        self.h5[SAMPLES_DNAME].resize((lengths[0],))
+        self.h5[WINDOWS_DNAME].resize((lengths[1],))
+
+    def _read_ledger(self):
+        done, lengths, valid = set(), (0, 0), []
+        with open(self.ledger_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break  # 最后一行写了一半
+            valid.append(line if line.endswith("\n") else line + "\n")
+            done.update(entry["rows"])
+            lengths = (entry["samples"], entry["windows"])
+        if valid != lines:
+            with open(self.ledger_path, "w", encoding="utf-8") as f:
+                f.writelines(valid)
+        return done, lengths
+
+    def append(self, task, results):
+        """写入一个任务的结果；返回 (ok 行数, error 行数, 样本数)。"""
+        study, _, items = task
+        samples = self.h5[SAMPLES_DNAME]
+        windows = self.h5[WINDOWS_DNAME]
+        s0, w0 = samples.shape[0], windows.shape[0]
+        records, arrays = _records(study, items, results, s0)
+        n_samples = sum(a.shape[0] for a in arrays)
+        if n_samples:
+            samples.resize((s0 + n_samples,))
+            samples[s0:] = np.concatenate(arrays)
+        windows.resize((w0 + records.shape[0],))
+        windows[w0:] = records
+        self.h5.flush()
+        rows = [row for row, _ in items]
+        with open(self.ledger_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"study": study, "rows": rows, "samples": s0 + n_samples,
+                                "windows": w0 + records.shape[0]}, ensure_ascii=False) + "\n")
+        self.done.update(rows)
+        errors = sum(1 for r in results if "error" in r)
+        return len(items) - errors, errors, n_samples
+
+    def close(self):
+        self.h5.close()
+
+
+def build_cohort(manifest, out_path, leads=None, workers=None, restart=False,
+                 window=2.0, before=None, after=None, raw_unipolar=False,
+                 raw_counts=False, version=None, revalidate=False, progress=None):
+    """按清单构建数据集；返回吞吐统计。`progress` 为可选的逐任务回调 (dict) -> None。"""
+    started = time.perf_counter()
+    rows = read_manifest(manifest, leads or [])
+    options = {"window": window, "before": before, "after": after,
+               "raw_unipolar": raw_unipolar, "raw_counts": raw_counts, "version": version,
+               "revalidate": revalidate}
+    writer = CohortWriter(out_path, raw_counts, restart=restart)
+    skipped = len(writer.done & {row for row, *_ in rows})
+    tasks = plan_tasks(rows, writer.done)
+    stats = {"rows": len(rows), "skipped": skipped, "ok": 0, "errors": 0,
+             "tasks": len(tasks), "samples": 0}
+
+    def record(task, results):
+        ok, errors, n_samples = writer.append(task, results)
+        stats["ok"] += ok
+        stats["errors"] += errors
+        stats["samples"] += n_samples
+        if progress:
+            progress({"study": task[0], "ok": ok, "errors": errors,
+                      "elapsed_s": round(time.perf_counter() - started, 3)})
+
+    try:
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                record(*run_task(task, options))
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+                futures = [pool.submit(run_task, task, options) for task in tasks]
+                for future in as_completed(futures):
+                    record(*future.result())
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    itemsize = 4  # float32 / int32
+    stats.update({
+        "out": out_path,
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round((stats["ok"] + stats["errors"]) / elapsed, 2) if elapsed else None,
+        "mb_per_s": round(stats["samples"] * itemsize / 1e6 / elapsed, 3) if elapsed else None,
+    })
+    return stats
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m epycon.cli.cohort")
+    ap.add_argument("--manifest", required=True, help="CSV 清单：study,time[,leads]")
+    ap.add_argument("--out", required=True, help="输出 HDF5 路径（账本为 <out>.ledger）")
+    ap.add_argument("--leads", help="缺省导联（逗号分隔），清单行可用 leads 列覆盖")
+    ap.add_argument("--workers", type=int, help="进程数，缺省为 CPU 核数")
+    ap.add_argument("--restart", action="store_true", help="丢弃已有输出与账本，从头开始")
+    ap.add_argument("--window", type=float, default=2.0)
+    ap.add_argument("--before", type=float)
+    ap.add_argument("--after", type=float)
+    ap.add_argument("--raw-unipolar", action="store_true")
+    ap.add_argument("--raw-counts", action="store_true")
+    ap.add_argument("--version")
+    ap.add_argument("--revalidate", action="store_true", help="忽略一致性校验缓存，重新校验各 study")
+    ap.add_argument("--quiet", action="store_true", help="不在 stderr 输出逐任务进度")
+    args = ap.parse_args(argv)
+
+    def progress(info):
+        print(json.dumps(info, ensure_ascii=False), file=sys.stderr, flush=True)
+
+    try:
+        stats = build_cohort(
+            args.manifest, args.out, leads=_split_leads(args.leads), workers=args.workers,
+            restart=args.restart, window=args.window, before=args.before, after=args.after,
+            raw_unipolar=args.raw_unipolar, raw_counts=args.raw_counts, version=args.version,
+            revalidate=args.revalidate, progress=None if args.quiet else progress)
+    except (ExtractionError, OSError) as e:
+        print(json.dumps({"error": str(e)}, ensure_ascii=False), file=sys.stderr)
+        return 2
+    print(json.dumps(stats, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
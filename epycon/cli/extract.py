@@ -1,30 +1,75 @@
 """按时间戳提取指定导联波形的 CLI。见设计文档第 9 节。
 
 python -m epycon.cli.extract --study <dir> --at 1:07:15 --leads V6,"CS 3-4" --window 2
+python -m epycon.cli.extract --study <dir> --targets-file targets.txt --leads II --out batch.npz
+python -m epycon.cli.extract --study <dir> --epochs --group EVENT --match "RF on" --leads II --out rf.h5
+python -m epycon.cli.extract --serve    # 长驻：stdin 每行一个 JSON 请求，stdout 每行一个 JSON 响应
 """
 import sys
 import json
+import time
+import base64
 import argparse
 
 import numpy as np
 
-from epycon.extraction import extract_window, ExtractionError
+from epycon.extraction import (
+    extract_epochs, extract_window, extract_windows, ExtractionError, ExtractionSession,
+)
+
+
+ENCODINGS = ("list", "base64")
+
+
+def to_jsonable(obj, encoding="list"):
+    """结果中的 ndarray → 可 JSON 序列化的对象（仅在 stdout / HTTP 输出端调用）。
+
+    list：`tolist()` 一次转换；base64：{"dtype", "shape", "base64"}，dtype 为
+    numpy 小端描述符（"<f4" / "<i4"），客户端可直接 `np.frombuffer` 还原。"""
+    if isinstance(obj, np.ndarray):
+        if encoding == "base64":
+            arr = np.ascontiguousarray(obj, dtype=obj.dtype.newbyteorder("<"))
+            return {"dtype": arr.dtype.str, "shape": list(arr.shape),
+                    "base64": base64.b64encode(arr.tobytes()).decode("ascii")}
+        return obj.tolist()
+    if isinstance(obj, dict):
+        return {k: to_jsonable(v, encoding) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_jsonable(v, encoding) for v in obj]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
 
 
 def _build_parser():
     ap = argparse.ArgumentParser(prog="python -m epycon.cli.extract")
-    ap.add_argument("--study", required=True)
-    tgt = ap.add_mutually_exclusive_group(required=True)
+    ap.add_argument("--study", help=".log 目录，或 HDF5 转换产物（合并文件、逐段文件或逐段产物目录）")
+    tgt = ap.add_mutually_exclusive_group()
     tgt.add_argument("--at", help="流逝时刻 H:MM:SS[.sss]")
     tgt.add_argument("--epoch", type=float, help="绝对 epoch 秒")
-    ap.add_argument("--leads", required=True, help="逗号分隔导联名")
+    tgt.add_argument("--targets-file",
+                     help="批量目标：每行一个 H:MM:SS 或 epoch 秒（# 注释），或 JSON 数组")
+    tgt.add_argument("--epochs", action="store_true",
+                     help="事件锁定：对每条匹配的标注取窗，堆叠写入 --out（.npz 或 .h5）")
+    ap.add_argument("--group", action="append", help="--epochs 的标注分组过滤（可重复）")
+    ap.add_argument("--match", help="--epochs 的标注消息正则")
+    ap.add_argument("--between", nargs=2, metavar=("START", "END"),
+                    help="--epochs 的时间范围：H:MM:SS 流逝时刻或 epoch 秒")
+    ap.add_argument("--leads", help="逗号分隔导联名")
     ap.add_argument("--window", type=float, default=2.0)
     ap.add_argument("--before", type=float)
     ap.add_argument("--after", type=float)
     ap.add_argument("--raw-unipolar", action="store_true")
     ap.add_argument("--raw-counts", action="store_true")
     ap.add_argument("--version")
+    ap.add_argument("--revalidate", action="store_true",
+                    help="忽略已缓存的一致性校验结论，重新解析 entries.log 校验")
     ap.add_argument("--out", help="写 .npz 文件而非 stdout 全量")
+    ap.add_argument("--encoding", choices=ENCODINGS, default="list",
+                    help="stdout 中样本数组的编码：list 为 JSON 数组，base64 为小端二进制")
+    ap.add_argument("--serve", action="store_true",
+                    help="长驻会话：stdin 逐行读 JSON 请求（字段同上述参数），逐行写 JSON 响应")
+    ap.add_argument("--max-studies", type=int, default=8, help="会话内缓存的 study 数上限（LRU）")
     return ap
 
 
@@ -48,15 +93,230 @@ def _save_npz(path, result):
     return meta, actual
 
 
+def _read_targets(path):
+    """目标文件 → extract_windows 的 targets 列表。
+
+    JSON 数组原样使用（元素可为 {"at"|"epoch": ...}）；否则逐行解析，
+    含冒号为流逝时刻，其余按 epoch 秒。"""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    targets = []
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        if ":" in line:
+            targets.append({"at": line})
+        else:
+            try:
+                targets.append({"epoch": float(line)})
+            except ValueError:
+                raise ExtractionError(f"目标文件 {path} 中无法识别的行：{line!r}")
+    return targets
+
+
+def _save_batch_npz(path, batch):
+    """批量结果写 .npz：数组名 `<目标序号>/<导联名>`，_meta 为去掉样本的批量结果。"""
+    actual = str(path) if str(path).endswith(".npz") else str(path) + ".npz"
+    arrays = {}
+    results = []
+    for i, result in enumerate(batch["results"]):
+        if "error" in result:
+            results.append(result)
+            continue
+        for ld in result["leads"]:
+            if ld["status"] == "ok":
+                arrays[f"{i}/{ld['name']}"] = np.asarray(ld["samples"])
+        results.append(_meta_without_samples(result))
+    meta = {**batch, "results": results}
+    np.savez(actual, _meta=json.dumps(meta, ensure_ascii=False), **arrays)
+    return meta, actual
+
+
+EPOCH_ARRAYS = ("data", "mask", "railed", "overflow")
+
+
+def _save_epochs(path, epochs):
+    """堆叠结果写 .h5/.hdf5（数据集 data/mask/railed/overflow，元数据入属性）或 .npz。
+
+    返回 (meta, 实际写入路径)；meta 为去掉数组的结果。"""
+    meta = {k: v for k, v in epochs.items() if k not in EPOCH_ARRAYS}
+    meta["shape"] = list(epochs["data"].shape)
+    path = str(path)
+    if path.lower().endswith((".h5", ".hdf5")):
+        import h5py
+        with h5py.File(path, "w") as f:
+            f.create_dataset("data", data=epochs["data"], chunks=True)
+            f.create_dataset("mask", data=epochs["mask"])
+            f.create_dataset("railed", data=epochs["railed"])
+            f.create_dataset("overflow", data=epochs["overflow"])
+            f.attrs["meta"] = json.dumps(meta, ensure_ascii=False)
+            f.attrs["fs"] = epochs["fs"]
+            f.attrs["units"] = epochs["units"]
+        return meta, path
+    actual = path if path.endswith(".npz") else path + ".npz"
+    np.savez(actual, **{k: epochs[k] for k in EPOCH_ARRAYS},
+             _meta=json.dumps(meta, ensure_ascii=False))
+    return meta, actual
+
+
+def _main_epochs(args, leads):
+    try:
+        time_range = None
+        if args.between:
+            # 含冒号为流逝时刻，否则为 epoch 秒（同 --targets-file）
+            time_range = [x if ":" in x else float(x) for x in args.between]
+        epochs = extract_epochs(
+            args.study, leads=leads, groups=args.group, pattern=args.match,
+            time_range=time_range, window=args.window, before=args.before,
+            after=args.after, raw_unipolar=args.raw_unipolar,
+            raw_counts=args.raw_counts, version=args.version, revalidate=args.revalidate)
+        meta, actual = _save_epochs(args.out, epochs)
+    except (ExtractionError, OSError, ValueError) as e:
+        print(json.dumps({"error": str(e)}, ensure_ascii=False), file=sys.stderr)
+        return 2
+    meta["out"] = actual
+    print(json.dumps(meta, ensure_ascii=False))
+    return 0
+
+
+def _main_batch(args, leads):
+    try:
+        targets = _read_targets(args.targets_file)
+        batch = extract_windows(
+            args.study, targets, leads=leads, window=args.window,
+            before=args.before, after=args.after, raw_unipolar=args.raw_unipolar,
+            raw_counts=args.raw_counts, version=args.version, revalidate=args.revalidate)
+    except (ExtractionError, OSError, ValueError) as e:
+        print(json.dumps({"error": str(e)}, ensure_ascii=False), file=sys.stderr)
+        return 2
+    if args.out:
+        try:
+            meta, actual = _save_batch_npz(args.out, batch)
+        except OSError as e:
+            print(json.dumps({"error": f"写入 {args.out} 失败：{e}"},
+                             ensure_ascii=False), file=sys.stderr)
+            return 2
+        meta["out"] = actual
+        print(json.dumps(meta, ensure_ascii=False))
+    else:
+        print(json.dumps(to_jsonable(batch, args.encoding), ensure_ascii=False))
+    return 0
+
+
+def _split_leads(leads):
+    if isinstance(leads, str):
+        return [x.strip() for x in leads.split(",") if x.strip()]
+    return list(leads or [])
+
+
+def handle_request(session, request, allow_out=False):
+    """执行一个会话请求 → 响应字典（与单次 CLI 的 stdout 同形）。
+
+    `out` 会让服务端写文件到任意路径，只有本地 stdin 会话（`serve`）传 allow_out=True；
+    HTTP 前端保持默认，带 `out` 的请求直接报错，不写任何文件。
+
+    请求字段：study、leads（列表或逗号分隔）、at / epoch / targets（三选一）、
+    window、before、after、raw_unipolar、raw_counts、version、revalidate、out、encoding、id。
+    响应已 JSON 化（样本数组按 `encoding` 编码，见 `to_jsonable`），另带 `id`（原样回显）、`cached`（study 是否已在会话中）与 `latency_ms`。
+    任何失败都转为 {"error": ...}，会话继续服务后续请求。"""
+    started = time.perf_counter()
+    response = {}
+    try:
+        if not isinstance(request, dict):
+            raise ExtractionError("请求须为 JSON 对象")
+        if not request.get("study"):
+            raise ExtractionError("请求缺少 study")
+        if "out" in request and not allow_out:
+            raise ExtractionError("此接口不支持 out（服务端写文件）；请在本地 --serve 会话中使用")
+        encoding = request.get("encoding", "list")
+        if encoding not in ENCODINGS:
+            raise ExtractionError(f"未知的 encoding {encoding!r}，可选 {list(ENCODINGS)}")
+        kwargs = {
+            "leads": _split_leads(request.get("leads")),
+            "window": float(request.get("window", 2.0)),
+            "before": request.get("before"),
+            "after": request.get("after"),
+            "raw_unipolar": bool(request.get("raw_unipolar", False)),
+            "raw_counts": bool(request.get("raw_counts", False)),
+            "version": request.get("version"),
+            "revalidate": bool(request.get("revalidate", False)),
+        }
+        if "targets" in request:
+            batch = session.extract_windows(request["study"], request["targets"], **kwargs)
+            cached = batch.pop("cached")
+            if request.get("out"):
+                response, actual = _save_batch_npz(request["out"], batch)
+                response["out"] = actual
+            else:
+                response = batch
+        else:
+            batch = session.extract_windows(
+                request["study"], [{"at": request.get("at"), "epoch": request.get("epoch")}],
+                **kwargs)
+            cached = batch["cached"]
+            result = batch["results"][0]
+            if "error" in result:
+                raise ExtractionError(result["error"])
+            if request.get("out"):
+                response, actual = _save_npz(request["out"], result)
+                response["out"] = actual
+            else:
+                response = result
+        response = to_jsonable(response, encoding)
+        response["cached"] = cached
+    except (ExtractionError, OSError, ValueError, TypeError) as e:
+        response = {"error": str(e)}
+    if isinstance(request, dict) and "id" in request:
+        response["id"] = request["id"]
+    response["latency_ms"] = round((time.perf_counter() - started) * 1000.0, 3)
+    return response
+
+
+def serve(stdin, stdout, session):
+    """JSON-lines 循环：每行一个请求、每行一个响应，EOF 退出。"""
+    for line in stdin:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = {"error": f"请求不是合法 JSON：{e}", "latency_ms": 0.0}
+        else:
+            response = handle_request(session, request, allow_out=True)
+        stdout.write(json.dumps(response, ensure_ascii=False) + "\n")
+        stdout.flush()
+    return 0
+
+
 def main(argv=None):
-    args = _build_parser().parse_args(argv)
-    leads = [x.strip() for x in args.leads.split(",") if x.strip()]
+    ap = _build_parser()
+    args = ap.parse_args(argv)
+    if args.serve:
+        session = ExtractionSession(max_studies=args.max_studies)
+        try:
+            return serve(sys.stdin, sys.stdout, session)
+        finally:
+            session.close()
+    if not args.study or not args.leads:
+        ap.error("单次模式须提供 --study 与 --leads")
+    if args.at is None and args.epoch is None and not args.targets_file and not args.epochs:
+        ap.error("须提供 --at、--epoch、--targets-file 或 --epochs 之一")
+    if args.epochs and not args.out:
+        ap.error("--epochs 须配合 --out（.npz 或 .h5）")
+    leads = _split_leads(args.leads)
+    if args.epochs:
+        return _main_epochs(args, leads)
+    if args.targets_file:
+        return _main_batch(args, leads)
     try:
         result = extract_window(
             args.study, at_elapsed=args.at, at_epoch=args.epoch, leads=leads,
             window=args.window, before=args.before, after=args.after,
             raw_unipolar=args.raw_unipolar, raw_counts=args.raw_counts,
-            version=args.version)
+            version=args.version, revalidate=args.revalidate)
     except ExtractionError as e:
         print(json.dumps({"error": str(e)}, ensure_ascii=False), file=sys.stderr)
         return 2
@@ -70,7 +330,7 @@ def main(argv=None):
         meta["out"] = actual
         print(json.dumps(meta, ensure_ascii=False))
     else:
-        print(json.dumps(result, ensure_ascii=False))
+        print(json.dumps(to_jsonable(result, args.encoding), ensure_ascii=False))
     return 0
 
 
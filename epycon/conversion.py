@@ -5,10 +5,15 @@ int 截断亚秒、字段名漂移、x32 时间戳误读等），故收敛到本
 任何转换语义的修改只允许发生在这里。
 """
 import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime
 from glob import iglob
 
 from epycon.config.byteschema import MASTER_FILENAME, LOG_PATTERN
+from epycon.core.filters import StreamingDecimator, StreamingFilter, column_filter_specs
 from epycon.core.helpers import get_channel_mappings
 from epycon.iou import (
     LogParser,
@@ -81,6 +86,256 @@ def entries_to_marks(entries, datalog_id, file_start_sec, fs, file_sample_count,
     return marks
 
 
+def conversion_windows(cfg, entries, zero_epoch=None):
+    """`data.windows` → 合并、排序后的 epoch 区间 [(start, end), ...]。
+
+    未配置返回 None，表示整段转换；配置了但无命中则返回空列表（什么都不写）；
+    配置了 windows 却三种来源皆空抛 ValueError。三种来源取并集：
+    - epoch_ranges：绝对 epoch 秒 [start, end]
+    - elapsed_ranges：流逝秒，零点 = study 首段起点（与 extraction 一致），需 zero_epoch
+    - around_entries：匹配 groups / pattern（正则 search message）的标注 ±before/after 秒
+    """
+    spec = cfg["data"].get("windows") or {}
+    if not spec:
+        return None
+    if not (spec.get("epoch_ranges") or spec.get("elapsed_ranges")
+            or spec.get("around_entries") is not None):
+        # 配置了 windows 却没有任何来源：不可悄悄退回整段转换
+        raise ValueError("Invalid config: data.windows defines no windows "
+                         "(empty epoch_ranges/elapsed_ranges and no around_entries); "
+                         "omit data.windows to convert whole logs")
+    ranges = [(float(a), float(b)) for a, b in spec.get("epoch_ranges", [])]
+    elapsed = spec.get("elapsed_ranges", [])
+    if elapsed:
+        if zero_epoch is None:
+            raise ValueError("elapsed_ranges require the study start epoch")
+        ranges += [(zero_epoch + float(a), zero_epoch + float(b)) for a, b in elapsed]
+    around = spec.get("around_entries")
+    if around is not None:
+        groups = set(around.get("groups", []))
+        pattern = None
+        if around.get("pattern"):
+            try:
+                pattern = re.compile(around["pattern"])
+            except re.error as e:
+                raise ValueError(
+                    f"Invalid config: around_entries pattern {around['pattern']!r} "
+                    f"is not a valid regular expression: {e}")
+        before = float(around.get("before", 10.0))
+        after = float(around.get("after", 10.0))
+        for entry in entries or ():
+            if groups and entry.group not in groups:
+                continue
+            if pattern and not pattern.search(str(entry.message)):
+                continue
+            ts = float(entry.timestamp)
+            ranges.append((ts - before, ts + after))
+    ranges = sorted((a, b) for a, b in ranges if b > a)
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def segment_ranges(windows, file_start_sec, fs, num_samples):
+    """把 epoch 区间裁剪到单段 → 段内样本区间 [(s0, s1), ...]（半开，已排序）。
+
+    windows 为 None 时返回 [(0, None)]：整段读取。返回空列表表示该段无需读取。"""
+    if windows is None:
+        return [(0, None)]
+    result = []
+    for start, end in windows:
+        s0 = max(0, round((start - file_start_sec) * fs))
+        s1 = min(num_samples, round((end - file_start_sec) * fs))
+        if s1 > s0:
+            result.append((s0, s1))
+    return result
+
+
+def _piece_id(datalog_id, s0, s1):
+    """窗口输出的文件名主干；整段转换保持原 datalog_id。"""
+    return datalog_id if s1 is None else f"{datalog_id}_{s0}-{s1}"
+
+
+OUTPUT_PLANTERS = {"csv": CSVPlanter, "h5": HDFPlanter}
+
+
+def output_specs(cfg):
+    """`data.output_format` → 输出规格列表 [{"format": ...}, ...]。
+
+    兼容旧配置的单个字符串；列表项可为格式字符串或 {"format": ...} 规格对象，
+    规格对象可带 `sampling_freq`（该路输出的目标采样率，见 `output_rate`）。
+    同一格式只允许出现一次（否则多路写同一路径）。"""
+    raw = cfg["data"]["output_format"]
+    items = raw if isinstance(raw, list) else [raw]
+    specs = []
+    for item in items:
+        spec = dict(item) if isinstance(item, dict) else {"format": item}
+        if spec.get("format") not in OUTPUT_PLANTERS:
+            raise ValueError(f"Unsupported output format: {spec.get('format')}")
+        specs.append(spec)
+    formats = [spec["format"] for spec in specs]
+    if not specs or len(set(formats)) != len(formats):
+        raise ValueError(f"Output formats must be non-empty and unique: {formats}")
+    return specs
+
+
+def output_rate(spec, fs):
+    """输出规格 + 原生采样率 → (抽取因子 q, 输出采样率)。
+
+    只支持整数抽取（原生率须为目标率的整数倍，如 2000 → 500/250 Hz）；
+    未配置或等于原生率时 q = 1。"""
+    target = spec.get("sampling_freq")
+    if not target or target == fs:
+        return 1, fs
+    q = fs / target
+    if q < 1 or not float(q).is_integer():
+        raise ValueError(
+            f"Output sampling_freq {target} Hz must divide the native {fs} Hz by an integer")
+    return int(q), target
+
+
+def _rate_attributes(fs, q, fs_out):
+    """输出采样率相关的 HDF5 根属性；抽取时另记原生率与因子。"""
+    attributes = {"sampling_freq": fs_out}
+    if q > 1:
+        attributes.update({"NativeSamplingFreq": fs, "DecimationFactor": q})
+    return attributes
+
+
+def sel_sampling_freq(specs, rates, fs):
+    """`.sel` 标注导出所用的采样率：与首个 HDF5 输出一致（同名 .h5 内嵌的 Marks 同轴）；
+    没有 HDF5 输出时取原生采样率。与输出列表的顺序无关。"""
+    for spec, (_, rate) in zip(specs, rates):
+        if spec["format"] == "h5":
+            return rate
+    return fs
+
+
+def _resample_stage(q):
+    return StreamingDecimator(q) if q > 1 else None
+
+
+def _decimated_count(num_samples, q):
+    return -(-num_samples // q)
+
+
+def output_formats(cfg):
+    """配置中的全部输出格式（供入口判断是否需要读取标注等）。"""
+    return [spec["format"] for spec in output_specs(cfg)]
+
+
+def needs_entries(cfg):
+    """是否需要读取 entries.log：导出标注、HDF5 嵌入标注或按标注锚定窗口。"""
+    return bool(
+        cfg["entries"]["convert"]
+        or ("h5" in output_formats(cfg) and cfg["data"]["pin_entries"])
+        or (cfg["data"].get("windows") or {}).get("around_entries") is not None
+    )
+
+
+class PlanterFanout:
+    """一次读取、多路写出：把同一个已 mount 的 chunk 分发给多个 DatalogPlanter。
+
+    原始读取（常在网络存储上）是瓶颈，多格式输出不应各读一遍。
+    threaded=True 时每个 planter 独占一个写线程（保证该路写入顺序），每路最多一个
+    在途 chunk——读下一块与写上一块重叠，内存占用有界。planter 不会原地修改输入，
+    故各路共享同一数组是安全的。
+
+    stages 与 planters 一一对应（None 为直写），用于每路独立的重采样等有状态处理；
+    退出时先 flush 各级滞留样本再收尾。
+    """
+
+    def __init__(self, planters, threaded=False, stages=None):
+        self.planters = list(planters)
+        self.stages = list(stages) if stages is not None else [None] * len(self.planters)
+        self._executors = None
+        if threaded and len(self.planters) > 1:
+            self._executors = [ThreadPoolExecutor(max_workers=1) for _ in self.planters]
+        self._pending = [None] * len(self.planters)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        try:
+            if exc_type is None:
+                self._dispatch(self._flush_one, None)
+                self._drain()
+        finally:
+            for executor in self._executors or ():
+                executor.shutdown(wait=True, cancel_futures=True)
+        return False
+
+    @staticmethod
+    def _write_one(planter, stage, chunk):
+        if stage is not None:
+            chunk = stage.process(chunk)
+            if chunk is None:
+                return
+        planter.write(chunk)
+
+    @staticmethod
+    def _flush_one(planter, stage, _):
+        if stage is not None:
+            tail = stage.flush()
+            if tail is not None:
+                planter.write(tail)
+
+    def _dispatch(self, func, chunk):
+        if self._executors is None:
+            for planter, stage in zip(self.planters, self.stages):
+                func(planter, stage, chunk)
+            return
+        for i, executor in enumerate(self._executors):
+            if self._pending[i] is not None:
+                self._pending[i].result()  # 写线程的异常在此处抛回主线程
+            self._pending[i] = executor.submit(func, self.planters[i], self.stages[i], chunk)
+
+    def write(self, chunk):
+        self._dispatch(self._write_one, chunk)
+
+    def _drain(self):
+        for i, future in enumerate(self._pending):
+            if future is not None:
+                self._pending[i] = None
+                future.result()
+
+
+def _filter_stage(cfg, column_names, fs):
+    """按 `data.filters` 为本次读取构造流式滤波级；未配置返回 None。
+
+    每个段 / 窗口片段各建一个：段间时间不连续，状态不跨段传递。"""
+    specs = column_filter_specs(cfg["data"].get("filters"), column_names)
+    return StreamingFilter(specs, fs) if specs else None
+
+
+def _filter_attributes(cfg, column_names):
+    """滤波后的文件不再是原始计数的线性缩放，须在根属性声明所用滤波。"""
+    specs = column_filter_specs(cfg["data"].get("filters"), column_names)
+    if not specs:
+        return {}
+    return {"Filters": json.dumps(dict(zip(column_names, specs)), ensure_ascii=False)}
+
+
+def _mounted_chunks(parser, mappings, stage=None):
+    """parser → mount 后（可选再经滤波级）的 chunk 流；跳过滤波延迟造成的空块。"""
+    for chunk in parser:
+        chunk = mount_channels(chunk, mappings)
+        if stage is not None:
+            chunk = stage.process(chunk)
+            if chunk is None:
+                continue
+        yield chunk
+    if stage is not None:
+        tail = stage.flush()
+        if tail is not None:
+            yield tail
+
+
 def _planter_kwargs(cfg):
     """HDFPlanter 的压缩参数（GUI 配置可带 compression；CLI 配置缺省为 None）。"""
     return {
@@ -89,12 +344,46 @@ def _planter_kwargs(cfg):
     }
 
 
+def _make_planter(fmt, f_path, column_names, fs, attributes, cfg):
+    """按格式构造 planter：CSV 与 HDF5 共用 factor/units，HDF5 另带属性与压缩。"""
+    if fmt == "h5":
+        return HDFPlanter(
+            f_path,
+            column_names=column_names,
+            sampling_freq=fs,
+            factor=1000,
+            units="uV",
+            attributes=attributes,
+            **_planter_kwargs(cfg),
+        )
+    return OUTPUT_PLANTERS[fmt](
+        f_path,
+        column_names=column_names,
+        factor=1000,
+        units="uV",
+    )
+
+
 def _convert_merged(group_files, group_channel_count, multi_group, study_id, out_dir,
                     cfg, entries, base_attributes, logger):
-    """合并模式：一组同通道数的日志写入单个 HDF5，标注按合并时间轴落位。"""
+    """合并模式：一组同通道数的日志写入单个 HDF5，标注按合并时间轴落位。
+
+    合并轴抹掉了段间空档，故另写 `SegmentIndex`（每段起点 epoch、样本偏移、
+    样本数、fs、resolution），读取侧据此二分反推"墙钟时刻 → 样本"（#21）。
+    窗口转换时每个窗口片段各占一行索引（起点为片段首样本的 epoch）。
+    HDF5 规格带 `sampling_freq` 时合并轴、索引与标注均按输出采样率计。
+
+    合并只作用于 HDF5；同时配置的其他格式（如 CSV）在同一遍读取中按文件写出。
+    """
     first_mappings = group_files[0]['mappings']
     merged_column_names = list(first_mappings.keys())
-    first_timestamp = group_files[0]['timestamp']
+    fs_native = group_files[0]['header'].amp.sampling_freq
+    first_s0 = group_files[0].get('ranges', [(0, None)])[0][0]
+    first_timestamp = group_files[0]['timestamp'] + first_s0 / fs_native
+    specs = output_specs(cfg)
+    merged_spec = next(spec for spec in specs if spec["format"] == "h5")
+    per_file_specs = [spec for spec in specs if spec["format"] != "h5"]
+    q_merged, fs_merged = output_rate(merged_spec, fs_native)
 
     hdf_attributes = {
         **base_attributes,
@@ -103,8 +392,9 @@ def _convert_merged(group_files, group_channel_count, multi_group, study_id, out
         "RecordDate": datetime.fromtimestamp(first_timestamp).isoformat() if first_timestamp else "",
         "merged": True,
         "num_files": len(group_files),
-        "sampling_freq": group_files[0]['header'].amp.sampling_freq,
         "num_channels": len(merged_column_names),
+        **_rate_attributes(fs_native, q_merged, fs_merged),
+        **_filter_attributes(cfg, merged_column_names),
     }
 
     if multi_group:
@@ -112,66 +402,75 @@ def _convert_merged(group_files, group_channel_count, multi_group, study_id, out
     else:
         merged_output_path = os.path.join(out_dir, f"{study_id}_merged.h5")
 
-    is_first_file = True
     total_samples = 0
     accumulated_marks = []
+    segment_rows = []
 
-    for idx, dlog_info in enumerate(group_files):
-        datalog_path = dlog_info['path']
-        datalog_id = dlog_info['id']
-        header = dlog_info['header']
-        fs = header.amp.sampling_freq
-        file_start_sec = float(header.timestamp)
-
-        if logger:
-            logger.info(f"Merging {datalog_id} ({idx + 1}/{len(group_files)})")
-
-        # 写入本文件前，记录其在合并时间轴上的样本偏移
-        file_offset_samples = total_samples
+    with _make_planter("h5", merged_output_path, merged_column_names, fs_merged,
+                       hdf_attributes, cfg) as merged_planter:
+        for idx, dlog_info in enumerate(group_files):
+            datalog_path = dlog_info['path']
+            datalog_id = dlog_info['id']
+            header = dlog_info['header']
+            fs = header.amp.sampling_freq
+            q, _ = output_rate(merged_spec, fs)
 
-        with LogParser(
-            datalog_path,
-            version=cfg["global_settings"]["workmate_version"],
-            samplesize=cfg["global_settings"]["processing"]["chunk_size"],
-        ) as parser:
-            with HDFPlanter(
-                merged_output_path,
-                column_names=merged_column_names,
-                sampling_freq=fs,
-                factor=1000,
-                units="uV",
-                attributes=hdf_attributes if is_first_file else {},
-                append=not is_first_file,
-                **_planter_kwargs(cfg),
-            ) as planter:
-                file_sample_count = 0
-                for chunk in parser:
-                    chunk = mount_channels(chunk, dlog_info['mappings'])
-                    planter.write(chunk)
-                    file_sample_count += chunk.shape[0]
-                    total_samples += chunk.shape[0]
-                is_first_file = False
-
-        if cfg["data"]["pin_entries"] and entries:
-            accumulated_marks.extend(entries_to_marks(
-                entries, datalog_id, file_start_sec, fs, file_sample_count,
-                base_offset=file_offset_samples, logger=logger,
-            ))
-
-    if accumulated_marks and cfg["data"]["pin_entries"]:
-        positions, groups, messages = zip(*accumulated_marks)
-        with HDFPlanter(
-            merged_output_path,
-            column_names=merged_column_names,
-            append=True,
-        ) as marks_planter:
-            marks_planter.add_marks(
+            if logger:
+                logger.info(f"Merging {datalog_id} ({idx + 1}/{len(group_files)})")
+
+            for s0, s1 in dlog_info.get('ranges', [(0, None)]):
+                piece_start_sec = float(header.timestamp) + s0 / fs
+                # 写入本片段前，记录其在合并时间轴上的样本偏移
+                piece_offset_samples = total_samples
+
+                with ExitStack() as stack:
+                    parser = stack.enter_context(LogParser(
+                        datalog_path,
+                        version=cfg["global_settings"]["workmate_version"],
+                        samplesize=cfg["global_settings"]["processing"]["chunk_size"],
+                        start=s0,
+                        end=s1,
+                    ))
+                    piece_id = _piece_id(datalog_id, s0, s1)
+                    file_rates = [output_rate(spec, fs) for spec in per_file_specs]
+                    file_planters = [
+                        stack.enter_context(_make_planter(
+                            spec["format"], os.path.join(out_dir, piece_id + "." + spec["format"]),
+                            merged_column_names, rate, {}, cfg))
+                        for spec, (_, rate) in zip(per_file_specs, file_rates)
+                    ]
+                    fanout = stack.enter_context(PlanterFanout(
+                        [merged_planter, *file_planters],
+                        threaded=cfg["data"].get("writer_threads", False),
+                        stages=[_resample_stage(f) for f in (q, *(f for f, _ in file_rates))],
+                    ))
+                    stage = _filter_stage(cfg, merged_column_names, fs)
+                    native_count = 0
+                    for chunk in _mounted_chunks(parser, dlog_info['mappings'], stage):
+                        fanout.write(chunk)
+                        native_count += chunk.shape[0]
+
+                piece_sample_count = _decimated_count(native_count, q)
+                total_samples += piece_sample_count
+                segment_rows.append((datalog_id, piece_start_sec, piece_offset_samples,
+                                     piece_sample_count, fs_merged, header.amp.resolution))
+
+                if cfg["data"]["pin_entries"] and entries:
+                    accumulated_marks.extend(entries_to_marks(
+                        entries, datalog_id, piece_start_sec, fs_merged, piece_sample_count,
+                        base_offset=piece_offset_samples, logger=logger,
+                    ))
+
+        merged_planter.add_segment_index(segment_rows)
+        if accumulated_marks and cfg["data"]["pin_entries"]:
+            positions, groups, messages = zip(*accumulated_marks)
+            merged_planter.add_marks(
                 positions=list(positions),
                 groups=list(groups),
                 messages=list(messages),
             )
-        if logger:
-            logger.info(f"   ✅ Total {len(accumulated_marks)} entries injected into merged file")
+            if logger:
+                logger.info(f"   ✅ Total {len(accumulated_marks)} entries injected into merged file")
 
     if logger:
         logger.info(f"Merged {len(group_files)} files into {merged_output_path} ({total_samples} total samples)")
@@ -179,18 +478,37 @@ def _convert_merged(group_files, group_channel_count, multi_group, study_id, out
 
 
 def _convert_single(datalog_path, datalog_id, study_id, out_dir, cfg, entries,
-                    entryplanter, base_attributes, logger):
-    """常规模式：单个日志输出 CSV/HDF5，并按配置嵌入标注、导出标注文件。"""
-    output_fmt = cfg["data"]["output_format"]
+                    entryplanter, base_attributes, logger, ranges=None):
+    """常规模式：单个日志一次读取、按配置的全部格式写出，并嵌入/导出标注。
+
+    ranges 为段内样本区间列表（见 `segment_ranges`）：每个区间只读对应字节范围，
+    写成独立文件 `<datalog_id>_<s0>-<s1>.*`，Timestamp 与标注位置都相对区间首样本。
+    """
+    pieces = [(0, None)] if ranges is None else ranges
+    for s0, s1 in pieces:
+        _convert_piece(
+            datalog_path, datalog_id, s0, s1, out_dir, cfg, entries,
+            entryplanter, base_attributes, logger,
+        )
+    return 1 if pieces else 0
+
+
+def _convert_piece(datalog_path, datalog_id, s0, s1, out_dir, cfg, entries,
+                   entryplanter, base_attributes, logger):
+    """读取并写出单个日志的 [s0, s1) 样本区间（s1 为 None 即到文件尾）。"""
+    specs = output_specs(cfg)
+    piece_id = _piece_id(datalog_id, s0, s1)
 
     with LogParser(
         datalog_path,
         version=cfg["global_settings"]["workmate_version"],
         samplesize=cfg["global_settings"]["processing"]["chunk_size"],
+        start=s0,
+        end=s1,
     ) as parser:
         header = parser.get_header()
-        ref_timestamp = header.timestamp
         fs = header.amp.sampling_freq
+        ref_timestamp = header.timestamp + s0 / fs
 
         mappings = get_channel_mappings(header, cfg)
         if cfg["data"]["channels"]:
@@ -198,59 +516,66 @@ def _convert_single(datalog_path, datalog_id, study_id, out_dir, cfg, entries,
             mappings = {key: value for key, value in mappings.items() if key in valid_channels}
         column_names = list(mappings.keys())
 
-        if output_fmt == "csv":
-            DataPlanter = CSVPlanter
-        elif output_fmt == "h5":
-            DataPlanter = HDFPlanter
-        else:
-            raise ValueError(f"Unsupported output format: {output_fmt}")
-
-        full_output_path = os.path.join(out_dir, datalog_id + "." + output_fmt)
-
         hdf_attributes = {
             **base_attributes,
             "LogID": datalog_id,
-            "sampling_freq": fs,
             "num_channels": len(column_names),
             "Timestamp": ref_timestamp,
+            # nV/LSb：读取侧据此把 µV 无损还原为原始计数（合并文件记在 SegmentIndex）
+            "Resolution": header.amp.resolution,
             "RecordDate": datetime.fromtimestamp(ref_timestamp).isoformat() if ref_timestamp else "",
+            **_filter_attributes(cfg, column_names),
         }
-
-        planter_kwargs = _planter_kwargs(cfg) if output_fmt == "h5" else {}
-        with DataPlanter(
-            f_path=full_output_path,
-            column_names=column_names,
-            sampling_freq=fs,
-            factor=1000,
-            units="uV",
-            attributes=hdf_attributes if output_fmt == "h5" else {},
-            **planter_kwargs,
-        ) as planter:
-            num_samples_written = 0
-            for chunk in parser:
-                chunk = mount_channels(chunk, mappings)
-                planter.write(chunk)
-                num_samples_written += chunk.shape[0]
-
-            if cfg["data"]["pin_entries"] and entries and hasattr(planter, "add_marks"):
-                valid_marks = entries_to_marks(
-                    entries, datalog_id, ref_timestamp, fs, num_samples_written,
-                    logger=logger,
-                )
-                if valid_marks:
-                    positions, groups, messages = zip(*valid_marks)
-                    planter.add_marks(
-                        positions=list(positions),
-                        groups=list(groups),
-                        messages=list(messages),
+        if s1 is not None:
+            hdf_attributes.update({"WindowStartSample": s0, "WindowEndSample": s1})
+
+        rates = [output_rate(spec, fs) for spec in specs]
+        with ExitStack() as stack:
+            planters = [
+                stack.enter_context(_make_planter(
+                    spec["format"], os.path.join(out_dir, piece_id + "." + spec["format"]),
+                    column_names, rate,
+                    {**hdf_attributes, **_rate_attributes(fs, q, rate)}, cfg))
+                for spec, (q, rate) in zip(specs, rates)
+            ]
+            with PlanterFanout(planters, threaded=cfg["data"].get("writer_threads", False),
+                               stages=[_resample_stage(q) for q, _ in rates]) as fanout:
+                num_samples_written = 0
+                stage = _filter_stage(cfg, column_names, fs)
+                for chunk in _mounted_chunks(parser, mappings, stage):
+                    fanout.write(chunk)
+                    num_samples_written += chunk.shape[0]
+
+            # 标注按各路自己的输出采样率落位（同一时刻在 2 kHz 与 500 Hz 文件中位置不同）
+            markable = [(planter, q, rate) for planter, (q, rate) in zip(planters, rates)
+                        if hasattr(planter, "add_marks")]
+            if cfg["data"]["pin_entries"] and entries and markable:
+                for i, (planter, q, rate) in enumerate(markable):
+                    valid_marks = entries_to_marks(
+                        entries, datalog_id, ref_timestamp, rate,
+                        _decimated_count(num_samples_written, q),
+                        logger=logger if i == 0 else None,
                     )
-                    if logger:
-                        logger.info(f"   ✅ Injected {len(valid_marks)} entries for {datalog_id}")
-                elif logger:
-                    logger.info(f"   ℹ️ No valid entries to inject for {datalog_id}")
-
-    # 按文件导出标注（csv/sel）
+                    if valid_marks:
+                        positions, groups, messages = zip(*valid_marks)
+                        planter.add_marks(
+                            positions=list(positions),
+                            groups=list(groups),
+                            messages=list(messages),
+                        )
+                    if logger and valid_marks:
+                        logger.info(f"   ✅ Injected {len(valid_marks)} entries for {piece_id} @ {rate} Hz")
+                    elif logger:
+                        logger.info(f"   ℹ️ No valid entries to inject for {piece_id} @ {rate} Hz")
+
+    # 按文件导出标注（csv/sel）；窗口片段只导出落在片段内的标注
     if cfg["entries"]["convert"] and entries:
+        if s1 is not None:
+            piece_end = ref_timestamp + num_samples_written / fs
+            entryplanter = EntryPlanter([
+                entry for entry in entries
+                if ref_timestamp <= float(entry.timestamp) < piece_end
+            ])
         criteria = {
             "fids": [datalog_id],
             "groups": cfg["entries"]["filter_annotation_type"],
@@ -259,24 +584,58 @@ def _convert_single(datalog_path, datalog_id, study_id, out_dir, cfg, entries,
         try:
             if file_fmt == "csv":
                 entryplanter.savecsv(
-                    os.path.join(out_dir, datalog_id + "." + file_fmt),
+                    os.path.join(out_dir, piece_id + "." + file_fmt),
                     criteria=criteria,
                     ref_timestamp=ref_timestamp,
                 )
             elif file_fmt == "sel":
                 entryplanter.savesel(
-                    os.path.join(out_dir, datalog_id + "." + file_fmt),
+                    os.path.join(out_dir, piece_id + "." + file_fmt),
                     ref_timestamp,
-                    fs,
+                    sel_sampling_freq(specs, rates, fs),
                     column_names,
                     criteria=criteria,
                 )
         except Exception as e:
             if logger:
-                logger.error(f"   ❌ Error exporting entry file for {datalog_id}: {e}")
+                logger.error(f"   ❌ Error exporting entry file for {piece_id}: {e}")
     return 1
 
 
+def _read_datalog_info(datalogs, cfg, logger=None):
+    """只读文件头：[(path, id)] → [{path, id, timestamp, header, mappings, ...}]。
+
+    读不到头的日志记警告并跳过。"""
+    datalog_info = []
+    for datalog_path, datalog_id in datalogs:
+        with LogParser(
+            datalog_path,
+            version=cfg["global_settings"]["workmate_version"],
+            samplesize=1024,
+        ) as parser:
+            header = parser.get_header()
+            if header is None:
+                if logger:
+                    logger.warning(f"⚠️ Cannot read header: {datalog_id}.log, skipping")
+                continue
+
+            file_mappings = get_channel_mappings(header, cfg)
+            if cfg["data"]["channels"]:
+                valid_channels = set(cfg["data"]["channels"])
+                file_mappings = {k: v for k, v in file_mappings.items() if k in valid_channels}
+
+            datalog_info.append({
+                'path': datalog_path,
+                'id': datalog_id,
+                'timestamp': header.timestamp,
+                'header': header,
+                'mappings': file_mappings,
+                'num_output_channels': len(file_mappings),
+                'num_samples': parser.num_samples,
+            })
+    return datalog_info
+
+
 def convert_study(study_path, study_id, out_dir, cfg, entries,
                   subject_id="", subject_name="", logger=None,
                   extra_attributes=None):
@@ -314,40 +673,33 @@ def convert_study(study_path, study_id, out_dir, cfg, entries,
     base_attributes.update(extra_attributes or {})
 
     merge_mode = cfg["data"].get("merge_logs", False)
-    output_fmt = cfg["data"]["output_format"]
     processed = 0
 
-    if merge_mode and output_fmt == "h5":
+    windows = None
+    if cfg["data"].get("windows"):
+        # 流逝秒零点 = 目录内全部 .log 的最早起点（不受 data_files 过滤影响，与 extraction 一致）
+        zero_epoch = None
+        if cfg["data"]["windows"].get("elapsed_ranges"):
+            zero_epoch = min(info['timestamp'] for info in
+                             _read_datalog_info(list_datalogs(study_path), cfg, logger))
+        windows = conversion_windows(cfg, entries, zero_epoch)
+        if logger:
+            logger.info(f"Windowed conversion: {len(windows)} window(s)")
+
+    if merge_mode and "h5" in output_formats(cfg):
         # 读取所有文件头，按时间排序并按通道数分组
         from collections import defaultdict
 
-        datalog_info = []
-        for datalog_path, datalog_id in all_datalogs:
-            with LogParser(
-                datalog_path,
-                version=cfg["global_settings"]["workmate_version"],
-                samplesize=1024,
-            ) as parser:
-                header = parser.get_header()
-                if header is None:
-                    if logger:
-                        logger.warning(f"⚠️ Cannot read header: {datalog_id}.log, skipping")
-                    continue
-
-                file_mappings = get_channel_mappings(header, cfg)
-                if cfg["data"]["channels"]:
-                    valid_channels = set(cfg["data"]["channels"])
-                    file_mappings = {k: v for k, v in file_mappings.items() if k in valid_channels}
-
-                datalog_info.append({
-                    'path': datalog_path,
-                    'id': datalog_id,
-                    'timestamp': header.timestamp,
-                    'header': header,
-                    'mappings': file_mappings,
-                    'num_output_channels': len(file_mappings),
-                    'num_samples': parser.num_samples,
-                })
+        datalog_info = _read_datalog_info(all_datalogs, cfg, logger)
+        for info in datalog_info:
+            info['ranges'] = segment_ranges(
+                windows, info['timestamp'], info['header'].amp.sampling_freq, info['num_samples'])
+        # 与任何窗口都不相交的段整段跳过，不读数据
+        datalog_info = [info for info in datalog_info if info['ranges']]
+        if not datalog_info:
+            if logger:
+                logger.warning(f"No data inside the requested windows in {study_id}")
+            return 0
 
         datalog_info.sort(key=lambda x: x['timestamp'])
 
@@ -369,12 +721,23 @@ def convert_study(study_path, study_id, out_dir, cfg, entries,
             )
     else:
         entryplanter = EntryPlanter(entries)
+        ranges_by_path = {}
+        if windows is not None:
+            ranges_by_path = {
+                info['path']: segment_ranges(
+                    windows, info['timestamp'], info['header'].amp.sampling_freq,
+                    info['num_samples'])
+                for info in _read_datalog_info(all_datalogs, cfg, logger)
+            }
         for datalog_path, datalog_id in all_datalogs:
+            ranges = ranges_by_path.get(datalog_path, []) if windows is not None else None
+            if ranges == []:
+                continue
             if logger:
                 logger.info(f"Converting {datalog_id}")
             processed += _convert_single(
                 datalog_path, datalog_id, study_id, out_dir, cfg, entries,
-                entryplanter, base_attributes, logger,
+                entryplanter, base_attributes, logger, ranges=ranges,
             )
 
     return processed
@@ -0,0 +1,268 @@
+"""转换期流式滤波：跨 chunk 连续的 SOS 滤波级（唯一实现）。
+
+查看器（`api_ecg`）的陷波/低通/高通只在显示路径上按窗口 filtfilt，每次平移都重算；
+这里在转换时一次性写出预滤波数据，下游查看与分析脚本不再重复滤波。
+
+- **causal**：`sosfilt` 逐 chunk 运行，状态 `zi` 在 chunk 间传递，边界无缝，
+  结果与整段一次 `sosfilt` 逐样本一致（首样本按稳态初始化，同 `api_ecg._apply_sos`）。
+- **zero_phase**：`sosfiltfilt` 不能真正流式（反向需要未来样本）。每块带左右各
+  `overlap` 秒的原始上下文一起滤，只保留中间部分（overlap-save）；输出因此滞后
+  `overlap` 秒，`flush()` 补齐尾部。与整段 filtfilt 的差异随 overlap 指数衰减，
+  须取滤波器最长时间常数的十几倍以上（低截止高通最慢）。
+
+滤波规格按导联配置，同规格的列合并成一组向量化处理；各组输出长度可能不同步
+（零相位组滞后），`StreamingFilter` 只放出所有组都已就绪的样本，保证写出的行对齐。
+
+scipy 为可选依赖：未安装时配置了滤波即报错，不静默输出未滤波数据。
+"""
+import json
+from functools import lru_cache
+
+import numpy as np
+
+try:
+    from scipy import signal as scipy_signal
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+FILTER_KINDS = ('notch', 'highpass', 'lowpass')
+
+# 0.5 Hz 高通的边缘瞬态约按 e^(-t/0.3s) 衰减：5 s 上下文的拼接误差约为幅值的 1e-5
+DEFAULT_OVERLAP_SEC = 5.0
+
+
+def _spec_key(spec):
+    """滤波规格 → 可哈希键（分组与系数缓存共用）。"""
+    return json.dumps(spec, sort_keys=True)
+
+
+@lru_cache(maxsize=64)
+def _design_sos(key, fs):
+    spec = json.loads(key)
+    sections = []
+    notch = spec.get('notch')
+    if notch:
+        for k in range(1, int(notch.get('harmonics', 1)) + 1):
+            freq = float(notch['freq']) * k
+            if freq >= fs / 2:
+                break  # 超过奈奎斯特频率
+            b, a = scipy_signal.iirnotch(freq, float(notch.get('q', 35.0)), fs)
+            sections.append(scipy_signal.tf2sos(b, a))
+    for kind, btype in (('highpass', 'high'), ('lowpass', 'low')):
+        params = spec.get(kind)
+        if not params:
+            continue
+        cutoff = float(params['cutoff'])
+        if not 0 < cutoff < fs / 2:
+            raise ValueError(f"{kind} cutoff {cutoff} Hz must lie in (0, {fs / 2}) Hz")
+        sections.append(scipy_signal.butter(
+            int(params.get('order', 2)), cutoff, btype=btype, fs=fs, output='sos'))
+    if not sections:
+        return None
+    return np.vstack(sections)
+
+
+def design_sos(spec, fs):
+    """{notch, highpass, lowpass} 规格 → 级联 SOS 矩阵；规格不含任何滤波器时返回 None。"""
+    if not SCIPY_AVAILABLE:
+        raise ImportError("scipy is required for conversion filters (data.filters)")
+    spec = {kind: spec.get(kind) for kind in FILTER_KINDS if spec.get(kind)}
+    return _design_sos(_spec_key(spec), float(fs))
+
+
+class _Passthrough:
+    def process(self, x):
+        return x
+
+    def flush(self):
+        return None
+
+
+class _CausalSection:
+    """sosfilt + 跨 chunk 状态传递。"""
+
+    def __init__(self, sos):
+        self.sos = sos
+        self.zi = None
+
+    def process(self, x):
+        if self.zi is None:
+            # 稳态初始化：避免首样本的阶跃瞬态
+            self.zi = scipy_signal.sosfilt_zi(self.sos)[:, :, np.newaxis] * x[0]
+        y, self.zi = scipy_signal.sosfilt(self.sos, x, axis=0, zi=self.zi)
+        return y
+
+    def flush(self):
+        return None
+
+
+class _ZeroPhaseSection:
+    """带左右上下文的分块 sosfiltfilt（overlap-save），输出滞后 `pad` 个样本。"""
+
+    def __init__(self, sos, pad):
+        self.sos = sos
+        self.pad = max(1, int(pad))
+        self.buf = None    # 左上下文 + 待输出样本（原始值）
+        self.n_left = 0    # buf 开头属于左上下文（已输出过）的样本数
+
+    def _filtfilt(self, x):
+        padlen = min(3 * (2 * len(self.sos) + 1), x.shape[0] - 1)
+        return scipy_signal.sosfiltfilt(self.sos, x, axis=0, padlen=padlen)
+
+    def process(self, x):
+        self.buf = x if self.buf is None else np.concatenate([self.buf, x])
+        emit_end = self.buf.shape[0] - self.pad  # 保留 pad 个样本作右上下文
+        if emit_end <= self.n_left:
+            return None
+        y = self._filtfilt(self.buf)[self.n_left:emit_end]
+        keep_from = max(0, emit_end - self.pad)
+        self.buf = self.buf[keep_from:]
+        self.n_left = emit_end - keep_from
+        return y
+
+    def flush(self):
+        if self.buf is None or self.buf.shape[0] <= self.n_left:
+            return None
+        y = self._filtfilt(self.buf)[self.n_left:]
+        self.buf = None
+        return y
+
+
+class StreamingFilter:
+    """(samples, columns) chunk 流上的逐列滤波级。
+
+    Args:
+        column_specs: 每列一个规格字典（或 None 表示不滤波），规格见 `design_sos`，
+            另可带 `zero_phase` (bool) 与 `overlap`（秒，仅零相位使用）。
+        fs: 采样率 (Hz)
+    """
+
+    def __init__(self, column_specs, fs):
+        groups = {}
+        for col, spec in enumerate(column_specs):
+            groups.setdefault(_spec_key(spec) if spec else None, []).append(col)
+        self.num_columns = len(column_specs)
+        self._groups = []
+        for key, cols in groups.items():
+            spec = json.loads(key) if key else {}
+            sos = design_sos(spec, fs) if spec else None
+            if sos is None:
+                section = _Passthrough()
+            elif spec.get('zero_phase', False):
+                section = _ZeroPhaseSection(
+                    sos, round(float(spec.get('overlap', DEFAULT_OVERLAP_SEC)) * fs))
+            else:
+                section = _CausalSection(sos)
+            self._groups.append((np.asarray(cols), section, []))
+
+    def _collect(self, outputs):
+        for (_, _, queue), y in zip(self._groups, outputs):
+            if y is not None and y.shape[0]:
+                queue.append(y)
+        ready = min(sum(y.shape[0] for y in queue) for _, _, queue in self._groups)
+        if ready == 0:
+            return None
+        out = None
+        for cols, _, queue in self._groups:
+            stacked = np.concatenate(queue) if len(queue) > 1 else queue[0]
+            if out is None:
+                out = np.empty((ready, self.num_columns), dtype=np.result_type(stacked, np.float64))
+            out[:, cols] = stacked[:ready]
+            queue[:] = [stacked[ready:]] if stacked.shape[0] > ready else []
+        return out
+
+    def process(self, chunk):
+        """滤波一个 chunk；返回已就绪的输出行（可能比输入少，甚至为 None）。"""
+        chunk = np.asarray(chunk, dtype=np.float64)
+        return self._collect([section.process(chunk[:, cols])
+                              for cols, section, _ in self._groups])
+
+    def flush(self):
+        """输入结束：放出所有滞留样本。"""
+        return self._collect([section.flush() for _, section, _ in self._groups])
+
+
+class StreamingDecimator:
+    """跨 chunk 的抗混叠多相整数抽取。
+
+    结果与整段一次 `scipy.signal.resample_poly(x, 1, q, padtype='edge')` 逐样本一致。
+
+    线性相位 FIR（Kaiser β=5，20q+1 阶，截止 = 目标奈奎斯特）只在保留的输出点上求值
+    （`upfirdn` 多相实现），第 k 个输出对齐输入第 kq 个样本——群延迟已补偿，
+    标注按 `round(t × fs_out)` 换算即可落位。两端按首/末样本延拓；输入跨 chunk 保留
+    FIR 长度的历史，任意分块的结果一致，共输出 ceil(N / q) 个样本。
+    """
+
+    def __init__(self, factor):
+        if not SCIPY_AVAILABLE:
+            raise ImportError("scipy is required for output resampling (sampling_freq)")
+        self.q = int(factor)
+        if self.q < 2:
+            raise ValueError(f"decimation factor must be >= 2, got {factor}")
+        self.half = 10 * self.q
+        self.h = scipy_signal.firwin(2 * self.half + 1, 1.0 / self.q, window=('kaiser', 5.0))
+        # 卷积下标 (k - k0)q + 2·half + lead 须是 q 的倍数，lead 为段首额外多取的样本数
+        self.lead = (-2 * self.half) % self.q
+        self.buf = None        # 原始输入（含左侧延拓）
+        self.buf_start = 0     # buf[0] 的绝对输入下标（延拓部分为负）
+        self.next_out = 0      # 下一个待输出的 k
+        self.num_in = 0        # 已收到的真实输入样本数
+
+    def _pad(self, edge):
+        return np.repeat(edge[np.newaxis], self.half + self.q, axis=0)
+
+    def _emit(self, limit):
+        """输出所有满足 k·q + half < buf 末端 且 k < limit 的点。"""
+        buf_end = self.buf_start + self.buf.shape[0]
+        k1 = min(limit, (buf_end - 1 - self.half) // self.q + 1)
+        if k1 <= self.next_out:
+            return None
+        k0 = self.next_out
+        seg_from = k0 * self.q - self.half - self.lead - self.buf_start
+        seg_to = (k1 - 1) * self.q + self.half + 1 - self.buf_start
+        y = scipy_signal.upfirdn(self.h, self.buf[seg_from:seg_to], up=1, down=self.q, axis=0)
+        first = (2 * self.half + self.lead) // self.q
+        y = y[first:first + (k1 - k0)]
+        self.next_out = k1
+        keep_from = k1 * self.q - self.half - self.lead - self.buf_start
+        self.buf = self.buf[keep_from:]
+        self.buf_start += keep_from
+        return y
+
+    def process(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if x.shape[0] == 0:
+            return None
+        if self.buf is None:
+            self.buf = self._pad(x[0])
+            self.buf_start = -self.buf.shape[0]
+        self.buf = np.concatenate([self.buf, x])
+        self.num_in += x.shape[0]
+        return self._emit(limit=np.iinfo(np.int64).max)
+
+    def flush(self):
+        if self.buf is None:
+            return None
+        self.buf = np.concatenate([self.buf, self._pad(self.buf[-1])])
+        return self._emit(limit=-(-self.num_in // self.q))
+
+
+def column_filter_specs(filters_cfg, column_names):
+    """`data.filters` 配置 → 逐列规格列表；未启用任何滤波时返回 None。
+
+    `default` 作用于所有列，`leads` 按列名覆盖（值为 null 表示该列不滤波）；
+    全局 `zero_phase` / `overlap` 作为各规格的缺省值。
+    """
+    if not filters_cfg:
+        return None
+    shared = {k: filters_cfg[k] for k in ('zero_phase', 'overlap') if k in filters_cfg}
+    default = filters_cfg.get('default')
+    leads = filters_cfg.get('leads', {})
+    specs = []
+    for name in column_names:
+        spec = leads[name] if name in leads else default
+        specs.append({**shared, **spec} if spec else None)
+    if not any(spec and any(spec.get(kind) for kind in FILTER_KINDS) for spec in specs):
+        return None
+    return specs
@@ -0,0 +1,105 @@
+"""段级墙钟时间索引：合并 HDF5 的 `SegmentIndex` 契约与 epoch→样本 映射（唯一实现）。
+
+背景（KNOWN_ISSUES #21）：合并文件的时间轴是"累计录制样本"，段间空档被抹掉，
+只凭首段 `Timestamp` 无法把墙钟时刻换回样本。本模块定义写入合并文件的紧凑索引——
+每段一行 `(SegmentID, StartEpoch, SampleOffset, NumSamples, Fs, Resolution)`——
+以及读取侧的二分定位。
+
+定位规则与 `epycon.extraction` 一致：段归属半开 `[start, start + n/fs)`，
+epoch 纯相减、零时区，落在段间空档返回 None（fail-closed，不吸附到最近段）。
+"""
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+SEGMENT_INDEX_DNAME = 'SegmentIndex'
+
+# Resolution（nV/LSb）随行落盘：读取侧据此把 float32 µV 无损还原为原始计数
+SEGMENT_INDEX_DTYPES = [
+    ('SegmentID', 'S16'),
+    ('StartEpoch', '<f8'),
+    ('SampleOffset', '<i8'),
+    ('NumSamples', '<i8'),
+    ('Fs', '<f8'),
+    ('Resolution', '<f8'),
+]
+
+
+class SegmentLocation(NamedTuple):
+    """一次定位的结果：第 `row` 段、段内样本 `local`、合并轴样本 `sample`。"""
+    row: int
+    local: int
+    sample: int
+
+
+def build_segment_index(rows):
+    """[(segment_id, start_epoch, sample_offset, num_samples, fs, resolution), ...]
+    → 结构化数组（按 StartEpoch 升序）。"""
+    content = np.array(
+        [(str(sid).encode('utf-8'), float(ts), int(off), int(n), float(fs), float(res))
+         for sid, ts, off, n, fs, res in rows],
+        dtype=SEGMENT_INDEX_DTYPES,
+    )
+    return np.sort(content, order='StartEpoch')
+
+
+def read_segment_index(h5file) -> Optional[np.ndarray]:
+    """从已打开的 h5py.File 读出索引；旧版文件无该数据集时返回 None。"""
+    if SEGMENT_INDEX_DNAME not in h5file:
+        return None
+    return np.sort(h5file[SEGMENT_INDEX_DNAME][:], order='StartEpoch')
+
+
+def segment_ids(index):
+    return [sid.decode('utf-8') if isinstance(sid, bytes) else str(sid)
+            for sid in index['SegmentID']]
+
+
+def locate_row(starts, epoch, duration) -> Optional[int]:
+    """epoch → 所在段的行号（唯一的段定位实现，`extraction.locate_segment` 亦用此）。
+
+    starts 为升序段起点 ndarray，直接 `np.searchsorted`（O(log n)，不复制）；
+    duration(row) 给出该段秒数，归属按半开 [start, start + duration)。空档 / 越界返回 None。
+    """
+    epoch = float(epoch)
+    row = int(np.searchsorted(starts, epoch, side='right')) - 1
+    if row < 0 or not (0 <= epoch - float(starts[row]) < duration(row)):
+        return None
+    return row
+
+
+def locate_epoch(index, epoch) -> Optional[SegmentLocation]:
+    """epoch → 段 + 样本（二分，O(log n)）。空档 / 越界返回 None。
+
+    段内样本取最近采样点（round），与 `conversion.entries_to_marks` 相同：
+    大数量级 epoch 相减有浮点误差，int() 截断会系统性偏一个采样点。
+    """
+    row = locate_row(index['StartEpoch'], epoch,
+                     lambda r: int(index[r]['NumSamples']) / float(index[r]['Fs']))
+    if row is None:
+        return None
+    seg = index[row]
+    fs = float(seg['Fs'])
+    n = int(seg['NumSamples'])
+    offset_sec = float(epoch) - float(seg['StartEpoch'])
+    local = min(n - 1, round(offset_sec * fs))
+    return SegmentLocation(row, local, int(seg['SampleOffset']) + local)
+
+
+def locate_elapsed(index, elapsed_sec) -> Optional[SegmentLocation]:
+    """流逝秒（零点 = 首段 StartEpoch，与 extraction 一致）→ 段 + 样本。"""
+    if len(index) == 0:
+        return None
+    return locate_epoch(index, float(index['StartEpoch'][0]) + float(elapsed_sec))
+
+
+def sample_to_epoch(index, sample) -> Optional[float]:
+    """合并轴样本 → 墙钟 epoch（逆映射，供查看器显示真实时刻）。"""
+    row = int(np.searchsorted(index['SampleOffset'], int(sample), side='right')) - 1
+    if row < 0:
+        return None
+    seg = index[row]
+    local = int(sample) - int(seg['SampleOffset'])
+    if local >= int(seg['NumSamples']):
+        return None
+    return float(seg['StartEpoch']) + local / float(seg['Fs'])
@@ -2,12 +2,23 @@
 
 设计文档：docs/superpowers/specs/2026-07-08-timestamp-lead-extraction-design.md
 全程 epoch 纯相减、零时区；段归属半开 [ts, ts+dur)；fail-closed。
+
+数据源也可以是带 `SegmentIndex` 的合并 HDF5（#21）：段表由索引给出，
+窗口从本地 chunk 化的 HDF5 读取，不再回到原始 .log。
 """
 import os
+import re
 import json
 import math
 import struct
+import hashlib
+import tempfile
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
 
+import h5py
 import numpy as np
 
 # 底层解析器在畸形输入上抛的预期异常——统一转 ExtractionError 走结构化错误，
@@ -18,12 +29,18 @@ from epycon.config.byteschema import ENTRIES_FILENAME
 from epycon.conversion import list_datalogs
 from epycon.core._validators import _validate_version
 from epycon.core.helpers import get_channel_mappings
+from epycon.core import units as units_mod
+from epycon.core._dataclasses import Entry
+from epycon.core.timeindex import locate_row, read_segment_index, sample_to_epoch, segment_ids
 from epycon.iou import LogParser, mount_channels, readentries
+from epycon.iou.planters import HDFPlanter, _normalize_channel_name
 
 # int32 的正/负向满量程。曾含 -2147483649——那不是合法 int32 值，而是
 # _twos_complement 边界 off-by-one 把 +2147483647 翻出来的产物；根因已修，故移除。
 RAIL_VALUES = frozenset({2147483647, -2147483648})
 
+H5_SUFFIXES = (".h5", ".hdf5")
+
 
 class ExtractionError(ValueError):
     """时间定位 / 一致性 / 导联查找的显式失败（fail-closed，绝不静默兜底）。"""
@@ -99,12 +116,332 @@ def check_consistency(study_dir, segments, version):
     return entries
 
 
-def locate_segment(segments, target_epoch):
-    """返回覆盖 target_epoch 的段（半开 [ts, ts+dur)），无则 None。"""
-    for seg in segments:
-        if seg["ts"] <= target_epoch < seg["ts"] + seg["dur"]:
-            return seg
-    return None
+# 校验缓存格式版本：缓存内容或校验规则变化时递增，旧缓存自动失效
+CONSISTENCY_CACHE_VERSION = 1
+_CONSISTENCY_MEMO = OrderedDict()   # (realpath, version) -> 缓存记录
+_CONSISTENCY_MEMO_MAX = 64
+_CONSISTENCY_LOCK = threading.Lock()
+# 持久缓存上限：每次写入后删去超龄记录，再按 mtime（命中时刷新）只留最近的若干条
+CONSISTENCY_CACHE_MAX_RECORDS = 256
+CONSISTENCY_CACHE_MAX_AGE_SEC = 30 * 24 * 3600
+
+
+def consistency_cache_dir():
+    """持久化校验缓存的目录；环境变量 EPYCON_CACHE_DIR 可改位置，设为空串则只在进程内缓存。"""
+    base = os.environ.get("EPYCON_CACHE_DIR")
+    if base is None:
+        base = (os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME")
+                or os.path.join(os.path.expanduser("~"), ".cache"))
+        base = os.path.join(base, "epycon")
+    return os.path.join(base, "consistency") if base else None
+
+
+def _consistency_cache_path(key):
+    cache_dir = consistency_cache_dir()
+    if cache_dir is None:
+        return None
+    digest = hashlib.sha1(json.dumps(list(key)).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, digest + ".json")
+
+
+def _load_consistency_record(key):
+    path = _consistency_cache_path(key)
+    if path is None:
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if record.get("cache_version") != CONSISTENCY_CACHE_VERSION or record.get("key") != list(key):
+        return None
+    try:
+        os.utime(path)  # 命中即刷新 mtime，清理时按最近使用保留
+    except OSError:
+        pass
+    return record
+
+
+def _prune_consistency_cache(cache_dir):
+    """删去超过 CONSISTENCY_CACHE_MAX_AGE_SEC 未用的记录，并只保留最近的
+    CONSISTENCY_CACHE_MAX_RECORDS 条；并发删除等失败忽略。"""
+    try:
+        entries = [(e.stat().st_mtime, e.path) for e in os.scandir(cache_dir)
+                   if e.is_file() and e.name.endswith((".json", ".tmp"))]
+    except OSError:
+        return
+    entries.sort(reverse=True)
+    cutoff = time.time() - CONSISTENCY_CACHE_MAX_AGE_SEC
+    for rank, (mtime, path) in enumerate(entries):
+        if rank >= CONSISTENCY_CACHE_MAX_RECORDS or mtime < cutoff:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _store_consistency_record(key, record):
+    """写持久缓存（先写临时文件再 os.replace）；目录不可写时只保留进程内缓存。
+    写入后按数量与时限清理（见 `_prune_consistency_cache`），缓存目录不会无限增长。"""
+    path = _consistency_cache_path(key)
+    if path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except OSError:
+        return
+    _prune_consistency_cache(os.path.dirname(path))
+
+
+def _segment_map(segments):
+    return [[s["id"], s["ts"], s["fs"], s["ns"], s["resolution"]] for s in segments]
+
+
+def _lookup_consistency(key, fingerprint):
+    """先查进程内、再查持久缓存；指纹不符（文件有增删改）视为未命中。"""
+    with _CONSISTENCY_LOCK:
+        record = _CONSISTENCY_MEMO.get(key)
+    if record is None:
+        record = _load_consistency_record(key)
+    if record is not None and record["fingerprint"] != fingerprint:
+        return None
+    return record
+
+
+def _remember_consistency(key, record):
+    with _CONSISTENCY_LOCK:
+        _CONSISTENCY_MEMO[key] = record
+        _CONSISTENCY_MEMO.move_to_end(key)
+        while len(_CONSISTENCY_MEMO) > _CONSISTENCY_MEMO_MAX:
+            _CONSISTENCY_MEMO.popitem(last=False)
+
+
+def _record_entries(record):
+    if "error" in record:
+        raise ExtractionError(record["error"])
+    return [Entry(*item) for item in record["entries"]]
+
+
+def _fingerprint_list(study_dir):
+    return [list(item) for item in study_fingerprint(study_dir)]
+
+
+def validated_entries(study_dir, segments, version, revalidate=False):
+    """`check_consistency` 的记忆化版本：结论（含解析出的 entries 与段表）按
+    全部 .log 与 entries.log 的大小 / mtime 缓存，文件不变就不再重新解析。
+
+    缓存先查进程内，再查 `consistency_cache_dir()` 下的 JSON；命中还须段表与
+    本次加载的一致。失败结论同样缓存并原样重抛，fail-closed 语义不变。
+    `revalidate=True` 跳过缓存强制重新校验。"""
+    key = (os.path.realpath(study_dir), version)
+    fingerprint = _fingerprint_list(study_dir)
+    seg_map = _segment_map(segments)
+    record = None
+    if not revalidate:
+        record = _lookup_consistency(key, fingerprint)
+        if record is not None and record["segments"] != seg_map:
+            record = None
+    if record is None:
+        record = {"cache_version": CONSISTENCY_CACHE_VERSION, "key": list(key),
+                  "fingerprint": fingerprint, "segments": seg_map}
+        try:
+            entries = check_consistency(study_dir, segments, version)
+        except ExtractionError as e:
+            record["error"] = str(e)
+        else:
+            record["entries"] = [[e.fid, e.group, e.timestamp, e.message] for e in entries]
+        _store_consistency_record(key, record)
+    _remember_consistency(key, record)
+    return _record_entries(record)
+
+
+def _cached_study(study_dir, version):
+    """指纹命中校验缓存时，由缓存的段表直接重建 (segments, entries)，不读任何 .log 头。
+
+    重建的段 `header` 为 None，由 `_segment_header` 在首次解析导联时按需读取。
+    未命中（或缓存段与目录中的 .log 对不上）返回 None。"""
+    key = (os.path.realpath(study_dir), version)
+    record = _lookup_consistency(key, _fingerprint_list(study_dir))
+    if record is None:
+        return None
+    paths = {seg_id: path for path, seg_id in list_datalogs(study_dir)}
+    if sorted(paths) != sorted(item[0] for item in record["segments"]):
+        return None
+    _remember_consistency(key, record)
+    entries = _record_entries(record)
+    segments = [{"id": seg_id, "path": paths[seg_id], "ts": ts, "fs": fs, "ns": ns,
+                 "dur": ns / fs, "resolution": resolution, "header": None}
+                for seg_id, ts, fs, ns, resolution in record["segments"]]
+    return segments, entries
+
+
+def _segment_header(seg, version):
+    """段头：`load_segments` 已带上；由校验缓存重建的段首次用到时才解析。"""
+    if seg["header"] is None:
+        try:
+            with LogParser(seg["path"], version=version, samplesize=1024) as parser:
+                seg["header"] = parser.get_header()
+        except _PARSE_ERRORS as e:
+            raise ExtractionError(f"无法解析 .log 段 {seg['id']}：{e}")
+    return seg["header"]
+
+
+def _h5_files(path):
+    """HDF5 数据源 → 其中的 .h5 文件列表（单文件或转换输出目录）。"""
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, name) for name in os.listdir(path)
+                      if name.lower().endswith(H5_SUFFIXES))
+    return [path]
+
+
+def is_h5_source(path):
+    """study 参数指向 HDF5 数据源时为 True：单个 .h5 文件（合并或逐段），
+    或不含 .log 段、只有转换产物 .h5 的目录。"""
+    if os.path.isfile(path):
+        return str(path).lower().endswith(H5_SUFFIXES)
+    if not os.path.isdir(path) or list_datalogs(path):
+        return False
+    return bool(_h5_files(path))
+
+
+def _h5_column_names(h5file):
+    info = h5file[HDFPlanter._INFO_DNAME][:]
+    return [_normalize_channel_name(row["ChannelName"]) for row in info]
+
+
+def _h5_file_segments(h5_path, f):
+    """已打开的一个转换产物 → 段列表。
+
+    合并文件的段表完全来自 `SegmentIndex`；缺索引的旧版合并文件无法反推墙钟时刻，
+    fail-closed 要求重新转换，绝不拿首段 Timestamp + 累计样本去猜。逐段文件
+    （无 `merged` 标记）自成一段：起点为根属性 `Timestamp`，原始计数的还原依赖
+    根属性 `Resolution`（早期逐段产物没有，同样要求重新转换）。"""
+    name = os.path.basename(h5_path)
+    if "Filters" in f.attrs or "DecimationFactor" in f.attrs:
+        # 预滤波 / 抽取后的数据不是原始计数的线性缩放，无法无损还原
+        raise ExtractionError(
+            f"{name} 为转换期滤波或抽取产物，无法还原原始计数；"
+            f"请从原始 .log 或未处理的转换结果提取")
+    # 还原原始计数依赖"数值 = raw × resolution ÷ 1000"，只对 µV 声明成立
+    declared = units_mod.resolve([row["Units"] for row in f[HDFPlanter._INFO_DNAME][:]])
+    if declared != units_mod.UV:
+        raise ExtractionError(f"{name} 单位声明为 {declared}，只支持 uV 的 epycon 产物")
+    columns = _h5_column_names(f)
+    index = read_segment_index(f)
+    if index is not None:
+        rows = [(seg_id, float(row["StartEpoch"]), int(row["SampleOffset"]),
+                 int(row["NumSamples"]), float(row["Fs"]), row["Resolution"])
+                for seg_id, row in zip(segment_ids(index), index)]
+    elif f.attrs.get("merged", False):
+        raise ExtractionError(
+            f"{name} 无 SegmentIndex（早于 #21 的合并文件），"
+            f"无法按墙钟时刻定位；请用新版重新转换")
+    elif "Timestamp" not in f.attrs or "Resolution" not in f.attrs:
+        raise ExtractionError(
+            f"{name} 无 SegmentIndex，也无 Timestamp/Resolution 属性，"
+            f"无法按墙钟时刻定位并还原原始计数；请用新版重新转换")
+    else:
+        dataset = f[HDFPlanter._DATASET_DNAME]
+        fs = f.attrs.get("sampling_freq", np.ravel(f.attrs["Fs"])[0])
+        log_id = f.attrs.get("LogID", os.path.splitext(name)[0])
+        if isinstance(log_id, bytes):
+            log_id = log_id.decode("utf-8")
+        rows = [(str(log_id), float(f.attrs["Timestamp"]), 0,
+                 int(dataset.attrs.get("_logical_length", dataset.shape[1])),
+                 float(fs), f.attrs["Resolution"])]
+    segs = []
+    for seg_id, ts, offset, ns, fs, res in rows:
+        segs.append({
+            "id": seg_id,
+            "path": h5_path,
+            "ts": ts,
+            "fs": int(fs) if fs.is_integer() else fs,
+            "ns": ns,
+            "dur": ns / fs,
+            "resolution": int(res),
+            "header": None,
+            "offset": offset,
+            "columns": columns,
+        })
+    return segs
+
+
+def load_h5_segments(h5_source):
+    """HDF5 数据源 → 与 load_segments 同形的段列表（多出 offset/columns），按 ts 升序。
+
+    数据源为合并文件、逐段文件，或装有逐段转换产物的目录（见 `_h5_file_segments`）。
+    各段时间区间不得重叠（例如同一目录混放合并与逐段产物），否则 fail-closed。"""
+    segs = []
+    for h5_path in _h5_files(h5_source):
+        try:
+            with h5py.File(h5_path, "r") as f:
+                segs.extend(_h5_file_segments(h5_path, f))
+        except OSError as e:
+            raise ExtractionError(f"无法读取 HDF5 {h5_path}：{e}")
+    segs.sort(key=lambda s: s["ts"])
+    for prev, seg in zip(segs, segs[1:]):
+        if seg["ts"] < prev["ts"] + prev["dur"]:
+            raise ExtractionError(
+                f"HDF5 段 {prev['id']}（{os.path.basename(prev['path'])}）与 "
+                f"{seg['id']}（{os.path.basename(seg['path'])}）时间重叠，无法唯一定位")
+    return segs
+
+
+def load_h5_entries(h5_source):
+    """HDF5 数据源的 Marks → 与 readentries 同形的 Entry 列表（timestamp 为 epoch 秒）。
+
+    合并文件的轴样本经 SegmentIndex 逆映射回墙钟时刻，fid 为所在段 ID；
+    逐段文件按 Timestamp + 样本 / fs 换算。"""
+    entries = []
+    for h5_path in _h5_files(h5_source):
+        try:
+            with h5py.File(h5_path, "r") as f:
+                index = read_segment_index(f)
+                marks = f[HDFPlanter._MARKS_DNAME][:] if HDFPlanter._MARKS_DNAME in f else []
+                if index is None and len(marks):
+                    seg = _h5_file_segments(h5_path, f)[0]
+        except OSError as e:
+            raise ExtractionError(f"无法读取 HDF5 {h5_path}：{e}")
+        if index is not None:
+            ids = segment_ids(index)
+            offsets = index["SampleOffset"].tolist()
+        for mark in marks:
+            sample = int(mark["SampleLeft"])
+            if index is not None:
+                epoch = sample_to_epoch(index, sample)
+                if epoch is None:
+                    continue
+                fid = ids[bisect_right(offsets, sample) - 1]
+            else:
+                epoch, fid = seg["ts"] + sample / seg["fs"], seg["id"]
+            entries.append(Entry(
+                fid=fid,
+                group=mark["Group"].decode("utf-8", errors="replace"),
+                timestamp=epoch,
+                message=mark["Info"].decode("utf-8", errors="replace"),
+            ))
+    entries.sort(key=lambda e: e.timestamp)
+    return entries
+
+
+def segment_starts(segments):
+    """段起点 ndarray（升序），供 `locate_segment` 批量定位时只构建一次。"""
+    return np.array([s["ts"] for s in segments], dtype=np.float64)
+
+
+def locate_segment(segments, target_epoch, starts=None):
+    """返回覆盖 target_epoch 的段（半开 [ts, ts+dur)），无则 None。
+
+    segments 已按 ts 升序（load_segments / load_h5_segments 保证），经
+    `timeindex.locate_row` 二分定位；多次定位时传入 `segment_starts(segments)`。"""
+    if starts is None:
+        starts = segment_starts(segments)
+    row = locate_row(starts, target_epoch, lambda r: segments[r]["dur"])
+    return None if row is None else segments[row]
 
 
 def _window_samples(seg, offset_sec, before, after):
@@ -120,20 +457,63 @@ def _window_samples(seg, offset_sec, before, after):
     return clipped_start, clipped_end, missing_before, missing_after
 
 
-def read_raw_window(seg, start_sample, end_sample, version):
+def read_raw_window(seg, start_sample, end_sample, version, parser=None):
     """读段内 [start, end) 样本 → (N, num_channels) int64 原始整数。
 
     LogParser 的 _process_chunk 总是 _twos_complement 后 ×resolution；
     这里反除 resolution 无损还原（resolution 为整数、值均为其整数倍，
     上界 (2^31+1)*78 ≈ 1.675e11 < 2^53，float64 精确）。int64 承载栏杆
-    值 -2147483649（越 int32 界）。"""
-    with LogParser(seg["path"], version=version, samplesize=1024,
-                   start=start_sample, end=end_sample) as parser:
-        scaled = parser.read()  # (N, num_channels)，已 ×resolution
+    值 -2147483649（越 int32 界）。
+
+    parser 为该段已打开的 LogParser 时复用之（见 ExtractionSession），免重开文件、重读头。"""
+    if parser is not None:
+        scaled = parser.select(start_sample, end_sample).read()
+    else:
+        with LogParser(seg["path"], version=version, samplesize=1024,
+                       start=start_sample, end=end_sample) as parser:
+            scaled = parser.read()  # (N, num_channels)，已 ×resolution
     res = seg["resolution"]
     return np.rint(np.asarray(scaled, dtype=np.float64) / res).astype(np.int64)
 
 
+def _stored_uv(raw, res):
+    """原始计数 → HDFPlanter 实际落盘的 float32 值（apply_factor 的同一算式）。"""
+    return np.float32(np.float32(raw * res) / np.float32(1000))
+
+
+def read_h5_window(seg, start_sample, end_sample, h5file=None, columns=None):
+    """读 HDF5 内该段 [start, end) 样本 → (N, num_columns) int64 原始整数。
+
+    落盘值为 float32(raw × res) ÷ 1000；|raw| < 2^22 时 rint(v × 1000 / res) 可无损
+    还原。栏杆值（int32 满量程）超出该精度范围，按同一算式逐值比对后精确回填，
+    使 is_railed 与 .log 路径判定一致。h5file 为已打开的句柄时复用之。
+    columns（升序列索引）给出时只读这些通道行，返回 (N, len(columns))。"""
+    off = seg["offset"]
+    rows = slice(None) if columns is None else list(columns)
+    try:
+        if h5file is not None:
+            block = h5file[HDFPlanter._DATASET_DNAME][rows, off + start_sample:off + end_sample].T
+        else:
+            with h5py.File(seg["path"], "r") as f:
+                block = f[HDFPlanter._DATASET_DNAME][rows, off + start_sample:off + end_sample].T
+    except OSError as e:
+        raise ExtractionError(f"无法读取 HDF5 {seg['path']}：{e}")
+    res = seg["resolution"]
+    raw = np.rint(block.astype(np.float64) * 1000.0 / res).astype(np.int64)
+    for rail in RAIL_VALUES:
+        raw[block == _stored_uv(rail, res)] = rail
+    return raw
+
+
+def _compact_sources(sources):
+    """[(导联名, 列索引元组), ...] → (升序去重的所需列, 改写为所需列内位置的 sources)。
+
+    读取只取所需列（HDF5 为按行 hyperslab），导联合成改在紧凑块上进行。"""
+    columns = sorted({c for _, cols in sources for c in cols})
+    position = {c: i for i, c in enumerate(columns)}
+    return columns, [(name, tuple(position[c] for c in cols)) for name, cols in sources]
+
+
 def is_railed(col):
     """窗口内该列恒定且命中满量程栏杆值 → True（未连接电极）。"""
     first = col[0]
@@ -167,6 +547,32 @@ def resolve_lead_sources(header, requested, raw_unipolar):
     return out
 
 
+def resolve_h5_lead_sources(columns, requested, raw_unipolar):
+    """HDF5 列名版的 resolve_lead_sources：导联名 → 列索引元组。
+
+    HDFPlanter 落盘时去掉了名字里的空白，故两侧同样规范化后精确匹配。
+    computed（默认）优先由 u+/u- 两列合成 u- − u+（与 .log 路径同源，且可逐列
+    判栏杆）；只有单列时直取（体表导联、或以 computed 模式转换的文件）。"""
+    by_name = {name: i for i, name in enumerate(columns)}
+    out = []
+    for name in requested:
+        key = _normalize_channel_name(name)
+        plus, minus = by_name.get("u+" + key), by_name.get("u-" + key)
+        if raw_unipolar:
+            cols = (by_name[key],) if key in by_name else None
+        elif key.startswith(("u+", "u-")):
+            cols = None
+        elif plus is not None and minus is not None:
+            cols = (minus, plus)
+        else:
+            cols = (by_name[key],) if key in by_name else None
+        if cols is None:
+            raise ExtractionError(
+                f"导联 {name!r} 不在 HDF5 通道表；可用: {sorted(columns)}")
+        out.append((name, cols))
+    return out
+
+
 def _lead_signal(raw_int, sources):
     """单源直取；双源 u- − u+。委托已导出的 mount_channels，保持双极合成
     规则与 conversion 单一来源、不漂移（sources 已是有效列索引，见
@@ -204,11 +610,8 @@ def _gap_message(segments, target_epoch, zero):
     return f"目标流逝 {tel:.3f}s 落在段间空档，无录制数据。前段: {p}; 后段: {n}"
 
 
-def extract_window(study_dir, at_elapsed=None, at_epoch=None, leads=None,
-                   window=2.0, before=None, after=None, raw_unipolar=False,
-                   raw_counts=False, version=None):
-    """按流逝时刻/epoch 提取指定导联 ±窗口原始波形。见设计文档第 8 节。
-    非 raw_counts 时物理值固定为 µV（= raw_int × resolution / 1000）。"""
+def _validate_request(version, leads, window, before, after):
+    """请求级参数校验（不触盘）：版本、导联、窗口。返回 (version, before, after)。"""
     if version is None:
         version = _default_version()
     # 非法版本在 LogParser 里会抛 ValueError；此处提前转 ExtractionError，
@@ -227,62 +630,461 @@ def extract_window(study_dir, at_elapsed=None, at_epoch=None, leads=None,
     if before < 0 or after < 0:
         raise ExtractionError(
             f"窗口 before/after 不可为负（before={before}, after={after}）")
+    return version, before, after
+
+
+def _open_study(study_dir, version, revalidate=False):
+    """study 级加载：段表 + 一致性校验（记忆化，见 `validated_entries`）。
+    返回 (segments, from_h5, entries)。
 
-    segments = load_segments(study_dir, version)
+    .log study 的指纹命中校验缓存时整段跳过 load_segments 与 check_consistency
+    （见 `_cached_study`）。"""
+    from_h5 = is_h5_source(study_dir)
+    if not from_h5 and not revalidate:
+        cached = _cached_study(study_dir, version)
+        if cached is not None:
+            return cached[0], False, cached[1]
+    if from_h5:
+        # 合并 HDF5 的标注在转换时已按段区间过滤落位，无 entries.log 可校验
+        segments = load_h5_segments(study_dir)
+    else:
+        segments = load_segments(study_dir, version)
     if not segments:
         raise ExtractionError(f"{study_dir} 无 .log 段")
-    check_consistency(study_dir, segments, version)
-    zero = segments[0]["ts"]
+    if from_h5:
+        entries = load_h5_entries(study_dir)
+    else:
+        entries = validated_entries(study_dir, segments, version, revalidate)
+    return segments, from_h5, entries
 
+
+def _target_epoch(at_elapsed, at_epoch, zero):
     if at_epoch is not None and at_elapsed is not None:
         raise ExtractionError("at_elapsed 与 at_epoch 互斥，不可同时提供")
     if at_epoch is not None:
-        target = float(at_epoch)
-    elif at_elapsed is not None:
-        target = zero + parse_elapsed(at_elapsed)
-    else:
-        raise ExtractionError("须提供 at_elapsed 或 at_epoch")
+        return float(at_epoch)
+    if at_elapsed is not None:
+        return zero + parse_elapsed(at_elapsed)
+    raise ExtractionError("须提供 at_elapsed 或 at_epoch")
 
-    seg = locate_segment(segments, target)
-    if seg is None:
-        raise ExtractionError(_gap_message(segments, target, zero))
 
-    offset = target - seg["ts"]
-    s0, s1, miss_b, miss_a = _window_samples(seg, offset, before, after)
-    if s1 <= s0:
-        raise ExtractionError("窗口在该段内无有效样本")
+def _normalize_target(target):
+    """批量目标项 → (at_elapsed, at_epoch)。
+
+    接受 {"at": "H:MM:SS"} / {"epoch": 秒}、H:MM:SS 字符串或 epoch 数值。"""
+    if isinstance(target, dict):
+        return target.get("at"), target.get("epoch")
+    if isinstance(target, str):
+        return target, None
+    if isinstance(target, (int, float)) and not isinstance(target, bool):
+        return None, target
+    raise ExtractionError(f"无法识别的目标 {target!r}：须为 H:MM:SS、epoch 秒或 {{at|epoch}}")
+
+
+def _coalesce(windows):
+    """[(s0, s1, key), ...] → 合并重叠 / 相邻区间后的读取计划 [(r0, r1, [key, ...]), ...]。"""
+    reads = []
+    for s0, s1, key in sorted(windows, key=lambda w: (w[0], w[1])):
+        if reads and s0 <= reads[-1][1]:
+            reads[-1][1] = max(reads[-1][1], s1)
+            reads[-1][2].append(key)
+        else:
+            reads.append([s0, s1, [key]])
+    return [tuple(r) for r in reads]
 
-    raw_int = read_raw_window(seg, s0, s1, version)
-    sources = resolve_lead_sources(seg["header"], leads, raw_unipolar)
-    res = seg["resolution"]
-    fs = seg["fs"]
 
+_INT32 = np.iinfo(np.int32)
+
+
+def _lead_samples(sig, res, raw_counts):
+    """导联信号 → 结果数组：raw_counts 为 int32 原始计数，否则 float32 µV。
+
+    双极差分（int64）可能超出 int32：先查值域，越界抛 ExtractionError，不静默回绕。"""
+    if raw_counts:
+        if sig.size and (sig.min() < _INT32.min or sig.max() > _INT32.max):
+            raise ExtractionError("双极差分超出 int32 计数范围，无法以 raw_counts 输出")
+        return sig.astype(np.int32)
+    return (sig.astype(np.float64) * (res / 1000.0)).astype(np.float32)
+
+
+def _lead_results(raw_int, sources, res, raw_counts):
+    """逐导联结果；`samples` 为 ndarray（见 `_lead_samples`），JSON 化留给输出端。"""
     lead_out = []
     for name, cols in sources:
         if any(is_railed(raw_int[:, c]) for c in cols):
             lead_out.append({"name": name, "status": "rejected",
                              "reason": "通道恒定于满量程，电极未连接"})
             continue
-        sig = _lead_signal(raw_int, cols)
-        if raw_counts:
-            samples = [int(x) for x in sig]
-        else:
-            samples = (sig.astype(np.float64) * res / 1000.0).tolist()
+        try:
+            samples = _lead_samples(_lead_signal(raw_int, cols), res, raw_counts)
+        except ExtractionError as e:
+            lead_out.append({"name": name, "status": "rejected", "reason": str(e)})
+            continue
         lead_out.append({"name": name, "status": "ok",
-                         "n": int(sig.shape[0]), "samples": samples})
+                         "n": int(samples.shape[0]), "samples": samples})
+    return lead_out
+
+
+def extract_windows(study_dir, targets, leads=None, window=2.0, before=None,
+                    after=None, raw_unipolar=False, raw_counts=False, version=None,
+                    revalidate=False):
+    """批量提取：study 只加载、校验一次，多个目标共享读取。
+
+    各目标二分定位到段，段内窗口按起点排序，重叠或相邻的合并成一次读取
+    （.log 为一次 LogParser 区间读，HDF5 为一次 hyperslab），再按目标切片。
+
+    study 级失败（版本、导联、段表、一致性）直接抛 ExtractionError；单个目标的
+    失败（空档、时间格式、导联不在该段通道表等）只记在该目标的 `error` 字段，
+    不影响其他目标。返回 {"study", "version", "reads", "results": [...]}，
+    results 与 targets 同序，成功项与 `extract_window` 的返回同形。
+    """
+    version, before, after = _validate_request(version, leads, window, before, after)
+    segments, from_h5, _ = _open_study(study_dir, version, revalidate)
+
+    def reader(seg, r0, r1, columns):
+        if from_h5:
+            return read_h5_window(seg, r0, r1, columns=columns)
+        return read_raw_window(seg, r0, r1, version)[:, columns]
+
+    return _extract_located(study_dir, segments, from_h5, reader, targets, leads,
+                            before, after, raw_unipolar, raw_counts, version)
+
+
+def _extract_located(study_dir, segments, from_h5, reader, targets, leads,
+                     before, after, raw_unipolar, raw_counts, version):
+    """已加载 study 上的批量定位 + 合并读取；reader(seg, r0, r1, columns) → 所需列的
+    int64 原始块。"""
+    zero = segments[0]["ts"]
+    study = os.path.basename(os.path.normpath(study_dir))
+
+    results = [None] * len(targets)
+    plan = {}  # seg id -> [(s0, s1, target index), ...]
+    located = {}
+    starts = segment_starts(segments)
+    for i, target in enumerate(targets):
+        try:
+            at_elapsed, at_epoch = _normalize_target(target)
+            epoch = _target_epoch(at_elapsed, at_epoch, zero)
+            seg = locate_segment(segments, epoch, starts)
+            if seg is None:
+                raise ExtractionError(_gap_message(segments, epoch, zero))
+            offset = epoch - seg["ts"]
+            s0, s1, miss_b, miss_a = _window_samples(seg, offset, before, after)
+            if s1 <= s0:
+                raise ExtractionError("窗口在该段内无有效样本")
+        except ExtractionError as e:
+            results[i] = {"target": target, "error": str(e)}
+            continue
+        located[i] = (seg, at_elapsed, epoch, offset, s0, s1, miss_b, miss_a)
+        plan.setdefault(seg["id"], []).append((s0, s1, i))
+
+    num_reads = 0
+    by_id = {seg["id"]: seg for seg in segments}
+    for seg_id, windows in plan.items():
+        seg = by_id[seg_id]
+        try:
+            if from_h5:
+                sources = resolve_h5_lead_sources(seg["columns"], leads, raw_unipolar)
+            else:
+                sources = resolve_lead_sources(_segment_header(seg, version), leads, raw_unipolar)
+        except ExtractionError as e:
+            for _, _, i in windows:
+                results[i] = {"target": targets[i], "error": str(e)}
+            continue
+        columns, sources = _compact_sources(sources)
+        for r0, r1, members in _coalesce(windows):
+            block = reader(seg, r0, r1, columns)
+            num_reads += 1
+            for i in members:
+                _, at_elapsed, epoch, offset, s0, s1, miss_b, miss_a = located[i]
+                raw_int = block[s0 - r0:s1 - r0]
+                fs = seg["fs"]
+                results[i] = {
+                    "study": study,
+                    "log": seg["id"],
+                    "version": version,
+                    "fs": fs,
+                    "units": "counts" if raw_counts else "uV",
+                    "resolution_nV": seg["resolution"],
+                    "target": {"elapsed": at_elapsed, "epoch": epoch,
+                               "offset_in_seg_s": offset},
+                    "requested_window": {"before": before, "after": after},
+                    "returned_window": {"start_s": s0 / fs, "end_s": s1 / fs,
+                                        "clipped": bool(miss_b or miss_a),
+                                        "missing_s": miss_b + miss_a},
+                    "leads": _lead_results(raw_int, sources, seg["resolution"], raw_counts),
+                }
+
+    return {"study": study, "version": version, "reads": num_reads, "results": results}
+
+
+def extract_window(study_dir, at_elapsed=None, at_epoch=None, leads=None,
+                   window=2.0, before=None, after=None, raw_unipolar=False,
+                   raw_counts=False, version=None, revalidate=False):
+    """按流逝时刻/epoch 提取指定导联 ±窗口原始波形。见设计文档第 8 节。
+    非 raw_counts 时物理值固定为 µV（= raw_int × resolution / 1000）。
+    各导联 `samples` 为 ndarray：float32 µV，raw_counts 时为 int32 原始计数。
+
+    study_dir 为 .log 目录，或 HDFPlanter 转换产物：带 SegmentIndex 的合并文件、
+    逐段文件或逐段产物所在目录（见 load_h5_segments），结果与 .log 路径逐样本一致。
+    单目标即 `extract_windows` 的特例；目标级错误在此重新抛出。"""
+    batch = extract_windows(
+        study_dir, [{"at": at_elapsed, "epoch": at_epoch}], leads=leads,
+        window=window, before=before, after=after, raw_unipolar=raw_unipolar,
+        raw_counts=raw_counts, version=version, revalidate=revalidate)
+    result = batch["results"][0]
+    if "error" in result:
+        raise ExtractionError(result["error"])
+    return result
+
+
+def select_entries(entries, groups=None, pattern=None, time_range=None):
+    """按分组、消息正则（search）与 epoch 闭区间筛选标注，按时间升序返回。"""
+    groups = set(groups or ())
+    try:
+        regex = re.compile(pattern) if pattern else None
+    except re.error as e:
+        raise ExtractionError(f"无效的正则 {pattern!r}：{e}")
+    selected = []
+    for entry in entries:
+        if groups and str(entry.group) not in groups:
+            continue
+        if regex and not regex.search(str(entry.message)):
+            continue
+        ts = float(entry.timestamp)
+        if time_range is not None and not (time_range[0] <= ts <= time_range[1]):
+            continue
+        selected.append(entry)
+    return sorted(selected, key=lambda e: float(e.timestamp))
+
+
+def extract_epochs(study_dir, leads=None, groups=None, pattern=None, time_range=None,
+                   window=2.0, before=None, after=None, raw_unipolar=False,
+                   raw_counts=False, version=None, revalidate=False):
+    """事件锁定取窗：对每条匹配的标注取 ±窗口，堆叠成 (events, leads, samples) 数组。
+
+    标注按 `groups`（分组名集合）、`pattern`（消息正则）与 `time_range`
+    （(起, 止) 闭区间，端点为 H:MM:SS 流逝时刻或 epoch 秒）筛选。
+
+    各事件窗口长度统一为 round(before·fs) + round(after·fs)，第 round(before·fs) 个
+    样本对齐标注时刻。窗口按段向量化定位、段内合并重叠区间后每段只读所需范围。
+    越过段边界的部分补 0 并在 `mask` 中置 False；落在空档的事件整行 False 并在
+    `events[i]["status"]` 注明。栏杆（未连接）导联在 `railed` 中置 True、数据置 0；
+    raw_counts 时双极差分超出 int32 的导联在 `overflow` 中置 True、数据置 0。
+
+    返回 {"data", "mask" (events, samples), "railed" / "overflow" (events, leads), "events",
+    "leads", "fs", "units", "before", "after", "pre_samples", "study", "version"}；
+    data 为 float32 µV，raw_counts 时为 int32 原始计数。
+    """
+    version, before, after = _validate_request(version, leads, window, before, after)
+    segments, from_h5, entries = _open_study(study_dir, version, revalidate)
+    zero = segments[0]["ts"]
+    if time_range is not None:
+        # 端点与批量目标同规则：H:MM:SS 为流逝时刻，数值为 epoch 秒
+        time_range = tuple(_target_epoch(*_normalize_target(x), zero) for x in time_range)
+    selected = select_entries(entries, groups, pattern, time_range)
+
+    rates = {seg["fs"] for seg in segments}
+    if len(rates) != 1:
+        raise ExtractionError(f"各段采样率不一致 {sorted(rates)}，无法堆叠等长窗口")
+    fs = rates.pop()
+    pre = round(before * fs)
+    length = pre + round(after * fs)
+    if length <= 0:
+        raise ExtractionError("窗口长度为 0")
+
+    n_events = len(selected)
+    dtype = np.int32 if raw_counts else np.float32
+    data = np.zeros((n_events, len(leads), length), dtype=dtype)
+    mask = np.zeros((n_events, length), dtype=bool)
+    railed = np.zeros((n_events, len(leads)), dtype=bool)
+    overflow = np.zeros((n_events, len(leads)), dtype=bool)
+
+    # 向量化定位：段起点二分 + 段内中心样本
+    epochs = np.array([float(e.timestamp) for e in selected], dtype=np.float64)
+    starts = segment_starts(segments)
+    rows = np.searchsorted(starts, epochs, side="right") - 1
+    ns = np.array([seg["ns"] for seg in segments], dtype=np.int64)
+    safe_rows = np.clip(rows, 0, len(segments) - 1)
+    centers = np.rint((epochs - starts[safe_rows]) * fs).astype(np.int64)
+    inside = (rows >= 0) & (centers >= 0) & (centers < ns[safe_rows])
+    w0 = centers - pre
+    w1 = w0 + length
+
+    events = []
+    plan = {}
+    for i, entry in enumerate(selected):
+        event = {"epoch": float(epochs[i]), "elapsed_s": float(epochs[i] - zero),
+                 "group": str(entry.group), "message": str(entry.message)}
+        if inside[i]:
+            seg = segments[rows[i]]
+            s0, s1 = max(0, int(w0[i])), min(seg["ns"], int(w1[i]))
+            event.update({"log": seg["id"], "status": "ok" if s1 - s0 == length else "clipped"})
+            plan.setdefault(int(rows[i]), []).append((s0, s1, i))
+        else:
+            event.update({"log": None, "status": "gap"})
+        events.append(event)
+
+    num_reads = 0
+    for row, windows in plan.items():
+        seg = segments[row]
+        if from_h5:
+            sources = resolve_h5_lead_sources(seg["columns"], leads, raw_unipolar)
+        else:
+            sources = resolve_lead_sources(_segment_header(seg, version), leads, raw_unipolar)
+        columns, sources = _compact_sources(sources)
+        for r0, r1, members in _coalesce(windows):
+            block = (read_h5_window(seg, r0, r1, columns=columns) if from_h5
+                     else read_raw_window(seg, r0, r1, version)[:, columns])
+            num_reads += 1
+            for i in members:
+                s0, s1 = max(0, int(w0[i])), min(seg["ns"], int(w1[i]))
+                d0 = s0 - int(w0[i])
+                raw_int = block[s0 - r0:s1 - r0]
+                mask[i, d0:d0 + (s1 - s0)] = True
+                for j, (_, cols) in enumerate(sources):
+                    if any(is_railed(raw_int[:, c]) for c in cols):
+                        railed[i, j] = True
+                        continue
+                    try:
+                        data[i, j, d0:d0 + (s1 - s0)] = _lead_samples(
+                            _lead_signal(raw_int, cols), seg["resolution"], raw_counts)
+                    except ExtractionError:
+                        overflow[i, j] = True
 
     return {
         "study": os.path.basename(os.path.normpath(study_dir)),
-        "log": seg["id"],
         "version": version,
         "fs": fs,
         "units": "counts" if raw_counts else "uV",
-        "resolution_nV": res,
-        "target": {"elapsed": at_elapsed, "epoch": target,
-                   "offset_in_seg_s": offset},
-        "requested_window": {"before": before, "after": after},
-        "returned_window": {"start_s": s0 / fs, "end_s": s1 / fs,
-                            "clipped": bool(miss_b or miss_a),
-                            "missing_s": miss_b + miss_a},
-        "leads": lead_out,
+        "leads": list(leads),
+        "before": before,
+        "after": after,
+        "pre_samples": pre,
+        "reads": num_reads,
+        "events": events,
+        "data": data,
+        "mask": mask,
+        "railed": railed,
+        "overflow": overflow,
     }
+
+
+def study_fingerprint(study_dir):
+    """数据源指纹：.log（含 entries.log）或 HDF5 的 (文件名, 大小, mtime_ns)。
+
+    只 stat 不读内容；任一文件增删改都会改变指纹，用于判定缓存的段表是否过期。"""
+    if os.path.isfile(study_dir):
+        st = os.stat(study_dir)
+        return ((os.path.basename(study_dir), st.st_size, st.st_mtime_ns),)
+    suffixes = H5_SUFFIXES if is_h5_source(study_dir) else (".log",)
+    try:
+        items = [(e.name, e.stat().st_size, e.stat().st_mtime_ns)
+                 for e in os.scandir(study_dir)
+                 if e.is_file() and e.name.lower().endswith(suffixes)]
+    except OSError as e:
+        raise ExtractionError(f"无法读取 study 目录 {study_dir}：{e}")
+    return tuple(sorted(items))
+
+
+class _OpenStudy:
+    """会话内一个已加载的 study：段表（含一致性校验结果）与打开的读取句柄。"""
+
+    def __init__(self, study_dir, version, fingerprint, revalidate=False):
+        self.study_dir = study_dir
+        self.version = version
+        self.fingerprint = fingerprint
+        self.segments, self.from_h5, self.entries = _open_study(study_dir, version, revalidate)
+        self._parsers = {}  # 段路径 -> 已进入上下文的 LogParser
+        self._h5files = {}  # 段路径 -> 打开的 h5py.File
+
+    def read(self, seg, r0, r1, columns=None):
+        if self.from_h5:
+            h5file = self._h5files.get(seg["path"])
+            if h5file is None:
+                try:
+                    h5file = h5py.File(seg["path"], "r")
+                except OSError as e:
+                    raise ExtractionError(f"无法读取 HDF5 {seg['path']}：{e}")
+                self._h5files[seg["path"]] = h5file
+            return read_h5_window(seg, r0, r1, h5file=h5file, columns=columns)
+        parser = self._parsers.get(seg["path"])
+        if parser is None:
+            try:
+                parser = LogParser(seg["path"], version=self.version, samplesize=1024).__enter__()
+            except _PARSE_ERRORS as e:
+                raise ExtractionError(f"无法解析 .log 段 {seg['id']}：{e}")
+            self._parsers[seg["path"]] = parser
+        raw = read_raw_window(seg, r0, r1, self.version, parser=parser)
+        return raw if columns is None else raw[:, columns]
+
+    def close(self):
+        for parser in self._parsers.values():
+            parser.__exit__(None, None, None)
+        self._parsers.clear()
+        for h5file in self._h5files.values():
+            h5file.close()
+        self._h5files.clear()
+
+
+class ExtractionSession:
+    """长驻提取会话：LRU 缓存已加载的 study（段表、一致性校验、打开的 parser / HDF5）。
+
+    单次 CLI 调用的主要开销是解析全部段头与 entries.log；会话内对同一 study 的重复
+    请求只剩定位与区间读取。每次请求先比对 `study_fingerprint`，文件有变动即重新加载。
+    线程安全：同一时刻只处理一个请求（parser 有文件位置状态）。
+    """
+
+    def __init__(self, max_studies=8):
+        self.max_studies = max(1, int(max_studies))
+        self._studies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, study_dir, version, revalidate=False):
+        """返回 (_OpenStudy, 是否命中缓存)；revalidate 强制重新加载并校验。"""
+        key = (os.path.realpath(study_dir), version)
+        fingerprint = study_fingerprint(study_dir)
+        study = self._studies.get(key)
+        if study is not None and study.fingerprint == fingerprint and not revalidate:
+            self._studies.move_to_end(key)
+            return study, True
+        if study is not None:
+            study.close()
+            del self._studies[key]
+        study = _OpenStudy(study_dir, version, fingerprint, revalidate)
+        self._studies[key] = study
+        while len(self._studies) > self.max_studies:
+            _, evicted = self._studies.popitem(last=False)
+            evicted.close()
+        return study, False
+
+    def extract_windows(self, study_dir, targets, leads=None, window=2.0, before=None,
+                        after=None, raw_unipolar=False, raw_counts=False, version=None,
+                        revalidate=False):
+        """同模块级 `extract_windows`，返回值另带 `cached`（study 是否已在会话中）。"""
+        version, before, after = _validate_request(version, leads, window, before, after)
+        with self._lock:
+            study, cached = self._get(study_dir, version, revalidate)
+            batch = _extract_located(study_dir, study.segments, study.from_h5, study.read,
+                                     targets, leads, before, after, raw_unipolar,
+                                     raw_counts, version)
+        batch["cached"] = cached
+        return batch
+
+    def extract_window(self, study_dir, at_elapsed=None, at_epoch=None, leads=None,
+                       window=2.0, before=None, after=None, raw_unipolar=False,
+                       raw_counts=False, version=None, revalidate=False):
+        batch = self.extract_windows(
+            study_dir, [{"at": at_elapsed, "epoch": at_epoch}], leads=leads,
+            window=window, before=before, after=after, raw_unipolar=raw_unipolar,
+            raw_counts=raw_counts, version=version, revalidate=revalidate)
+        result = batch["results"][0]
+        if "error" in result:
+            raise ExtractionError(result["error"])
+        return result
+
+    def close(self):
+        with self._lock:
+            for study in self._studies.values():
+                study.close()
+            self._studies.clear()
@@ -133,22 +133,7 @@ class LogParser(abc.Iterator):
             # compute size of data block to read at once
             self._chunksize = self._block_size * self.samplesize
 
-            # convert start sample to byte address
-            startbyte = self._header.datablock_address + self.start * self._block_size
-
-            if self.end is not None:
-                # convert end sample to byte address
-                stopbyte = self._header.datablock_address + self.end * self._block_size
-            else:
-                # set stop byte to the last one (use a very large int instead of Inf)
-                stopbyte = sys.maxsize
-
-            # get address of the last/user defined byte
-            # Use os.fstat for potentially better performance than seek(0, 2)
-            self._stopbyte = int(min(stopbyte, self._f_obj.seek(0, 2)))
-
-            # Seek to start position
-            self._f_obj.seek(max(self._header.datablock_address, startbyte))
+            self._seek_range()
 
             return self
 
@@ -164,6 +149,41 @@ class LogParser(abc.Iterator):
 
         return self
 
+    def _seek_range(self) -> None:
+        """Position the file object at `start` and set the stop byte from `end`."""
+        assert self._f_obj is not None and self._header is not None
+
+        # convert start sample to byte address
+        startbyte = self._header.datablock_address + self.start * self._block_size
+
+        if self.end is not None:
+            # convert end sample to byte address
+            stopbyte = self._header.datablock_address + self.end * self._block_size
+        else:
+            # set stop byte to the last one (use a very large int instead of Inf)
+            stopbyte = sys.maxsize
+
+        # get address of the last/user defined byte
+        # Use os.fstat for potentially better performance than seek(0, 2)
+        self._stopbyte = int(min(stopbyte, self._f_obj.seek(0, 2)))
+
+        # Seek to start position
+        self._f_obj.seek(max(self._header.datablock_address, startbyte))
+
+    def select(self, start: int = 0, end: Optional[int] = None) -> "LogParser":
+        """Re-target an open parser to the sample range [start, end).
+
+        Reuses the open file handle and the already parsed header, so long-lived
+        callers (e.g. extraction sessions) can serve many ranges from one parser.
+        Only valid inside the context manager.
+        """
+        if self._f_obj is None or self._header is None:
+            raise ValueError("select() requires an open parser (use it inside `with`)")
+        self.start = _validate_int("start sample", start, min_value=0)
+        self.end = _validate_int("end sample", end, min_value=start) if end is not None else None
+        self._seek_range()
+        return self
+
     def __exit__(self, exc_type, exc_value, exc_traceback):
         # Clear file header
         if self._header is not None:
@@ -6,6 +6,7 @@ import numpy as np
 from epycon.core._dataclasses import Entry
 from epycon.core._formatting import _tocsv, _tosel, SignalPlantDefaults
 from epycon.core.units import UNITS_CONTRACT_ATTR, UNITS_CONTRACT_VERSION
+from epycon.core.timeindex import SEGMENT_INDEX_DNAME, build_segment_index
 
 from epycon.core._typing import (
     Union, PathLike, NumpyArray, Tuple, List, Any,
@@ -631,3 +632,19 @@ class HDFPlanter(DatalogPlanter):
             del self._f_obj[self._MARKS_DNAME]
 
         self._f_obj.create_dataset(self._MARKS_DNAME, data=content)
+
+    def add_segment_index(
+        self,
+        rows: Union[List, Tuple],
+        ) -> None:
+        """写入段级墙钟时间索引（合并文件专用，见 `epycon.core.timeindex`）。
+
+        Args:
+            rows: [(segment_id, start_epoch, sample_offset, num_samples, fs, resolution), ...]
+        """
+        content = build_segment_index(rows)
+
+        if SEGMENT_INDEX_DNAME in self._f_obj:
+            del self._f_obj[SEGMENT_INDEX_DNAME]
+
+        self._f_obj.create_dataset(SEGMENT_INDEX_DNAME, data=content)
@@ -0,0 +1,9 @@
+# tests/conftest.py
+# 全局隔离：一致性校验的持久缓存默认写用户缓存目录（~/.cache/epycon），
+# 测试一律改写到各自的 tmp_path，不在真实缓存里堆积以 /tmp/pytest-* 为键的记录。
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def isolated_consistency_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("EPYCON_CACHE_DIR", str(tmp_path / "epycon-cache"))
@@ -8,8 +8,11 @@ HDF5 fixture 用项目自己的 HDFPlanter 生成，等价于一次
 "转换输出 -> ECG 查看器" 的集成验证。
 """
 import base64
+import json
 import io
 import os
+import threading
+import time
 
 import numpy as np
 import pytest
@@ -22,6 +25,8 @@ from epycon.api_ecg import (
     FILE_CACHE,
     _convert_numpy_types,
     minmax_downsample,
+    lttb_indices,
+    decimate_to_points,
     _build_computed_leads,
     _get_dataset_path,
     _get_annotations_path,
@@ -40,11 +45,23 @@ CH_NAMES = ["I", "II", "V1"]
 # ========================= fixtures =========================
 
 @pytest.fixture(autouse=True)
-def clean_file_cache():
-    """隔离测试间的全局文件缓存"""
+def clean_file_cache(tmp_path, monkeypatch):
+    """隔离测试间的全局文件缓存、HDF5 句柄池与金字塔缓存目录"""
     FILE_CACHE.clear()
+    api_ecg.H5_HANDLES.close()
+    monkeypatch.setattr(api_ecg, "PYRAMIDS", api_ecg.PyramidCache(str(tmp_path / "pyramid")))
+    monkeypatch.setattr(api_ecg, "FILTER_TILES", api_ecg.FilteredTileCache())
+    monkeypatch.setattr(api_ecg, "NPZ_DIR", str(tmp_path / "npz"))
+    monkeypatch.setattr(api_ecg, "META_DIR", str(tmp_path / "meta"))
+    # interval_sec=0：不启动后台清理线程，测试里显式调用 sweep()
+    monkeypatch.setattr(api_ecg, "JANITOR", api_ecg.TempJanitor(root=str(tmp_path), interval_sec=0))
+    # 预取会在后台多读相邻窗口，默认关闭以免干扰其它测试的缓存计数
+    monkeypatch.setattr(api_ecg, "PREFETCHER", api_ecg.WindowPrefetcher(enabled=False))
     yield
+    api_ecg.PREFETCHER.close()
+    api_ecg.PYRAMIDS.close()
     FILE_CACHE.clear()
+    api_ecg.H5_HANDLES.close()
 
 
 @pytest.fixture
@@ -84,6 +101,12 @@ def _open_local(client, path):
     return resp.get_json()
 
 
+def _wait_pyramid(path):
+    pyramid = api_ecg.PYRAMIDS.get(path)
+    assert pyramid is not None and pyramid.done.wait(10)
+    return pyramid
+
+
 # ========================= 纯函数 =========================
 
 class TestConvertNumpyTypes:
@@ -137,6 +160,52 @@ class TestMinmaxDownsample:
         np.testing.assert_array_equal(out[1], data.max(axis=0))
 
 
+def _lttb_reference(y, n_out):
+    """逐点标量 LTTB（教科书实现），作为向量化版本的对照"""
+    n = len(y)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    out, a = [0], 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        if b + 1 < n_out - 2:
+            c_x, c_y = (edges[b + 1] + edges[b + 2] - 1) / 2, y[edges[b + 1]:edges[b + 2]].mean()
+        else:
+            c_x, c_y = n - 1, y[-1]
+        a = max(range(lo, hi), key=lambda j: abs((a - c_x) * (y[j] - y[a]) - (a - j) * (c_y - y[a])))
+        out.append(a)
+    return out + [n - 1]
+
+
+class TestDecimateToPoints:
+    def test_lttb_matches_scalar_reference(self):
+        data = np.random.default_rng(0).standard_normal((3001, 3)).cumsum(axis=0)
+        index = lttb_indices(data, 200)
+        assert index.shape == (200, 3)
+        for c in range(3):
+            assert index[:, c].tolist() == _lttb_reference(data[:, c], 200)
+
+    def test_short_input_untouched(self):
+        data = np.arange(20, dtype=float).reshape(10, 2)
+        out, index, factor = decimate_to_points(data, 10, "lttb")
+        assert out is data and index is None and factor == 1
+
+    @pytest.mark.parametrize("n", [101, 1000, 12345])
+    def test_minmax_bounded_and_keeps_peaks(self, n):
+        data = np.zeros((n, 2))
+        data[n // 3, 0] = 999.0
+        data[n // 2, 1] = -888.0
+        out, index, factor = decimate_to_points(data, 100, "minmax")
+        assert index is None and factor > 1
+        assert out.shape[0] <= 100
+        assert 999.0 in out[:, 0] and -888.0 in out[:, 1]
+
+    def test_lttb_values_follow_index(self):
+        data = np.random.default_rng(1).standard_normal((5000, 2))
+        out, index, _ = decimate_to_points(data, 300, "lttb")
+        assert out.shape == index.shape == (300, 2)
+        np.testing.assert_array_equal(out, np.take_along_axis(data, index, axis=0))
+
+
 class TestBuildComputedLeads:
     def test_pairs_detected(self):
         meta = _build_computed_leads({"channel_names": ["u+HRA", "u-HRA", "ECG"]})
@@ -238,6 +307,78 @@ class TestFiltersWithScipy:
         assert np.std(out) < 0.5 * np.std(sine200)
 
 
+class TestFilterCascade:
+    """陷波谐波 + 低通 + 高通合成一个缓存的 SOS 级联，与逐级滤波一致"""
+
+    @staticmethod
+    def _sequential(x, method):
+        from scipy import signal
+
+        def run(b, a, y):
+            if method == "causal":
+                zi = signal.lfilter_zi(b, a)
+                return signal.lfilter(b, a, y, axis=0, zi=zi[:, np.newaxis] * y[0])[0]
+            return signal.filtfilt(b, a, y, axis=0)
+
+        y = x
+        for k in (1, 2, 3):
+            b, a = signal.iirnotch(50.0 * k, 35.0, FS)
+            y = run(b, a, run(b, a, y))
+        y = run(*signal.butter(1, 40 / (FS / 2), "low"), y)
+        return run(*signal.butter(1 if method == "causal" else 2, 0.5 / (FS / 2), "high"), y)
+
+    @pytest.mark.parametrize("method", ["causal", "zero_phase"])
+    def test_golden_configuration_matches_sequential(self, method):
+        pytest.importorskip("scipy")
+        t = np.arange(20000) / FS
+        x = (np.random.default_rng(4).standard_normal((20000, 2))
+             + 50 * np.sin(2 * np.pi * 50 * t)[:, np.newaxis])
+        out = api_ecg._apply_grouped_filters(x.copy(), FS, [("40", "0.5")] * 2, method, (50.0, True))
+        ref = self._sequential(x, method)
+        # 因果：稳态初值一致，逐样本相同；零相位：两端填充不同，内部一致
+        inner = slice(None) if method == "causal" else slice(6000, -6000)
+        np.testing.assert_allclose(out[inner], ref[inner], atol=1e-5 * np.abs(ref).max())
+
+    def test_cascade_is_cached_single_pass(self):
+        pytest.importorskip("scipy")
+        first = api_ecg._filter_cascade(1000.0, 50.0, 35.0, True, 40.0, 0.5, "zero_phase")
+        assert api_ecg._filter_cascade(1000.0, 50.0, 35.0, True, 40.0, 0.5, "zero_phase") is first
+        sos, zi = first
+        assert sos.shape == (8, 6) and zi.shape == (8, 2)  # 3 谐波 × 2 + 低通 1 节 + 高通 1 节
+        # 超过奈奎斯特频率的谐波跳过
+        assert api_ecg._filter_cascade(250.0, 50.0, 35.0, True, None, None, "causal")[0].shape == (4, 6)
+
+
+class TestGroupedFilters:
+    """同有效设置的列合成一组、一次 2D 滤波；结果与逐列滤波一致"""
+
+    def test_groups_match_per_column(self, monkeypatch):
+        pytest.importorskip("scipy")
+        data = np.random.default_rng(3).standard_normal((20000, 6)).astype(np.float32)
+        settings = [("40", "0.5"), ("40", "0.5"), ("100", None), ("40", "0.5"), (None, None), ("100", None)]
+        calls = []
+        real_apply = api_ecg._apply_sos
+        monkeypatch.setattr(api_ecg, "_apply_sos",
+                            lambda sos, block, *a: calls.append(block.shape) or real_apply(sos, block, *a))
+        out = api_ecg._apply_grouped_filters(data.copy(), FS, settings, "zero_phase")
+        assert sorted(calls) == [(20000, 2), (20000, 3)]  # 两组各一次，而非逐列
+        assert out.dtype == np.float32
+        for col, (lp, hp) in enumerate(settings):
+            ref = data[:, col].astype(np.float64)
+            if lp:
+                ref = apply_lowpass_filter(ref, FS, cutoff=float(lp))
+            if hp:
+                ref = apply_highpass_filter(ref, FS, cutoff=float(hp))
+            # 单级联与逐级 filtfilt 只在两端的填充处理上不同
+            np.testing.assert_allclose(out[6000:-6000, col], ref[6000:-6000], atol=1e-4)
+
+    def test_invalid_cutoff_leaves_group_unfiltered(self):
+        pytest.importorskip("scipy")
+        data = np.ones((100, 2))
+        out = api_ecg._apply_grouped_filters(data.copy(), FS, [("abc", None), ("abc", None)], "causal")
+        np.testing.assert_array_equal(out, data)
+
+
 # ========================= API 端点 =========================
 
 class TestCheckEndpoint:
@@ -338,6 +479,243 @@ class TestDataEndpoint:
         assert body["num_samples"] == FS  # 1 秒 * 1000Hz
 
 
+class TestMaxPoints:
+    """max_points：按像素数自动降采样，在滤波之后进行"""
+
+    def test_bounded_by_points(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        body = client.get(f"/api/ecg/data/{file_id}?start=0&end=10&max_points=300").get_json()
+        assert body["decimation"] == "minmax" and body["downsample"] > 1
+        assert body["num_samples"] <= 300 and "sample_index" not in body
+
+    def test_supersedes_downsample(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        body = client.get(
+            f"/api/ecg/data/{file_id}?start=0&end=1&downsample=4&max_points=5000").get_json()
+        assert body["num_samples"] == FS and body["decimation"] == "minmax"
+
+    def test_lttb_index(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        full = np.asarray(client.get(f"/api/ecg/data/{file_id}?start=0&end=10").get_json()["data"])
+        body = client.get(
+            f"/api/ecg/data/{file_id}?start=0&end=10&max_points=200&decimate=lttb").get_json()
+        assert body["decimation"] == "lttb" and body["num_samples"] == 200
+        index = np.asarray(body["sample_index"]).T
+        np.testing.assert_array_equal(np.asarray(body["data"]), np.take_along_axis(full, index, axis=0))
+
+    def test_lttb_binary_carries_index(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        query = f"/api/ecg/data/{file_id}?start=0&end=10&max_points=200&decimate=lttb"
+        as_json = client.get(query).get_json()
+        body = client.get(query + "&format=bin").data
+        n = int.from_bytes(body[:4], "little")
+        meta = json.loads(body[4:4 + n])
+        assert meta["index_dtype"] == "int32"
+        size = meta["num_channels"] * meta["num_samples"]
+        index = np.frombuffer(body[4 + n + 4 * size:], dtype="<i4").reshape(meta["num_channels"], -1)
+        np.testing.assert_array_equal(index, np.asarray(as_json["sample_index"]))
+
+    @pytest.mark.parametrize("query", ["max_points=2", "max_points=abc", "max_points=100&decimate=avg"])
+    def test_invalid_params(self, client, planter_h5, query):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        assert client.get(f"/api/ecg/data/{file_id}?{query}").status_code == 400
+
+
+class TestPyramid:
+    """打开后后台构建 min/max 金字塔，缩小视图直接取金字塔"""
+
+    def test_zoomed_out_served_from_pyramid(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        _wait_pyramid(planter_h5)
+        full = np.asarray(client.get(f"/api/ecg/data/{file_id}?start=0&end=10").get_json()["data"])
+        body = client.get(f"/api/ecg/data/{file_id}?start=0&end=10&max_points=40").get_json()
+        assert body["source"] == "pyramid" and body["num_samples"] <= 40
+        # 64 样本桶两两归并 = 对原始数据按 128 因子做 Min-Max
+        assert body["downsample"] == 128
+        np.testing.assert_array_equal(np.asarray(body["data"]), minmax_downsample(full, 128))
+
+    def test_filters_and_short_windows_read_raw(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        _wait_pyramid(planter_h5)
+        base = f"/api/ecg/data/{file_id}?start=0&end=10"
+        assert client.get(base + "&max_points=40&lp=35").get_json()["source"] == "raw"
+        assert client.get(base + "&max_points=5000").get_json()["source"] == "raw"
+
+    def test_default_viewer_lttb_served_from_pyramid(self, client, planter_h5):
+        # 与 ui/ecg_viewer.html 默认请求同参：decimate=lttb、无滤波、format=bin
+        file_id = _open_local(client, planter_h5)["file_id"]
+        _wait_pyramid(planter_h5)
+        query = (f"/api/ecg/data/{file_id}?enhanced_notch=false&filter_method=zero_phase"
+                 f"&start=0&end=10&max_points=40&decimate=lttb&channels=0,1,2")
+        resp = client.get(query + "&format=bin")
+        header_len = int.from_bytes(resp.data[:4], "little")
+        meta = json.loads(resp.data[4:4 + header_len])
+        assert meta["source"] == "pyramid" and meta["decimation"] == "lttb"
+        assert meta["num_samples"] <= 40 and meta["index_dtype"] == "int32"
+        body = client.get(query).get_json()
+        assert body["source"] == "pyramid"
+        # 选中点取自同层 min/max 包络：第 i 行位于 i × downsample / 2
+        envelope = client.get(query.replace("decimate=lttb", "decimate=minmax")).get_json()
+        rows = np.asarray(envelope["data"])
+        data, index = np.asarray(body["data"]), np.asarray(body["sample_index"])
+        for ch in range(3):
+            assert (np.diff(index[ch]) > 0).all()
+            np.testing.assert_array_equal(data[:, ch], rows[index[ch] * 2 // envelope["downsample"], ch])
+        # 窗口足够长时在 max_points × PYRAMID_LTTB_OVERSAMPLE 的细包络上选点
+        body = client.get(query.replace("max_points=40", "max_points=8")).get_json()
+        assert body["source"] == "pyramid" and body["num_samples"] == 8
+
+    def test_partial_build_falls_back(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        pyramid = _wait_pyramid(planter_h5)
+        pyramid.built = 0  # 模拟构建尚未覆盖该窗口
+        body = client.get(f"/api/ecg/data/{file_id}?start=0&end=10&max_points=40").get_json()
+        assert body["source"] == "raw" and body["num_samples"] <= 40
+
+    def test_reused_from_disk_and_invalidated_by_mtime(self, client, planter_h5, tmp_path):
+        _open_local(client, planter_h5)
+        _wait_pyramid(planter_h5)
+        api_ecg.PYRAMIDS.close()
+        cache = api_ecg.PyramidCache(str(tmp_path / "pyramid"))
+        info = next(iter(FILE_CACHE.values()))
+        pyramid = cache.ensure(info)
+        assert pyramid.thread is None and pyramid.done.is_set()  # 直接加载落盘结果
+        st = os.stat(planter_h5)
+        os.utime(planter_h5, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert cache.get(planter_h5) is None
+        cache.close()
+
+    def test_computed_leads_pyramid(self, client, computed_h5):
+        file_id = _open_local(client, computed_h5)["file_id"]
+        _wait_pyramid(computed_h5)
+        query = f"/api/ecg/data/{file_id}?start=0&end=10&max_points=20"
+        full = np.asarray(client.get(query.replace("&max_points=20", "")).get_json()["data"])
+        body = client.get(query).get_json()
+        assert body["source"] == "pyramid"
+        np.testing.assert_allclose(np.asarray(body["data"]), minmax_downsample(full, body["downsample"]))
+
+    def test_check_reports_and_cleanup_removes_upload(self, client, planter_h5):
+        with open(planter_h5, "rb") as f:
+            resp = client.post("/api/ecg/upload", data={"file": (f, "x.h5")},
+                               content_type="multipart/form-data")
+        file_id = resp.get_json()["file_id"]
+        path = FILE_CACHE[file_id]["path"]
+        directory = _wait_pyramid(path).directory
+        assert client.get("/api/ecg/check").get_json()["pyramids"]["count"] == 1
+        client.delete(f"/api/ecg/cleanup/{file_id}")
+        assert not os.path.exists(directory)
+        assert client.get("/api/ecg/check").get_json()["pyramids"]["count"] == 0
+
+
+class TestH5HandlePool:
+    """get_data 复用池内句柄；文件改写、超限、空闲与清理时关闭。"""
+
+    def test_data_requests_reuse_handle(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        _wait_pyramid(planter_h5)  # 后台构建也经句柄池读取
+        before = api_ecg.H5_HANDLES.stats()
+        for start in (0, 0.5, 1.0):
+            assert client.get(f"/api/ecg/data/{file_id}?start={start}&end={start + 0.5}").status_code == 200
+        stats = api_ecg.H5_HANDLES.stats()
+        assert stats["opens"] - before["opens"] == 0
+        assert stats["hits"] - before["hits"] == 3
+        assert client.get("/api/ecg/check").get_json()["h5_handles"]["open"] == 1
+
+    def test_mtime_change_reopens(self, planter_h5):
+        pool = api_ecg.H5HandlePool()
+        with pool.acquire(planter_h5) as f:
+            first = f.id.id
+        st = os.stat(planter_h5)
+        os.utime(planter_h5, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        with pool.acquire(planter_h5) as f:
+            assert f.id.id != first
+        assert pool.stats()["reopens"] == 1
+        pool.close()
+
+    def test_cap_evicts_lru_and_in_use_handle_survives(self, planter_h5, tmp_path):
+        import shutil
+        other = str(tmp_path / "other.h5")
+        shutil.copy(planter_h5, other)
+        pool = api_ecg.H5HandlePool(max_open=1)
+        with pool.acquire(planter_h5) as held:
+            with pool.acquire(other):
+                pass
+            # 超限但 planter_h5 仍在用：不得关闭
+            assert held.id.valid
+        with pool.acquire(other):
+            pass
+        assert pool.stats()["open"] == 1 and pool.stats()["evictions"] >= 1
+        pool.close()
+
+    def test_idle_timeout_closes(self, planter_h5, tmp_path):
+        import shutil
+        other = str(tmp_path / "other.h5")
+        shutil.copy(planter_h5, other)
+        pool = api_ecg.H5HandlePool(idle_sec=0.0)
+        with pool.acquire(planter_h5) as f:
+            handle = f
+        with pool.acquire(other):
+            pass
+        assert not handle.id.valid and pool.stats()["idle_closed"] == 1
+        pool.close()
+
+    def test_cleanup_closes_handle(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        client.get(f"/api/ecg/data/{file_id}?start=0&end=0.5")
+        client.delete(f"/api/ecg/cleanup/{file_id}")
+        assert api_ecg.H5_HANDLES.stats()["open"] == 0
+
+
+class TestChannelSubsetRead:
+    """只读显示通道所需的原始行，连续下标合并为 hyperslab"""
+
+    @pytest.fixture
+    def wide_h5(self, tmp_path):
+        path = str(tmp_path / "wide.h5")
+        data = np.arange(20 * 500, dtype=np.float32).reshape(20, 500)  # channels_first
+        with h5py.File(path, "w") as f:
+            ds = f.create_dataset("data", data=data)
+            ds.attrs["channel_names"] = ",".join(f"Ch{i}" for i in range(20))
+            ds.attrs["sampling_freq"] = float(FS)
+        return path, data
+
+    def test_channel_runs(self):
+        assert api_ecg._channel_runs([0, 1, 2, 5, 7, 8]) == [(0, 3), (5, 6), (7, 9)]
+
+    def test_source_channels_for_computed_leads(self, client, computed_h5):
+        metadata = FILE_CACHE[_open_local(client, computed_h5)["file_id"]]["metadata"]
+        assert api_ecg._source_channels(metadata, [0]) == [0, 1]
+        assert api_ecg._source_channels(metadata, [1]) == [2]
+
+    def test_out_of_range_reads_everything(self, client, wide_h5):
+        metadata = FILE_CACHE[_open_local(client, wide_h5[0])["file_id"]]["metadata"]
+        assert api_ecg._source_channels(metadata, [3, 25]) is None
+
+    def test_reads_only_requested_rows(self, client, wide_h5, monkeypatch):
+        path, data = wide_h5
+        file_id = _open_local(client, path)["file_id"]
+        shapes = []
+        getitem = h5py.Dataset.__getitem__
+
+        def spy(self, args, *rest, **kwargs):
+            out = getitem(self, args, *rest, **kwargs)
+            shapes.append(np.shape(out))
+            return out
+
+        monkeypatch.setattr(h5py.Dataset, "__getitem__", spy)
+        body = client.get(f"/api/ecg/data/{file_id}?start=0.1&end=0.3&channels=10,3,4").get_json()
+        np.testing.assert_array_equal(np.asarray(body["data"]), data[[10, 3, 4], 100:300].T)
+        assert shapes == [(2, 200), (1, 200)]  # 两段 hyperslab：[3, 5) 与 [10, 11)
+
+    def test_scattered_channels_read_bounding_slab(self, client, wide_h5, monkeypatch):
+        path, data = wide_h5
+        file_id = _open_local(client, path)["file_id"]
+        monkeypatch.setattr(api_ecg, "H5_MAX_HYPERSLABS", 2)
+        channels = [0, 4, 8, 12]
+        raw = api_ecg._read_raw_window(FILE_CACHE[file_id], 0, 50, channels)
+        np.testing.assert_array_equal(raw, data[channels, :50].T)
+
+
 class TestAnnotationsEndpoint:
     def test_all(self, client, planter_h5):
         file_id = _open_local(client, planter_h5)["file_id"]
@@ -356,6 +734,119 @@ class TestAnnotationsEndpoint:
         assert body["total"] == 1
         assert body["annotations"][0]["sample"] == 500
 
+    def test_type_filter_and_counts(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        body = client.get(f"/api/ecg/annotations/{file_id}?type=EVENT").get_json()
+        assert [a["sample"] for a in body["annotations"]] == [500]
+        # counts 统计时间范围内全部标签，不受 type 影响
+        assert body["counts"] == {"hello": 1, "EVENT": 1}
+
+    def test_paging(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        body = client.get(f"/api/ecg/annotations/{file_id}?offset=1&limit=5").get_json()
+        assert body["total"] == 2 and body["offset"] == 1 and body["limit"] == 5
+        assert [a["sample"] for a in body["annotations"]] == [500]
+
+    @pytest.mark.parametrize("query", ["start=abc", "limit=-1", "offset=x"])
+    def test_bad_params(self, client, planter_h5, query):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        assert client.get(f"/api/ecg/annotations/{file_id}?{query}").status_code == 400
+
+
+class TestAnnotationIndex:
+    """列式标注索引与逐条扫描结果一致"""
+
+    @pytest.fixture
+    def marks(self):
+        rng = np.random.default_rng(7)
+        samples = rng.integers(0, 10**7, size=20000)
+        labels = rng.choice(["ABL", "NOTE", "PACE"], size=samples.size)
+        return [{"index": i, "sample": int(s), "label": str(lab)}
+                for i, (s, lab) in enumerate(zip(samples, labels))]
+
+    @pytest.mark.parametrize("start,end,label", [
+        (None, None, None), (100.0, 250.5, None), (100.0, 250.5, "PACE"),
+        (9999.0, None, "ABL"), (300.0, 200.0, None), (None, 50.0, "MISSING"),
+    ])
+    def test_matches_linear_scan(self, marks, start, end, label):
+        fs = 1000.0
+        index = api_ecg.AnnotationIndex(marks, fs)
+        positions, counts = index.query(start, end, label)
+        in_range = [m for m in marks
+                    if (start is None or m["sample"] / fs >= start)
+                    and (end is None or m["sample"] / fs <= end)]
+        expected = sorted((m for m in in_range if label is None or m["label"] == label),
+                          key=lambda m: m["sample"])
+        got = index.records(positions)
+        assert [m["index"] for m in got] == [m["index"] for m in expected]
+        assert counts == {lab: n for lab in ("ABL", "NOTE", "PACE")
+                          if (n := sum(m["label"] == lab for m in in_range))}
+        if got:
+            assert got[0]["time_sec"] == pytest.approx(got[0]["sample"] / fs)
+
+    def test_empty(self):
+        positions, counts = api_ecg.AnnotationIndex([], 1000.0).query(0.0, 1.0, "X")
+        assert len(positions) == 0 and counts == {}
+
+
+
+class TestMetadataDiskCache:
+    """重新打开本地 HDF5 时元数据与标注取自磁盘缓存"""
+
+    def _forbid_parsing(self, monkeypatch):
+        def fail(*args):
+            raise AssertionError("命中缓存时不应重新解析 HDF5")
+        monkeypatch.setattr(api_ecg, "_extract_metadata", fail)
+        monkeypatch.setattr(api_ecg, "_extract_annotations", fail)
+
+    def test_reopen_served_from_cache(self, client, planter_h5, monkeypatch):
+        first = _open_local(client, planter_h5)
+        annotations = client.get(f"/api/ecg/annotations/{first['file_id']}").get_json()["annotations"]
+        self._forbid_parsing(monkeypatch)
+        second = _open_local(client, planter_h5)
+        assert second["metadata"] == first["metadata"]
+        assert second["num_annotations"] == first["num_annotations"]
+        again = client.get(f"/api/ecg/annotations/{second['file_id']}").get_json()["annotations"]
+        assert again == annotations
+        assert client.get(f"/api/ecg/data/{second['file_id']}?start=0&end=0.5").status_code == 200
+
+    def test_rewritten_file_is_parsed_again(self, client, planter_h5, monkeypatch):
+        _open_local(client, planter_h5)
+        st = os.stat(planter_h5)
+        os.utime(planter_h5, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        calls = []
+        extract = api_ecg._extract_metadata
+        monkeypatch.setattr(api_ecg, "_extract_metadata", lambda *a: calls.append(1) or extract(*a))
+        _open_local(client, planter_h5)
+        assert calls == [1]
+
+    def test_reader_version_invalidates(self, client, planter_h5, monkeypatch):
+        _open_local(client, planter_h5)
+        monkeypatch.setattr(api_ecg, "METADATA_READER_VERSION", api_ecg.METADATA_READER_VERSION + 1)
+        calls = []
+        extract = api_ecg._extract_metadata
+        monkeypatch.setattr(api_ecg, "_extract_metadata", lambda *a: calls.append(1) or extract(*a))
+        _open_local(client, planter_h5)
+        assert calls == [1]
+        assert len(os.listdir(api_ecg.META_DIR)) == 2
+
+    def test_corrupt_cache_falls_back(self, client, planter_h5):
+        expected = _open_local(client, planter_h5)["metadata"]
+        (cache_file,) = os.listdir(api_ecg.META_DIR)
+        with open(os.path.join(api_ecg.META_DIR, cache_file), "w") as f:
+            f.write("{truncated")
+        assert _open_local(client, planter_h5)["metadata"] == expected
+
+    @pytest.mark.skipif(os.name != "posix", reason="POSIX 权限位")
+    def test_cache_is_private_to_user(self, client, planter_h5):
+        # 缓存含患者标识：即使目录已以宽松权限存在，也收紧为仅本用户可访问
+        os.makedirs(api_ecg.META_DIR, mode=0o777)
+        os.chmod(api_ecg.META_DIR, 0o777)
+        _open_local(client, planter_h5)
+        assert os.stat(api_ecg.META_DIR).st_mode & 0o777 == 0o700
+        (cache_file,) = os.listdir(api_ecg.META_DIR)
+        assert os.stat(os.path.join(api_ecg.META_DIR, cache_file)).st_mode & 0o777 == 0o600
+
 
 class TestCleanup:
     def test_cleanup_local_keeps_file_on_disk(self, client, planter_h5):
@@ -380,6 +871,96 @@ class TestCleanup:
         assert os.path.exists(planter_h5)  # 用户原始数据不得被删除
 
 
+def _upload_npy(client, name="sig.npy", samples=300):
+    buf = io.BytesIO()
+    np.save(buf, np.ones((samples, 2), dtype=np.float32))
+    buf.seek(0)
+    resp = client.post("/api/ecg/upload", data={"file": (buf, name)},
+                       content_type="multipart/form-data")
+    assert resp.status_code == 200, resp.get_json()
+    return resp.get_json()["file_id"]
+
+
+class TestFileCacheBounds:
+    """FILE_CACHE 的字节预算 / 空闲过期与 TEMP_DIR 配额清理"""
+
+    @pytest.fixture
+    def temp_dir(self, tmp_path, monkeypatch):
+        root = tmp_path / "viewer_tmp"
+        root.mkdir()
+        monkeypatch.setattr(api_ecg, "TEMP_DIR", str(root))
+        monkeypatch.setattr(api_ecg, "JANITOR", api_ecg.TempJanitor(
+            root=str(root), quota_bytes=10**9, interval_sec=0))
+        return root
+
+    def test_budget_evicts_lru_and_releases_upload(self, client, temp_dir, monkeypatch):
+        monkeypatch.setattr(api_ecg, "FILE_CACHE", api_ecg.FileCache(budget_bytes=1))
+        first = _upload_npy(client)
+        first_path = api_ecg.FILE_CACHE[first]["path"]
+        second = _upload_npy(client)
+        # 刚放入的条目不淘汰；被淘汰的上传文件随即删除
+        assert second in api_ecg.FILE_CACHE
+        assert client.get(f"/api/ecg/data/{first}?start=0&end=0.1").status_code == 404
+        assert not os.path.exists(first_path)
+        stats = client.get("/api/ecg/check").get_json()["file_cache"]
+        assert stats["entries"] == 1 and stats["evictions"] == 1
+
+    def test_idle_entries_expire(self, client, planter_h5, monkeypatch):
+        monkeypatch.setattr(api_ecg, "FILE_CACHE", api_ecg.FileCache(idle_sec=0))
+        file_id = _open_local(client, planter_h5)["file_id"]
+        assert client.get(f"/api/ecg/metadata/{file_id}").status_code == 404
+        assert api_ecg.FILE_CACHE.stats()["expired"] == 1
+        assert os.path.exists(planter_h5)  # 本地文件过期也只清缓存
+
+    def test_check_reports_hit_rate(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        client.get(f"/api/ecg/metadata/{file_id}")
+        client.get("/api/ecg/metadata/missing")
+        stats = client.get("/api/ecg/check").get_json()["file_cache"]
+        assert stats["misses"] == 1 and stats["hits"] >= 1 and 0 < stats["hit_rate"] < 1
+        assert stats["bytes"] > 0
+
+    def test_annotation_index_counts_toward_budget(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        before = api_ecg.FILE_CACHE.stats()["bytes"]
+        assert client.get(f"/api/ecg/annotations/{file_id}").status_code == 200
+        index = api_ecg.FILE_CACHE[file_id]["annotation_index"]
+        assert api_ecg.FILE_CACHE.stats()["bytes"] == before + index.nbytes() > before
+
+    def test_janitor_removes_stale_exports(self, client, temp_dir):
+        png = base64.b64encode(b"\x89PNG fake").decode()
+        url = client.post("/api/ecg/export_image", json={"image_data": png}).get_json()["download_url"]
+        path = temp_dir / (url.split("/")[-1].split("?")[0] + ".png")
+        fresh = temp_dir / "fresh.png"
+        fresh.write_bytes(b"x")
+        old = time.time() - 2 * api_ecg.EXPORT_IMAGE_TTL_SEC
+        os.utime(path, (old, old))
+        api_ecg.JANITOR.sweep()
+        assert not path.exists() and fresh.exists()
+        assert api_ecg.JANITOR.stats()["exports_removed"] == 1
+
+    def test_quota_removes_unreferenced_files_first(self, client, temp_dir):
+        file_id = _upload_npy(client, samples=2000)
+        in_use = api_ecg.FILE_CACHE[file_id]["path"]
+        stale = temp_dir / "npz" / "stale.npy"
+        stale.parent.mkdir()
+        stale.write_bytes(b"0" * 50000)
+        old = time.time() - 3600
+        os.utime(stale, (old, old))
+        os.utime(in_use, (old, old))
+        api_ecg.JANITOR.quota_bytes = 20000
+        total = api_ecg.JANITOR.sweep()
+        assert not stale.exists() and os.path.exists(in_use)
+        assert total <= 20000
+
+    def test_quota_evicts_lru_upload(self, client, temp_dir):
+        first = _upload_npy(client, samples=2000)
+        second = _upload_npy(client, samples=2000)
+        api_ecg.JANITOR.quota_bytes = 20000
+        api_ecg.JANITOR.sweep()
+        assert first not in api_ecg.FILE_CACHE and second in api_ecg.FILE_CACHE
+
+
 # ========================= 计算导联模式 =========================
 
 @pytest.fixture
@@ -478,6 +1059,174 @@ class TestDataFilterParams:
         assert col(body["data"], 1) == col(raw, 1)  # 通道 1 不受影响
 
 
+class TestFilteredTileCache:
+    """滤波结果按带重叠填充的固定分块缓存"""
+
+    @pytest.fixture
+    def tiles(self, monkeypatch):
+        pytest.importorskip("scipy")
+        cache = api_ecg.FilteredTileCache(tile_samples=512)
+        monkeypatch.setattr(api_ecg, "FILTER_TILES", cache)
+        return cache
+
+    def test_window_edges_match_whole_file_filtering(self, client, planter_h5, tiles):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        whole = np.asarray(client.get(
+            f"/api/ecg/data/{file_id}?start=0&end=2&notch=50&hp=0.5").get_json()["data"])
+        window = np.asarray(client.get(
+            f"/api/ecg/data/{file_id}?start=0.7&end=1.3&notch=50&hp=0.5").get_json()["data"])
+        # 窗口边缘不是滤波边界：与整段滤波后再切片一致
+        np.testing.assert_allclose(window, whole[700:1300], rtol=1e-5, atol=1e-3)
+
+    def test_pan_back_hits_cache(self, client, planter_h5, tiles):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        for start in (0.0, 0.6, 0.0):
+            query = f"/api/ecg/data/{file_id}?start={start}&end={start + 0.4}&lp=40"
+            assert client.get(query).status_code == 200
+        stats = client.get("/api/ecg/check").get_json()["filter_tiles"]
+        assert stats["misses"] == 2 and stats["hits"] == 1  # 分块 0、1 各算一次
+        # 不同滤波参数 / 通道集合是不同的键
+        client.get(f"/api/ecg/data/{file_id}?start=0&end=0.4&lp=30")
+        client.get(f"/api/ecg/data/{file_id}?start=0&end=0.4&lp=40&channels=0")
+        assert tiles.stats()["misses"] == 4
+
+    def test_budget_evicts_lru(self, planter_h5, client):
+        pytest.importorskip("scipy")
+        file_id = _open_local(client, planter_h5)["file_id"]
+        cache = api_ecg.FilteredTileCache(budget_bytes=512 * 3 * 4 * 2, tile_samples=512)
+        spec = api_ecg._filter_spec(lp_cutoff="40")
+        cache.window(FILE_CACHE[file_id], 0, N_SAMPLES, [0, 1, 2], spec)
+        stats = cache.stats()
+        assert stats["tiles"] == 2 and stats["evictions"] == 2
+        assert stats["bytes"] <= stats["budget_bytes"]
+
+    def test_slow_highpass_has_no_tile_seams(self, client, tmp_path, tiles):
+        # 0.05 Hz 高通 τ≈3.2 s，需要约 38 s 填充：不得截短成分块接缝处的跳变
+        fs, seconds = 200, 120
+        t = np.arange(fs * seconds) / fs
+        data = (5000 + 800 * np.sin(2 * np.pi * 0.02 * t)).astype(np.int32)[:, None]
+        path = str(tmp_path / "slow.h5")
+        with HDFPlanter(f_path=path, column_names=["I"], sampling_freq=fs,
+                        factor=1000, units="uV") as planter:
+            planter.write(data)
+        file_id = _open_local(client, path)["file_id"]
+        info, spec = FILE_CACHE[file_id], api_ecg._filter_spec(hp_cutoff="0.05")
+        assert api_ecg._filter_pad_samples(fs, spec) > api_ecg.FILTER_TILE_MAX_PAD_SEC * fs
+        raw = api_ecg._read_raw_window(info, 0, fs * seconds).astype(np.float64)
+        whole = api_ecg._filter_window(raw, info["metadata"], [0], fs, spec)
+        start, end = 50 * fs, 70 * fs  # 跨越多个 512 样本分块边界
+        window = tiles.window(info, start, end, [0], spec)
+        np.testing.assert_allclose(window[:, 0], whole[start:end, 0], atol=1e-4)
+        # 原信号逐样本变化不超过一个量化步 1e-3；截短填充时接缝处残留直流瞬态 ≈ 5·e^(-10/3.2) ≈ 0.2
+        assert np.abs(np.diff(window[:, 0])).max() < 5e-3
+        assert tiles.stats()["direct"] == 1 and tiles.stats()["tiles"] == 0
+
+    def test_cleanup_drops_tiles(self, client, planter_h5, tiles):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        client.get(f"/api/ecg/data/{file_id}?start=0&end=1&lp=40")
+        assert tiles.stats()["tiles"] > 0
+        client.delete(f"/api/ecg/cleanup/{file_id}")
+        assert tiles.stats()["tiles"] == 0
+
+
+
+class TestPrefetch:
+    """相邻窗口预取与有界响应缓存"""
+
+    @pytest.fixture
+    def prefetcher(self, monkeypatch):
+        prefetcher = api_ecg.WindowPrefetcher(enabled=True)
+        monkeypatch.setattr(api_ecg, "PREFETCHER", prefetcher)
+        return prefetcher
+
+    def test_next_page_is_served_from_cache(self, client, planter_h5, prefetcher):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        client.get(f"/api/ecg/data/{file_id}?start=0&end=0.5")
+        prefetcher.wait()
+        assert prefetcher.stats()["prefetched"] == 1  # 起点为 0，只有下一页
+        resp = client.get(f"/api/ecg/data/{file_id}?start=0.5&end=1.0")
+        assert resp.status_code == 200
+        stats = prefetcher.stats()
+        assert stats["hits"] == 1 and stats["misses"] == 1
+
+    def test_cached_response_matches_fresh(self, client, planter_h5, prefetcher):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        client.get(f"/api/ecg/data/{file_id}?start=0.5&end=1.0&downsample=2")
+        prefetcher.wait()
+        cached = client.get(f"/api/ecg/data/{file_id}?start=1.0&end=1.5&downsample=2").get_json()
+        assert prefetcher.stats()["hits"] == 1
+        prefetcher.enabled = False
+        fresh = client.get(f"/api/ecg/data/{file_id}?start=1.0&end=1.5&downsample=2").get_json()
+        assert cached == fresh
+
+    def test_jump_cancels_stale_prefetch(self, client, planter_h5, prefetcher, monkeypatch):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        started, release = threading.Event(), threading.Event()
+        compute = api_ecg._compute_data
+
+        def gated_compute(*args):
+            if threading.current_thread().name.startswith("ecg-prefetch"):
+                started.set()
+                release.wait(5)
+            return compute(*args)
+
+        monkeypatch.setattr(api_ecg, "_compute_data", gated_compute)
+        client.get(f"/api/ecg/data/{file_id}?start=0.4&end=0.6")
+        assert started.wait(5)  # 下一页正在算，上一页仍在排队
+        client.get(f"/api/ecg/data/{file_id}?start=1.4&end=1.6")
+        release.set()
+        prefetcher.wait()
+        stats = prefetcher.stats()
+        assert stats["cancelled"] == 1
+        assert stats["prefetched"] == 3  # 旧的下一页 + 新窗口两侧
+        client.get(f"/api/ecg/data/{file_id}?start=0.2&end=0.4")
+        assert prefetcher.stats()["misses"] == 3
+
+    def test_budget_bounds_cache(self, client, planter_h5, monkeypatch):
+        # 每个 0.1 s 窗口 100×3 float32 = 1200 B，预算只够两个
+        prefetcher = api_ecg.WindowPrefetcher(budget_bytes=2400, enabled=True)
+        monkeypatch.setattr(api_ecg, "PREFETCHER", prefetcher)
+        file_id = _open_local(client, planter_h5)["file_id"]
+        for start in (0.0, 0.5, 1.0, 1.5):
+            client.get(f"/api/ecg/data/{file_id}?start={start}&end={start + 0.1}")
+            prefetcher.wait()
+        stats = prefetcher.stats()
+        assert stats["bytes"] <= 2400 and stats["evictions"] > 0
+
+    def test_cleanup_drops_responses(self, client, planter_h5, prefetcher):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        client.get(f"/api/ecg/data/{file_id}?start=0&end=0.5")
+        prefetcher.wait()
+        assert prefetcher.stats()["entries"] == 2
+        client.delete(f"/api/ecg/cleanup/{file_id}")
+        assert prefetcher.stats()["entries"] == 0
+
+    def test_cleanup_does_not_wait_for_other_files(self, client, planter_h5, prefetcher,
+                                                   monkeypatch, tmp_path):
+        other = str(tmp_path / "other.h5")
+        with open(planter_h5, "rb") as src, open(other, "wb") as dst:
+            dst.write(src.read())
+        first = _open_local(client, planter_h5)["file_id"]
+        second = _open_local(client, other)["file_id"]
+        started, release = threading.Event(), threading.Event()
+        compute = api_ecg._compute_data
+
+        def gated_compute(file_id, *args):
+            if file_id == second and threading.current_thread().name.startswith("ecg-prefetch"):
+                started.set()
+                release.wait(5)
+            return compute(file_id, *args)
+
+        monkeypatch.setattr(api_ecg, "_compute_data", gated_compute)
+        client.get(f"/api/ecg/data/{second}?start=0&end=0.5")
+        assert started.wait(5)
+        began = time.monotonic()
+        client.delete(f"/api/ecg/cleanup/{first}")
+        assert time.monotonic() - began < 2  # 另一文件的预取仍卡着，释放不受其阻塞
+        assert prefetcher.stats()["inflight"] == 1
+        release.set()
+        prefetcher.wait()
+
 # ========================= NumPy 文件路径 =========================
 
 class TestNumpyFiles:
@@ -500,6 +1249,45 @@ class TestNumpyFiles:
         assert resp.status_code == 200
         assert resp.get_json()["num_samples"] == 300
 
+    def test_npz_decoded_once(self, client, tmp_path, monkeypatch):
+        path = tmp_path / "sig.npz"
+        arr = np.random.default_rng(3).normal(size=(500, 2))
+        np.savez_compressed(path, arr=arr)
+        file_id = _open_local(client, str(path))["file_id"]
+        data_file = FILE_CACHE[file_id]["data_file"]
+        assert os.path.dirname(data_file) == api_ecg.NPZ_DIR
+        assert isinstance(np.load(data_file, mmap_mode="r"), np.memmap)
+
+        def no_reload(*args):
+            raise AssertionError("npz 不应被重新解压")
+
+        # 之后的窗口读取与再次打开都只用解压缓存
+        monkeypatch.setattr(api_ecg, "load_npz", no_reload)
+        body = client.get(f"/api/ecg/data/{file_id}?start=0.4&end=0.8").get_json()
+        np.testing.assert_allclose(np.asarray(body["data"]), arr[100:200], rtol=1e-6)
+        assert FILE_CACHE[_open_local(client, str(path))["file_id"]]["data_file"] == data_file
+
+    def test_npz_redecoded_when_cache_removed(self, client, tmp_path):
+        path = tmp_path / "sig.npz"
+        np.savez(path, arr=np.ones((300, 2)))
+        file_id = _open_local(client, str(path))["file_id"]
+        os.remove(FILE_CACHE[file_id]["data_file"])
+        resp = client.get(f"/api/ecg/data/{file_id}?start=0&end=1")
+        assert resp.status_code == 200
+        assert os.path.exists(FILE_CACHE[file_id]["data_file"])
+
+    def test_upload_cleanup_removes_decoded(self, client, tmp_path):
+        buf = io.BytesIO()
+        np.savez(buf, arr=np.ones((300, 2)))
+        buf.seek(0)
+        resp = client.post("/api/ecg/upload", data={"file": (buf, "sig.npz")},
+                           content_type="multipart/form-data")
+        file_id = resp.get_json()["file_id"]
+        data_file = FILE_CACHE[file_id]["data_file"]
+        assert os.path.exists(data_file)
+        client.delete(f"/api/ecg/cleanup/{file_id}")
+        assert not os.path.exists(data_file)
+
 
 # ========================= browse（mock GUI 子进程） =========================
 
@@ -857,3 +1645,66 @@ class TestExtractionNpzRoundtrip:
         md = resp.get_json()["metadata"]
         assert md["num_channels"] == 2
         assert md["units"] == "uV"
+
+
+# ========================= 按时间戳提取 =========================
+
+class TestExtractEndpoint:
+    def test_extract_from_merged_h5(self, client, tmp_path):
+        import json
+        from pathlib import Path
+        from epycon.conversion import convert_study
+        root = Path(__file__).parent.parent
+        cfg = json.loads((root / "epycon" / "config" / "config.json").read_text(encoding="utf-8"))
+        cfg["data"]["merge_logs"] = True
+        convert_study(str(root / "examples" / "data" / "study01"), "study01", str(tmp_path), cfg, [])
+        body = {"study": str(tmp_path / "study01_merged.h5"), "at": "0:00:00.5",
+                "leads": "CH1", "window": 0.1, "version": "4.3.2"}
+
+        first = client.post("/api/ecg/extract", json=body)
+        second = client.post("/api/ecg/extract", json=body)
+        assert first.status_code == second.status_code == 200
+        assert first.get_json()["leads"][0]["n"] == 200
+        assert second.get_json()["cached"] is True
+        api_ecg._EXTRACT_SESSION.close()
+
+    def test_extract_error_is_400(self, client):
+        resp = client.post("/api/ecg/extract", json={"at": "0:00:01"})
+        assert resp.status_code == 400
+        assert "study" in resp.get_json()["error"]
+
+    def test_extract_rejects_out_path(self, client, tmp_path):
+        target = tmp_path / "written.npz"
+        resp = client.post("/api/ecg/extract", json={
+            "study": str(tmp_path), "at": "0:00:00", "leads": "CH1", "out": str(target)})
+        assert resp.status_code == 400
+        assert "out" in resp.get_json()["error"]
+        assert not target.exists() and list(tmp_path.iterdir()) == []
+
+
+class TestBinaryDataFormat:
+    """format=bin：JSON 前导 + 小端 float32 通道优先，数值与 JSON 路径一致。"""
+
+    @staticmethod
+    def _decode(body):
+        n = int.from_bytes(body[:4], "little")
+        meta = json.loads(body[4:4 + n].decode("utf-8"))
+        assert (4 + n) % 4 == 0
+        samples = np.frombuffer(body[4 + n:], dtype="<f4")
+        return meta, samples.reshape(meta["num_channels"], meta["num_samples"])
+
+    def test_matches_json(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        query = f"/api/ecg/data/{file_id}?start=0.1&end=0.6&channels=2,0&notch=50"
+        as_json = client.get(query).get_json()
+        resp = client.get(query + "&format=bin")
+        assert resp.status_code == 200
+        assert resp.mimetype == "application/octet-stream"
+        meta, samples = self._decode(resp.data)
+        assert meta["layout"] == "channel_major" and meta["channel_names"] == ["V1", "I"]
+        assert meta["num_samples"] == as_json["num_samples"] == 500
+        np.testing.assert_array_equal(samples.T, np.asarray(as_json["data"], dtype=np.float32))
+
+    def test_unknown_format_rejected(self, client, planter_h5):
+        file_id = _open_local(client, planter_h5)["file_id"]
+        assert client.get(f"/api/ecg/data/{file_id}?format=xml").status_code == 400
@@ -0,0 +1,162 @@
+# tests/test_cli_cohort.py
+# 队列数据集构建：合成 study（study01 的两个 .log + 空 entries.log），CI 可跑。
+import json
+import shutil
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pytest
+
+from epycon.cli import cohort
+from epycon.cli.cohort import build_cohort, main
+from epycon.extraction import extract_window, extract_windows
+
+ROOT = Path(__file__).parent.parent
+STUDY01 = ROOT / "examples" / "data" / "study01"
+VER = "4.3.2"
+
+
+def _make_study(path):
+    path.mkdir()
+    for log in sorted(STUDY01.glob("0*.log")):
+        shutil.copy(log, path / log.name)
+    (path / "entries.log").write_bytes(bytes(36))
+    return path
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    _make_study(tmp_path / "a")
+    _make_study(tmp_path / "b")
+    path = tmp_path / "cohort.csv"
+    path.write_text(
+        "study,time,leads\n"
+        "a,0:00:00.5,CH1\n"
+        "a,0:00:05,CH1\n"            # 段间空档：行级错误
+        "b,0:00:00.3,\"CH1,CH2\"\n"
+        "missing,0:00:00.5,CH1\n",   # study 不存在：行级错误
+        encoding="utf-8")
+    return path
+
+
+def _windows(out):
+    with h5py.File(out, "r") as f:
+        return f["Windows"][:], f["Samples"][:]
+
+
+def test_rows_written_and_errors_recorded(manifest, tmp_path):
+    out = str(tmp_path / "cohort.h5")
+    stats = build_cohort(str(manifest), out, window=0.1, version=VER, workers=1)
+    assert (stats["rows"], stats["ok"], stats["errors"]) == (4, 2, 2)
+    assert stats["samples"] == 200 * 3
+    windows, samples = _windows(out)
+    by_row = {}
+    for rec in windows:
+        by_row.setdefault(int(rec["Row"]), []).append(rec)
+    assert [r["Status"] for r in by_row[1]] == [b"error"]
+    assert "空档" in by_row[1][0]["Message"].decode("utf-8")
+    assert [r["Lead"] for r in by_row[2]] == [b"CH1", b"CH2"]
+    # 切片与单次 extract_window 逐样本一致
+    expected = extract_window(str(tmp_path / "b"), at_elapsed="0:00:00.3",
+                              leads=["CH1", "CH2"], window=0.1, version=VER)
+    for rec, ld in zip(by_row[2], expected["leads"]):
+        got = samples[rec["Offset"]:rec["Offset"] + rec["Count"]]
+        assert np.array_equal(got, ld["samples"])
+
+
+def test_resume_skips_done_rows_and_drops_unledgered_tail(manifest, tmp_path):
+    out = str(tmp_path / "cohort.h5")
+    build_cohort(str(manifest), out, window=0.1, version=VER, workers=1)
+    windows_before, samples_before = _windows(out)
+    # 模拟崩溃：账本只保留第一个任务，且最后一行写了一半
+    ledger = Path(out + ".ledger")
+    first = ledger.read_text(encoding="utf-8").splitlines()[0]
+    ledger.write_text(first + "\n{\"study\": ", encoding="utf-8")
+    stats = build_cohort(str(manifest), out, window=0.1, version=VER, workers=1)
+    assert stats["skipped"] == 2 and stats["ok"] + stats["errors"] == 2
+    windows_after, samples_after = _windows(out)
+    assert sorted(windows_after["Row"].tolist()) == sorted(windows_before["Row"].tolist())
+    assert samples_after.shape == samples_before.shape
+    # 全部完成后再跑：无事可做
+    stats = build_cohort(str(manifest), out, window=0.1, version=VER, workers=1)
+    assert stats["tasks"] == 0 and stats["skipped"] == 4
+
+
+def test_process_pool_matches_serial(manifest, tmp_path):
+    serial, pooled = str(tmp_path / "s.h5"), str(tmp_path / "p.h5")
+    build_cohort(str(manifest), serial, window=0.1, version=VER, workers=1)
+    build_cohort(str(manifest), pooled, window=0.1, version=VER, workers=2)
+    (ws, ss), (wp, sp) = _windows(serial), _windows(pooled)
+    order_s, order_p = np.argsort(ws, order=["Row", "Lead"]), np.argsort(wp, order=["Row", "Lead"])
+    for a, b in zip(ws[order_s], wp[order_p]):
+        assert (a["Row"], a["Lead"], a["Status"], a["Count"]) == \
+            (b["Row"], b["Lead"], b["Status"], b["Count"])
+        assert np.array_equal(ss[a["Offset"]:a["Offset"] + a["Count"]],
+                              sp[b["Offset"]:b["Offset"] + b["Count"]])
+
+
+def test_cli_reports_throughput(manifest, tmp_path, capsys):
+    out = str(tmp_path / "cohort.h5")
+    rc = main(["--manifest", str(manifest), "--out", out, "--window", "0.1",
+               "--version", VER, "--workers", "1", "--raw-counts", "--quiet"])
+    assert rc == 0
+    stats = json.loads(capsys.readouterr().out)
+    assert stats["ok"] == 2 and stats["rows_per_s"] > 0
+    with h5py.File(out, "r") as f:
+        assert f["Samples"].dtype == np.int32 and f.attrs["units"] == "counts"
+    # 样本类型与已有输出不符：拒绝续跑
+    assert main(["--manifest", str(manifest), "--out", out, "--window", "0.1",
+                 "--version", VER, "--workers", "1", "--quiet"]) == 2
+
+
+def test_bad_manifest_rows_become_error_records(tmp_path):
+    _make_study(tmp_path / "a")
+    path = tmp_path / "cohort.csv"
+    path.write_text(
+        "study,time,leads\n"
+        "a,0:00:00.5,CH1\n"
+        ",0:00:00.5,CH1\n"          # 缺 study
+        "a,,CH1\n"                  # 缺 time
+        "a,soon,CH1\n",             # 时间无法识别
+        encoding="utf-8")
+    out = str(tmp_path / "cohort.h5")
+    stats = build_cohort(str(path), out, window=0.1, version=VER, workers=1)
+    assert (stats["rows"], stats["ok"], stats["errors"]) == (4, 1, 3)
+    windows, _ = _windows(out)
+    status = {int(r["Row"]): r["Status"] for r in windows}
+    assert status == {0: b"ok", 1: b"error", 2: b"error", 3: b"error"}
+    msg = {int(r["Row"]): r["Message"].decode("utf-8") for r in windows}
+    assert "缺少" in msg[1] and "soon" in msg[3]
+    rows = [row for line in Path(out + ".ledger").read_text(encoding="utf-8").splitlines()
+            for row in json.loads(line)["rows"]]
+    assert sorted(rows) == [0, 1, 2, 3]
+
+
+def test_unexpected_exception_is_row_error(manifest, tmp_path, monkeypatch):
+    def boom(study, *args, **kwargs):
+        if study.endswith("b"):
+            raise ValueError("corrupt block")
+        return extract_windows(study, *args, **kwargs)
+    monkeypatch.setattr(cohort, "extract_windows", boom)
+    out = str(tmp_path / "cohort.h5")
+    stats = build_cohort(str(manifest), out, window=0.1, version=VER, workers=1)
+    assert (stats["ok"], stats["errors"]) == (1, 3)
+    windows, _ = _windows(out)
+    (rec,) = [r for r in windows if int(r["Row"]) == 2]
+    assert rec["Status"] == b"error" and rec["Message"] == b"ValueError: corrupt block"
+
+
+def test_long_study_path_not_truncated(tmp_path):
+    deep = tmp_path
+    for i in range(8):
+        deep = deep / ("d%02d_" % i + "x" * 40)
+    deep.parent.mkdir(parents=True)
+    _make_study(deep)
+    path = tmp_path / "cohort.csv"
+    path.write_text(f"study,time,leads\n{deep},0:00:00.5,CH1\n", encoding="utf-8")
+    out = str(tmp_path / "cohort.h5")
+    build_cohort(str(path), out, window=0.1, version=VER, workers=1)
+    windows, _ = _windows(out)
+    assert len(str(deep)) > 256
+    assert windows[0]["Study"].decode("utf-8") == str(deep)
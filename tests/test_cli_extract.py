@@ -67,3 +67,119 @@ class TestCliExtract:
         reported = json.loads(r.stdout)["out"]
         assert reported.endswith(".npz")
         assert Path(reported).exists()
+
+
+def test_targets_file_batch(tmp_path, capsys):
+    """--targets-file 走批量路径（合成 study，CI 可跑）：stdout 为逐目标结果。"""
+    import shutil
+    from epycon.cli.extract import main
+    study = tmp_path / "study"
+    study.mkdir()
+    for log in sorted((ROOT / "examples" / "data" / "study01").glob("0*.log")):
+        shutil.copy(log, study / log.name)
+    (study / "entries.log").write_bytes(bytes(36))
+    targets = tmp_path / "targets.txt"
+    targets.write_text("# 两个目标\n0:00:00.5\n0:00:05\n", encoding="utf-8")
+
+    rc = main(["--study", str(study), "--targets-file", str(targets), "--leads", "CH1",
+               "--window", "0.1", "--version", "4.3.2", "--out", str(tmp_path / "b")])
+    assert rc == 0
+    meta = json.loads(capsys.readouterr().out)
+    assert meta["results"][0]["leads"][0]["n"] == 200
+    assert "error" in meta["results"][1]
+
+    import numpy as np
+    data = np.load(meta["out"])
+    assert data["0/CH1"].shape == (200,)
+
+
+def test_serve_json_lines(tmp_path):
+    """--serve 的 JSON-lines 循环：逐行响应、回显 id、报告延迟与缓存命中。"""
+    import io
+    import shutil
+    from epycon.cli.extract import serve
+    from epycon.extraction import ExtractionSession
+    study = tmp_path / "study"
+    study.mkdir()
+    for log in sorted((ROOT / "examples" / "data" / "study01").glob("0*.log")):
+        shutil.copy(log, study / log.name)
+    (study / "entries.log").write_bytes(bytes(36))
+
+    requests = [
+        {"id": 1, "study": str(study), "at": "0:00:00.5", "leads": "CH1", "window": 0.1,
+         "version": "4.3.2"},
+        {"id": 2, "study": str(study), "targets": ["0:00:00.5", "0:00:05"], "leads": ["CH1"],
+         "window": 0.1, "version": "4.3.2"},
+        "not json",
+        {"id": 4, "study": str(study), "at": "0:00:05", "leads": "CH1", "version": "4.3.2"},
+    ]
+    stdin = io.StringIO("\n".join(r if isinstance(r, str) else json.dumps(r) for r in requests))
+    stdout = io.StringIO()
+    session = ExtractionSession()
+    assert serve(stdin, stdout, session) == 0
+    session.close()
+
+    first, second, bad, gap = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert first["id"] == 1 and first["cached"] is False and first["leads"][0]["n"] == 200
+    assert second["id"] == 2 and second["cached"] is True
+    assert "error" in second["results"][1]
+    assert "error" in bad
+    assert gap["id"] == 4 and "空档" in gap["error"]
+    assert all("latency_ms" in r for r in (first, second, bad, gap))
+
+
+@pytest.mark.parametrize("suffix", [".npz", ".h5"])
+def test_epochs_stacked_output(tmp_path, capsys, suffix):
+    """--epochs 对合并 HDF5 的标注取窗，写出堆叠数组与 mask。"""
+    import numpy as np
+    from epycon.cli.extract import main
+    from epycon.conversion import convert_study
+    from epycon.core._dataclasses import Entry
+    study01 = ROOT / "examples" / "data" / "study01"
+    cfg = json.loads((ROOT / "epycon" / "config" / "config.json").read_text(encoding="utf-8"))
+    cfg["data"]["merge_logs"] = True
+    entries = [Entry("00000001", "EVENT", 1769608092.753, "RF on")]
+    convert_study(str(study01), "study01", str(tmp_path), cfg, entries)
+
+    out = tmp_path / f"epochs{suffix}"
+    rc = main(["--study", str(tmp_path / "study01_merged.h5"), "--epochs", "--group", "EVENT",
+               "--leads", "CH1,CH2", "--window", "0.1", "--version", "4.3.2", "--out", str(out)])
+    assert rc == 0
+    meta = json.loads(capsys.readouterr().out)
+    assert meta["shape"] == [1, 2, 200] and meta["events"][0]["status"] == "ok"
+    if suffix == ".npz":
+        data = np.load(meta["out"])
+        stack, mask = data["data"], data["mask"]
+    else:
+        import h5py
+        with h5py.File(meta["out"], "r") as f:
+            stack, mask = f["data"][:], f["mask"][:]
+    assert stack.shape == (1, 2, 200) and mask.all()
+
+
+def test_base64_encoding_roundtrip(tmp_path):
+    """encoding=base64：样本以小端二进制传输，np.frombuffer 还原后与 list 编码一致。"""
+    import base64
+    import shutil
+    import numpy as np
+    from epycon.cli.extract import handle_request
+    from epycon.extraction import ExtractionSession
+    study = tmp_path / "study"
+    study.mkdir()
+    for log in sorted((ROOT / "examples" / "data" / "study01").glob("0*.log")):
+        shutil.copy(log, study / log.name)
+    (study / "entries.log").write_bytes(bytes(36))
+
+    session = ExtractionSession()
+    request = {"study": str(study), "at": "0:00:00.5", "leads": "CH1", "window": 0.1,
+               "version": "4.3.2"}
+    plain = handle_request(session, request)
+    packed = handle_request(session, {**request, "encoding": "base64"})
+    bad = handle_request(session, {**request, "encoding": "hex"})
+    session.close()
+
+    enc = json.loads(json.dumps(packed))["leads"][0]["samples"]
+    assert enc["dtype"] == "<f4" and enc["shape"] == [200]
+    decoded = np.frombuffer(base64.b64decode(enc["base64"]), dtype=enc["dtype"])
+    assert decoded.tolist() == plain["leads"][0]["samples"]
+    assert "encoding" in bad["error"]
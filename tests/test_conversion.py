@@ -194,3 +194,199 @@ class TestGuiConversionEquivalence:
         with h5py.File(tmp_path / "study01" / "00000001.h5", "r") as f:
             positions = [int(r["SampleLeft"]) for r in f["Marks"][:]]
             assert positions == [50]
+
+
+# ========================= 多格式单遍扇出 =========================
+
+class TestMultiFormatFanout:
+    """output_format 为列表时每个 .log 只读一遍，分发给多个 planter。"""
+
+    @pytest.fixture
+    def entries(self):
+        return readentries(f_path=str(STUDY / "entries.log"), version="4.3.2")
+
+    @pytest.fixture
+    def parser_opens(self, monkeypatch):
+        import epycon.conversion as conv
+        opened = []
+
+        class CountingParser(conv.LogParser):
+            def __enter__(self):
+                opened.append(self.f_path)
+                return super().__enter__()
+
+        monkeypatch.setattr(conv, "LogParser", CountingParser)
+        return opened
+
+    @pytest.mark.parametrize("threaded", [False, True])
+    def test_single_pass_matches_separate_runs(self, tmp_path, entries, parser_opens, threaded):
+        cfg = _base_cfg(STUDY.parent, tmp_path / "both", merge=False)
+        cfg["data"]["output_format"] = ["h5", {"format": "csv"}]
+        cfg["data"]["writer_threads"] = threaded
+        cfg["entries"]["convert"] = False
+        convert_study(str(STUDY), "study01", str(tmp_path / "both"), cfg, entries)
+        assert len(parser_opens) == 2  # 两个 .log 各读一遍，而非每格式一遍
+
+        for fmt in ("h5", "csv"):
+            single = _base_cfg(STUDY.parent, tmp_path / fmt, merge=False)
+            single["data"]["output_format"] = fmt
+            single["entries"]["convert"] = False
+            convert_study(str(STUDY), "study01", str(tmp_path / fmt), single, entries)
+
+        assert (tmp_path / "both" / "00000000.csv").read_text() == \
+            (tmp_path / "csv" / "00000000.csv").read_text()
+        with h5py.File(tmp_path / "both" / "00000001.h5", "r") as a, \
+                h5py.File(tmp_path / "h5" / "00000001.h5", "r") as b:
+            assert (a["Data"][:] == b["Data"][:]).all()
+            assert [int(r["SampleLeft"]) for r in a["Marks"][:]] == [50]
+
+    def test_merge_mode_fans_out_per_file_csv(self, tmp_path, entries, parser_opens):
+        cfg = _base_cfg(STUDY.parent, tmp_path, merge=True)
+        cfg["data"]["output_format"] = ["h5", "csv"]
+        convert_study(str(STUDY), "study01", str(tmp_path), cfg, entries)
+        # 2 次读头 + 2 次读数据
+        assert len(parser_opens) == 4
+        with h5py.File(tmp_path / "study01_merged.h5", "r") as f:
+            assert max(f["Data"].shape) == 2048
+            assert [int(r["SampleLeft"]) for r in f["Marks"][:]] == [1074]
+        for log_id in ("00000000", "00000001"):
+            assert len((tmp_path / f"{log_id}.csv").read_text().splitlines()) == 1025
+
+    def test_duplicate_format_rejected(self, tmp_path):
+        from epycon.conversion import output_specs
+        cfg = _base_cfg(STUDY.parent, tmp_path)
+        cfg["data"]["output_format"] = ["h5", "h5"]
+        with pytest.raises(ValueError, match="unique"):
+            output_specs(cfg)
+
+    def test_writer_thread_error_propagates(self):
+        from epycon.conversion import PlanterFanout
+
+        class Boom:
+            def write(self, chunk):
+                raise IOError("disk full")
+
+        class Sink:
+            def write(self, chunk):
+                pass
+
+        with pytest.raises(IOError, match="disk full"):
+            with PlanterFanout([Sink(), Boom()], threaded=True) as fanout:
+                fanout.write(object())
+
+
+# ========================= 窗口 / 局部转换 =========================
+
+SEG0_TS = 1769608079.246
+SEG1_TS = 1769608092.253
+
+
+class TestConversionWindows:
+    def _cfg(self, windows):
+        return {"data": {"windows": windows}}
+
+    def test_unconfigured_means_whole_logs(self):
+        from epycon.conversion import conversion_windows
+        assert conversion_windows(self._cfg(None), []) is None
+        assert conversion_windows(self._cfg({}), []) is None
+
+    def test_union_is_sorted_and_merged(self):
+        from epycon.conversion import conversion_windows
+        cfg = self._cfg({"epoch_ranges": [[20, 30], [10, 15], [14, 18]],
+                         "elapsed_ranges": [[25, 40]]})
+        assert conversion_windows(cfg, [], zero_epoch=5) == [(10, 18), (20, 45)]
+
+    def test_around_entries_group_and_pattern(self):
+        from epycon.conversion import conversion_windows
+        entries = [FakeEntry("a", 100, "EVENT", "RF on"), FakeEntry("a", 200, "NOTE", "RF on"),
+                   FakeEntry("a", 300, "EVENT", "pacing")]
+        cfg = self._cfg({"around_entries": {"groups": ["EVENT"], "pattern": "^RF",
+                                            "before": 5, "after": 2}})
+        assert conversion_windows(cfg, entries) == [(95, 102)]
+
+    def test_no_match_converts_nothing(self):
+        from epycon.conversion import conversion_windows
+        cfg = self._cfg({"around_entries": {"pattern": "nothing"}})
+        assert conversion_windows(cfg, [FakeEntry("a", 1, message="x")]) == []
+
+    def test_empty_range_lists_are_a_config_error(self):
+        from epycon.conversion import conversion_windows
+        for spec in ({"epoch_ranges": []}, {"elapsed_ranges": [], "epoch_ranges": []}):
+            with pytest.raises(ValueError, match="defines no windows"):
+                conversion_windows(self._cfg(spec), [])
+
+    def test_schema_requires_nonempty_range_lists(self):
+        import jsonschema
+        schema = json.loads((ROOT / "epycon" / "config" / "schema.json").read_text(encoding="utf-8"))
+        windows = schema["properties"]["data"]["properties"]["windows"]
+        jsonschema.validate({"epoch_ranges": [[1, 2]]}, windows)
+        for key in ("epoch_ranges", "elapsed_ranges"):
+            with pytest.raises(jsonschema.ValidationError):
+                jsonschema.validate({key: []}, windows)
+
+    def test_invalid_pattern_is_a_config_error(self):
+        from epycon.conversion import conversion_windows
+        cfg = self._cfg({"around_entries": {"pattern": "RF("}})
+        with pytest.raises(ValueError, match=r"'RF\('"):
+            conversion_windows(cfg, [FakeEntry("a", 1, message="RF on")])
+
+    def test_segment_ranges_clip(self):
+        from epycon.conversion import segment_ranges
+        assert segment_ranges(None, 100, 1000, 1024) == [(0, None)]
+        assert segment_ranges([(99.5, 100.2), (100.9, 200)], 100, 1000, 1024) == \
+            [(0, 200), (900, 1024)]
+        assert segment_ranges([(50, 60)], 100, 1000, 1024) == []
+
+
+class TestWindowedConversion:
+    @pytest.fixture
+    def entries(self):
+        return readentries(f_path=str(STUDY / "entries.log"), version="4.3.2")
+
+    def _full(self, tmp_path, entries):
+        cfg = _base_cfg(STUDY.parent, tmp_path / "full", merge=False)
+        cfg["entries"]["convert"] = False
+        convert_study(str(STUDY), "study01", str(tmp_path / "full"), cfg, entries)
+        with h5py.File(tmp_path / "full" / "00000001.h5", "r") as f:
+            return f["Data"][:]
+
+    def test_epoch_window_reads_only_overlapping_log(self, tmp_path, entries):
+        full = self._full(tmp_path, entries)
+        cfg = _base_cfg(STUDY.parent, tmp_path / "win", merge=False)
+        cfg["entries"]["convert"] = False
+        cfg["data"]["windows"] = {"epoch_ranges": [[SEG1_TS + 0.02, SEG1_TS + 0.3]]}
+        assert convert_study(str(STUDY), "study01", str(tmp_path / "win"), cfg, entries) == 1
+
+        assert sorted(p.name for p in (tmp_path / "win").iterdir()) == ["00000001_20-300.h5"]
+        with h5py.File(tmp_path / "win" / "00000001_20-300.h5", "r") as f:
+            assert (f["Data"][:] == full[:, 20:300]).all()
+            assert f.attrs["Timestamp"] == pytest.approx(SEG1_TS + 0.02)
+            assert f.attrs["WindowStartSample"] == 20
+            # 原 50 号样本的标注相对窗口首样本落位
+            assert [int(r["SampleLeft"]) for r in f["Marks"][:]] == [30]
+
+    def test_empty_windows_fail_before_converting(self, tmp_path, entries):
+        import logging
+        cfg = _base_cfg(STUDY.parent, tmp_path, merge=False)
+        cfg["data"]["windows"] = {"epoch_ranges": []}
+        for logger in (None, logging.getLogger("test")):
+            with pytest.raises(ValueError, match="defines no windows"):
+                convert_study(str(STUDY), "study01", str(tmp_path), cfg, entries, logger=logger)
+        assert not list(tmp_path.glob("*.h5"))
+
+    def test_around_entries_in_merged_file(self, tmp_path, entries):
+        from epycon.core.timeindex import locate_epoch, read_segment_index
+        cfg = _base_cfg(STUDY.parent, tmp_path, merge=True)
+        cfg["data"]["windows"] = {
+            "around_entries": {"pattern": "Entry 2", "before": 0.1, "after": 0.2},
+            "elapsed_ranges": [[0.5, 0.6]],
+        }
+        convert_study(str(STUDY), "study01", str(tmp_path), cfg, entries)
+        with h5py.File(tmp_path / "study01_merged.h5", "r") as f:
+            assert max(f["Data"].shape) == 100 + 250
+            assert f.attrs["Timestamp"] == pytest.approx(SEG0_TS + 0.5)
+            index = read_segment_index(f)
+            assert index["SampleOffset"].tolist() == [0, 100]
+            assert index["NumSamples"].tolist() == [100, 250]
+            assert [int(r["SampleLeft"]) for r in f["Marks"][:]] == [150]
+        assert locate_epoch(index, SEG1_TS + 0.05).sample == 150
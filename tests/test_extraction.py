@@ -9,6 +9,7 @@ from pathlib import Path
 import numpy as np
 import pytest
 
+from epycon.cli.extract import to_jsonable
 from epycon.extraction import parse_elapsed, ExtractionError
 
 ROOT = Path(__file__).parent.parent
@@ -235,7 +236,7 @@ class TestExtractWindow:
         r = extract_window(str(REAL), at_elapsed="1:07:15",
                            leads=["II"], window=2.0, raw_counts=True, version=VER)
         assert r["units"] == "counts"
-        assert all(isinstance(x, int) for x in r["leads"][0]["samples"][:5])
+        assert r["leads"][0]["samples"].dtype == np.int32
 
     def test_conflicting_targets_raise(self):
         from epycon.extraction import extract_window
@@ -346,6 +347,32 @@ class TestRailPure:
         assert is_railed(np.arange(100, dtype=np.int64)) is False
 
 
+class TestLeadOverflowPure:
+    """raw_counts 输出 int32：双极差分越界必须拒绝，不得回绕成错误波形。"""
+
+    def test_bipolar_difference_beyond_int32_rejected(self):
+        from epycon.extraction import _lead_results
+        raw = np.zeros((10, 2), dtype=np.int64)
+        raw[:, 0] = -2_000_000_000 + np.arange(10)
+        raw[:, 1] = 2_000_000_000 - np.arange(10)
+        (ld,) = _lead_results(raw, [("D", (0, 1))], 1.0, raw_counts=True)
+        assert ld["status"] == "rejected" and "int32" in ld["reason"]
+
+    def test_microvolts_keep_full_range(self):
+        from epycon.extraction import _lead_results
+        raw = np.zeros((10, 2), dtype=np.int64)
+        raw[:, 0] = -2_000_000_000 + np.arange(10)
+        raw[:, 1] = 2_000_000_000 - np.arange(10)
+        (ld,) = _lead_results(raw, [("D", (0, 1))], 1.0, raw_counts=False)
+        assert ld["status"] == "ok"
+        assert abs(ld["samples"][0]) == pytest.approx(4e6, rel=1e-6)  # 4e9 计数 × 1/1000 µV
+
+    def test_in_range_counts_pass_through(self):
+        from epycon.extraction import _lead_samples
+        sig = np.array([np.iinfo(np.int32).min, 0, np.iinfo(np.int32).max], dtype=np.int64)
+        assert _lead_samples(sig, 1.0, True).tolist() == sig.tolist()
+
+
 class TestFailClosedGuardsPure:
     """fail-closed 守卫在读任何数据文件之前触发，故用不存在的目录即可测，CI 可跑。"""
     NODIR = str(ROOT / "no_such_study_dir")
@@ -400,3 +427,403 @@ class TestMalformedInputPure:
         (tmp_path / "entries.log").write_bytes(b"\x00" * 7)  # 长度非法
         with pytest.raises(ExtractionError, match="无法解析"):
             check_consistency(str(tmp_path), [], VER)
+
+
+class TestMergedH5Source:
+    """合并 HDF5（带 SegmentIndex）作数据源：波形须与原始 .log 逐样本一致（#21）。"""
+
+    @pytest.fixture
+    def merged_h5(self, tmp_path):
+        import json
+        from epycon.conversion import convert_study
+        cfg = json.loads((ROOT / "epycon" / "config" / "config.json").read_text(encoding="utf-8"))
+        cfg["data"]["merge_logs"] = True
+        convert_study(str(STUDY01), "study01", str(tmp_path), cfg, [])
+        return tmp_path / "study01_merged.h5"
+
+    def test_window_matches_log(self, merged_h5):
+        from epycon.extraction import extract_window, load_segments, read_raw_window
+        seg1 = load_segments(str(STUDY01), VER)[1]
+        r = extract_window(str(merged_h5), at_epoch=seg1["ts"] + 0.5,
+                           leads=["CH1", "CH2"], window=0.1, raw_counts=True, version=VER)
+        assert r["log"] == "00000001"
+        raw = read_raw_window(seg1, 400, 600, VER)
+        for ld, col in zip(r["leads"], (0, 1)):
+            assert ld["status"] == "ok"
+            assert list(ld["samples"]) == raw[:, col].tolist()
+
+    def test_gap_rejects(self, merged_h5):
+        from epycon.extraction import extract_window, load_segments
+        seg0 = load_segments(str(STUDY01), VER)[0]
+        with pytest.raises(ExtractionError, match="空档"):
+            extract_window(str(merged_h5), at_epoch=seg0["ts"] + 5.0,
+                           leads=["CH1"], version=VER)
+
+    def test_missing_index_fails_closed(self, merged_h5):
+        import h5py
+        from epycon.extraction import extract_window
+        with h5py.File(merged_h5, "a") as f:
+            del f["SegmentIndex"]
+        with pytest.raises(ExtractionError, match="SegmentIndex"):
+            extract_window(str(merged_h5), at_elapsed="0:00:00.5",
+                           leads=["CH1"], version=VER)
+
+    def test_rail_values_survive_float32_roundtrip(self):
+        from epycon.extraction import RAIL_VALUES, _stored_uv
+        res = 78
+        stored = np.array([_stored_uv(r, res) for r in RAIL_VALUES], dtype=np.float32)
+        # 栏杆值在 float32 下不能靠 rint 还原，必须走逐值比对回填
+        naive = np.rint(stored.astype(np.float64) * 1000.0 / res).astype(np.int64)
+        assert set(naive.tolist()) != set(RAIL_VALUES)
+
+
+@pytest.fixture
+def consistent_study(tmp_path):
+    """study01 的两个 .log + 空 entries.log（仅 36 字节头），可通过一致性校验。"""
+    import shutil
+    study = tmp_path / "study"
+    study.mkdir()
+    for log in sorted(STUDY01.glob("0*.log")):
+        shutil.copy(log, study / log.name)
+    (study / "entries.log").write_bytes(bytes(36))
+    return study
+
+
+class TestExtractWindows:
+    """批量提取：一次加载、重叠窗口合并读取，逐目标结果与单目标调用一致。"""
+
+    def test_matches_single_target_calls(self, consistent_study):
+        from epycon.extraction import extract_window, extract_windows, load_segments
+        seg0, seg1 = load_segments(str(consistent_study), VER)
+        targets = [{"epoch": seg1["ts"] + 0.5}, "0:00:00.2", {"epoch": seg0["ts"] + 0.3}]
+        batch = extract_windows(str(consistent_study), targets, leads=["CH1", "CH2"],
+                                window=0.1, raw_counts=True, version=VER)
+        singles = [
+            extract_window(str(consistent_study), at_epoch=seg1["ts"] + 0.5, leads=["CH1", "CH2"],
+                           window=0.1, raw_counts=True, version=VER),
+            extract_window(str(consistent_study), at_elapsed="0:00:00.2", leads=["CH1", "CH2"],
+                           window=0.1, raw_counts=True, version=VER),
+            extract_window(str(consistent_study), at_epoch=seg0["ts"] + 0.3, leads=["CH1", "CH2"],
+                           window=0.1, raw_counts=True, version=VER),
+        ]
+        assert to_jsonable(batch["results"]) == to_jsonable(singles)
+        # seg0 的 [100,300) 与 [200,400) 重叠合并为一次读，seg1 一次
+        assert batch["reads"] == 2
+
+    def test_samples_are_typed_arrays(self, consistent_study):
+        from epycon.extraction import extract_windows
+        for raw_counts, dtype in ((False, np.float32), (True, np.int32)):
+            batch = extract_windows(str(consistent_study), ["0:00:00.5"], leads=["CH1"],
+                                    window=0.1, raw_counts=raw_counts, version=VER)
+            samples = batch["results"][0]["leads"][0]["samples"]
+            assert isinstance(samples, np.ndarray) and samples.dtype == dtype
+
+    def test_loads_study_once(self, consistent_study, monkeypatch):
+        import epycon.extraction as ext
+        calls = []
+        real = ext.check_consistency
+        monkeypatch.setattr(ext, "check_consistency", lambda *a: calls.append(a) or real(*a))
+        ext.extract_windows(str(consistent_study), [f"0:00:00.{i}" for i in range(1, 10)],
+                            leads=["CH1"], window=0.05, version=VER)
+        assert len(calls) == 1
+
+    def test_per_target_errors_do_not_abort_batch(self, consistent_study):
+        from epycon.extraction import extract_windows
+        batch = extract_windows(str(consistent_study), ["0:00:05", "bad", "0:00:00.5"],
+                                leads=["CH1"], version=VER)
+        first, second, third = batch["results"]
+        assert "空档" in first["error"]
+        assert "H:MM:SS" in second["error"]
+        assert third["leads"][0]["status"] == "ok"
+
+    def test_coalesce_merges_adjacent(self):
+        from epycon.extraction import _coalesce
+        assert _coalesce([(10, 20, "b"), (0, 10, "a"), (30, 40, "c"), (35, 36, "d")]) == \
+            [(0, 20, ["a", "b"]), (30, 40, ["c", "d"])]
+
+    def test_study_level_error_still_raises(self, consistent_study):
+        from epycon.extraction import extract_windows
+        with pytest.raises(ExtractionError, match="导联"):
+            extract_windows(str(consistent_study), ["0:00:00.5"], leads=[], version=VER)
+
+
+class TestExtractionSession:
+    """长驻会话：同一 study 只加载一次、parser 复用，文件变动后自动重载。"""
+
+    def test_repeat_queries_hit_cache_and_reuse_parser(self, consistent_study, monkeypatch):
+        import epycon.extraction as ext
+        from epycon.extraction import ExtractionSession, extract_window
+        opened = []
+        real_parser = ext.LogParser
+
+        class CountingParser(real_parser):
+            def __enter__(self):
+                opened.append(self.f_path)
+                return super().__enter__()
+
+        session = ExtractionSession()
+        expected = extract_window(str(consistent_study), at_elapsed="0:00:00.5",
+                                  leads=["CH1"], window=0.1, version=VER)
+        monkeypatch.setattr(ext, "LogParser", CountingParser)
+        first = session.extract_windows(str(consistent_study), ["0:00:00.5"],
+                                        leads=["CH1"], window=0.1, version=VER)
+        n_opened = len(opened)  # 2 个段头 + 1 个读取 parser
+        second = session.extract_windows(str(consistent_study), ["0:00:00.5", "0:00:00.7"],
+                                         leads=["CH1"], window=0.1, version=VER)
+        assert (first["cached"], second["cached"]) == (False, True)
+        assert len(opened) == n_opened
+        assert to_jsonable(first["results"][0]) == to_jsonable(second["results"][0]) \
+            == to_jsonable(expected)
+        session.close()
+
+    def test_changed_files_invalidate(self, consistent_study):
+        import os
+        from epycon.extraction import ExtractionSession
+        session = ExtractionSession()
+        session.extract_window(str(consistent_study), at_elapsed="0:00:00.5",
+                               leads=["CH1"], version=VER)
+        entries = consistent_study / "entries.log"
+        st = entries.stat()
+        os.utime(entries, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        batch = session.extract_windows(str(consistent_study), ["0:00:00.5"],
+                                        leads=["CH1"], version=VER)
+        assert batch["cached"] is False
+        session.close()
+
+    def test_lru_eviction(self, consistent_study, tmp_path):
+        import shutil
+        from epycon.extraction import ExtractionSession
+        other = tmp_path / "other"
+        shutil.copytree(consistent_study, other)
+        session = ExtractionSession(max_studies=1)
+        for study in (consistent_study, other, consistent_study):
+            batch = session.extract_windows(str(study), ["0:00:00.5"], leads=["CH1"], version=VER)
+            assert batch["cached"] is False
+        assert len(session._studies) == 1
+        session.close()
+
+
+@pytest.fixture
+def merged_with_entries(tmp_path):
+    """study01 合并 HDF5，带三条标注：段0 起点附近（窗口越界）与段1 中部。"""
+    import json
+    from epycon.conversion import convert_study
+    from epycon.core._dataclasses import Entry
+    from epycon.extraction import load_segments
+    seg0, seg1 = load_segments(str(STUDY01), VER)
+    entries = [
+        Entry("00000000", "EVENT", seg0["ts"] + 0.01, "RF on"),
+        Entry("00000001", "EVENT", seg1["ts"] + 0.5, "RF on"),
+        Entry("00000001", "NOTE", seg1["ts"] + 0.6, "comment"),
+    ]
+    cfg = json.loads((ROOT / "epycon" / "config" / "config.json").read_text(encoding="utf-8"))
+    cfg["data"]["merge_logs"] = True
+    convert_study(str(STUDY01), "study01", str(tmp_path), cfg, entries)
+    return tmp_path / "study01_merged.h5"
+
+
+class TestExtractEpochs:
+    """事件锁定取窗：按标注堆叠 (events, leads, samples)，越界部分补零并由 mask 标出。"""
+
+    def test_stack_matches_single_windows(self, merged_with_entries):
+        from epycon.extraction import extract_epochs, extract_window, load_segments
+        seg1 = load_segments(str(STUDY01), VER)[1]
+        ep = extract_epochs(str(merged_with_entries), leads=["CH1", "CH2"], groups=["EVENT"],
+                            window=0.1, raw_counts=True, version=VER)
+        assert ep["data"].shape == (2, 2, 200) and ep["data"].dtype == np.int32
+        assert ep["pre_samples"] == 100
+        assert [e["status"] for e in ep["events"]] == ["clipped", "ok"]
+        single = extract_window(str(merged_with_entries), at_epoch=seg1["ts"] + 0.5,
+                                leads=["CH1", "CH2"], window=0.1, raw_counts=True, version=VER)
+        for j, ld in enumerate(single["leads"]):
+            assert ep["data"][1, j].tolist() == list(ld["samples"])
+        assert ep["mask"][1].all()
+        assert ep["overflow"].shape == (2, 2) and not ep["overflow"].any()
+
+    def test_clipped_edge_is_zero_padded(self, merged_with_entries):
+        from epycon.extraction import extract_epochs
+        ep = extract_epochs(str(merged_with_entries), leads=["CH1"], pattern="RF",
+                            window=0.1, version=VER)
+        assert ep["data"].dtype == np.float32
+        # 标注位于段0 第 10 个样本：窗口前 90 个样本越过段首
+        assert not ep["mask"][0, :90].any() and ep["mask"][0, 90:].all()
+        assert not ep["data"][0, 0, :90].any()
+
+    def test_selection_filters(self, merged_with_entries):
+        from epycon.extraction import extract_epochs, load_segments
+        seg1 = load_segments(str(STUDY01), VER)[1]
+        ep = extract_epochs(str(merged_with_entries), leads=["CH1"], pattern="^comm",
+                            window=0.1, version=VER)
+        assert [e["group"] for e in ep["events"]] == ["NOTE"]
+        ep = extract_epochs(str(merged_with_entries), leads=["CH1"], window=0.1, version=VER,
+                            time_range=(seg1["ts"], "0:01:00"))
+        assert len(ep["events"]) == 2 and ep["reads"] == 1  # 段1 两个重叠窗口合并为一次读
+
+    def test_no_match_gives_empty_stack(self, merged_with_entries):
+        from epycon.extraction import extract_epochs
+        ep = extract_epochs(str(merged_with_entries), leads=["CH1"], groups=["NOPE"],
+                            window=0.1, version=VER)
+        assert ep["data"].shape == (0, 1, 200) and ep["events"] == []
+
+    def test_invalid_pattern_raises(self, merged_with_entries):
+        from epycon.extraction import extract_epochs
+        with pytest.raises(ExtractionError, match="正则"):
+            extract_epochs(str(merged_with_entries), leads=["CH1"], pattern="(", version=VER)
+
+
+class TestConsistencyCache:
+    """一致性校验记忆化：文件不变不重新解析；变动、--revalidate 时重新校验。"""
+
+    @pytest.fixture
+    def counted(self, monkeypatch, tmp_path):
+        import epycon.extraction as ext
+        monkeypatch.setenv("EPYCON_CACHE_DIR", str(tmp_path / "cache"))
+        monkeypatch.setattr(ext, "_CONSISTENCY_MEMO", ext.OrderedDict())
+        calls = []
+        real = ext.check_consistency
+        monkeypatch.setattr(ext, "check_consistency", lambda *a: calls.append(a) or real(*a))
+        return calls
+
+    def test_hit_in_process_and_on_disk(self, consistent_study, counted, tmp_path):
+        import epycon.extraction as ext
+        segs = ext.load_segments(str(consistent_study), VER)
+        ext.validated_entries(str(consistent_study), segs, VER)
+        ext.validated_entries(str(consistent_study), segs, VER)
+        assert len(counted) == 1
+        assert len(list((tmp_path / "cache" / "consistency").glob("*.json"))) == 1
+        ext._CONSISTENCY_MEMO.clear()  # 模拟新进程：从磁盘缓存命中
+        ext.validated_entries(str(consistent_study), segs, VER)
+        assert len(counted) == 1
+
+    def test_changed_entries_and_revalidate(self, consistent_study, counted):
+        import os
+        import epycon.extraction as ext
+        segs = ext.load_segments(str(consistent_study), VER)
+        ext.validated_entries(str(consistent_study), segs, VER)
+        ext.validated_entries(str(consistent_study), segs, VER, revalidate=True)
+        assert len(counted) == 2
+        entries = consistent_study / "entries.log"
+        st = entries.stat()
+        os.utime(entries, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        ext.validated_entries(str(consistent_study), segs, VER)
+        assert len(counted) == 3
+
+    def test_failure_is_cached_and_reraised(self, counted):
+        import epycon.extraction as ext
+        segs = ext.load_segments(str(STUDY01), VER)
+        for _ in range(2):
+            with pytest.raises(ExtractionError, match="之外"):
+                ext.validated_entries(str(STUDY01), segs, VER)
+        assert len(counted) == 1
+
+    def test_hit_skips_segment_loading(self, consistent_study, counted, monkeypatch):
+        import epycon.extraction as ext
+        loads = []
+        real = ext.load_segments
+        monkeypatch.setattr(ext, "load_segments", lambda *a: loads.append(a) or real(*a))
+        kwargs = dict(leads=["CH1", "CH2"], window=0.1, raw_counts=True, version=VER)
+        first = ext.extract_window(str(consistent_study), at_elapsed="0:00:00.5", **kwargs)
+        ext._CONSISTENCY_MEMO.clear()  # 新进程：只剩磁盘缓存
+        second = ext.extract_window(str(consistent_study), at_elapsed="0:00:00.5", **kwargs)
+        assert (len(loads), len(counted)) == (1, 1)
+        for a, b in zip(first["leads"], second["leads"]):
+            assert np.array_equal(a["samples"], b["samples"])
+        # 段表缓存与首次加载同形，段头按需补读
+        segs, _, _ = ext._open_study(str(consistent_study), VER)
+        assert len(loads) == 1 and all(seg["header"] is None for seg in segs)
+        assert ext._segment_map(segs) == ext._segment_map(real(str(consistent_study), VER))
+        assert ext._segment_header(segs[0], VER).num_channels > 0
+        ext._open_study(str(consistent_study), VER, revalidate=True)
+        assert (len(loads), len(counted)) == (2, 2)
+
+    def test_disk_cache_is_bounded(self, counted, tmp_path, monkeypatch):
+        import os
+        import epycon.extraction as ext
+        monkeypatch.setattr(ext, "CONSISTENCY_CACHE_MAX_RECORDS", 3)
+        cache_dir = tmp_path / "cache" / "consistency"
+        import time
+        for i in range(5):
+            ext._store_consistency_record((f"/study{i}", VER), {"i": i})
+            stamp = time.time() - 100 + i  # 显式递增 mtime，不依赖文件系统时间精度
+            os.utime(ext._consistency_cache_path((f"/study{i}", VER)), (stamp, stamp))
+        names = {p.name for p in cache_dir.glob("*.json")}
+        assert len(names) == 3
+        assert os.path.basename(ext._consistency_cache_path(("/study4", VER))) in names
+        # 超龄记录在下次写入时删除
+        stale = cache_dir / sorted(names)[0]
+        old = os.stat(stale).st_mtime - ext.CONSISTENCY_CACHE_MAX_AGE_SEC - 60
+        os.utime(stale, (old, old))
+        ext._store_consistency_record(("/study5", VER), {"i": 5})
+        assert not stale.exists() and len(list(cache_dir.glob("*.json"))) == 3
+
+    def test_empty_cache_dir_disables_persistence(self, consistent_study, counted, monkeypatch):
+        import epycon.extraction as ext
+        monkeypatch.setenv("EPYCON_CACHE_DIR", "")
+        assert ext.consistency_cache_dir() is None
+        segs = ext.load_segments(str(consistent_study), VER)
+        assert ext.validated_entries(str(consistent_study), segs, VER) == []
+
+
+class TestH5Conformance:
+    """从转换产物提取（逐段文件、逐段目录、合并文件）须与 .log 路径逐样本一致。"""
+
+    @pytest.fixture
+    def converted(self, consistent_study, tmp_path):
+        import json
+        from epycon.conversion import convert_study
+        cfg = json.loads((ROOT / "epycon" / "config" / "config.json").read_text(encoding="utf-8"))
+        per_seg, merged = tmp_path / "per_seg", tmp_path / "merged"
+        convert_study(str(consistent_study), "study", str(per_seg), cfg, [])
+        cfg["data"]["merge_logs"] = True
+        convert_study(str(consistent_study), "study", str(merged), cfg, [])
+        return per_seg, merged / "study_merged.h5"
+
+    @staticmethod
+    def _strip(batch):
+        results = to_jsonable(batch["results"])
+        for r in results:
+            r.pop("study", None)
+        return results
+
+    @pytest.mark.parametrize("raw_counts", [False, True])
+    def test_sources_identical(self, consistent_study, converted, raw_counts):
+        from epycon.extraction import extract_windows, load_segments
+        per_seg, merged = converted
+        seg0, seg1 = load_segments(str(consistent_study), VER)
+        targets = ["0:00:00.05", {"epoch": seg0["ts"] + 1.0}, {"epoch": seg1["ts"] + 0.5},
+                   "0:00:05"]
+        kwargs = dict(leads=["CH2", "CH1"], window=0.1, raw_counts=raw_counts, version=VER)
+        expected = self._strip(extract_windows(str(consistent_study), targets, **kwargs))
+        for source in (per_seg, merged):
+            assert self._strip(extract_windows(str(source), targets, **kwargs)) == expected
+        # 单个逐段文件：只含该段，其余目标落在其区间之外
+        single = self._strip(extract_windows(str(per_seg / "00000001.h5"), targets, **kwargs))
+        assert single[2] == expected[2]
+
+    def test_reads_only_required_columns(self, converted, monkeypatch):
+        import epycon.extraction as ext
+        per_seg, _ = converted
+        seen = []
+        real = ext.read_h5_window
+        monkeypatch.setattr(ext, "read_h5_window",
+                            lambda *a, **k: seen.append(k.get("columns")) or real(*a, **k))
+        r = ext.extract_window(str(per_seg), at_elapsed="0:00:00.5", leads=["CH2"],
+                               window=0.1, version=VER)
+        assert seen == [[1]] and r["leads"][0]["n"] == 200
+
+    def test_per_segment_without_resolution_fails_closed(self, converted):
+        import h5py
+        from epycon.extraction import extract_window
+        per_seg, _ = converted
+        with h5py.File(per_seg / "00000000.h5", "a") as f:
+            del f.attrs["Resolution"]
+        with pytest.raises(ExtractionError, match="Resolution"):
+            extract_window(str(per_seg), at_elapsed="0:00:00.5", leads=["CH1"], version=VER)
+
+    def test_overlapping_products_fail_closed(self, converted):
+        import shutil
+        from epycon.extraction import extract_window
+        per_seg, merged = converted
+        shutil.copy(merged, per_seg / merged.name)
+        with pytest.raises(ExtractionError, match="重叠"):
+            extract_window(str(per_seg), at_elapsed="0:00:00.5", leads=["CH1"], version=VER)
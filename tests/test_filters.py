@@ -0,0 +1,181 @@
+"""转换期流式滤波 / 抽取级测试。
+
+核心断言：分块流式结果与整段一次处理一致——causal 逐样本相等（zi 跨块传递），
+zero_phase 在上下文足够时逼近整段 filtfilt，抽取与 resample_poly 逐样本相等；
+混合规格的列输出对齐、样本数守恒。
+"""
+import json
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pytest
+
+signal = pytest.importorskip("scipy.signal")
+
+from epycon.conversion import convert_study
+from epycon.core.filters import (
+    StreamingDecimator, StreamingFilter, column_filter_specs, design_sos,
+)
+from epycon.extraction import ExtractionError, load_h5_segments
+
+ROOT = Path(__file__).parent.parent
+STUDY = ROOT / "examples" / "data" / "study01"
+FS = 1000
+SPEC = {"notch": {"freq": 50, "harmonics": 2}, "highpass": {"cutoff": 0.5}, "lowpass": {"cutoff": 100}}
+
+
+@pytest.fixture
+def walk():
+    return np.random.default_rng(0).normal(size=(20000, 3)).cumsum(axis=0)
+
+
+def _stream(stage, x, chunk):
+    out = []
+    for i in range(0, len(x), chunk):
+        y = stage.process(x[i:i + chunk])
+        if y is not None:
+            out.append(y)
+    tail = stage.flush()
+    if tail is not None:
+        out.append(tail)
+    return np.concatenate(out)
+
+
+def _causal_reference(x):
+    sos = design_sos(SPEC, FS)
+    zi = signal.sosfilt_zi(sos)[:, :, np.newaxis] * x[0]
+    return signal.sosfilt(sos, x, axis=0, zi=zi)[0]
+
+
+@pytest.mark.parametrize("chunk", [1024, 777, 20000])
+def test_causal_chunks_are_seamless(walk, chunk):
+    y = _stream(StreamingFilter([SPEC] * 3, FS), walk, chunk)
+    np.testing.assert_array_equal(y, _causal_reference(walk))
+
+
+def test_zero_phase_matches_whole_signal_filtfilt(walk):
+    spec = {**SPEC, "zero_phase": True, "overlap": 8}
+    y = _stream(StreamingFilter([spec] * 3, FS), walk, 1024)
+    ref = signal.sosfiltfilt(design_sos(SPEC, FS), walk, axis=0)
+    assert y.shape == walk.shape
+    assert np.abs(y - ref).max() < 1e-6 * np.abs(ref).max()
+
+
+def test_mixed_specs_stay_aligned(walk):
+    # 零相位组滞后输出，causal 与直通组必须等它，行才对齐
+    stage = StreamingFilter([{**SPEC, "zero_phase": True, "overlap": 1}, SPEC, None], FS)
+    y = _stream(stage, walk, 1024)
+    assert y.shape == walk.shape
+    np.testing.assert_array_equal(y[:, 1], _causal_reference(walk)[:, 1])
+    np.testing.assert_array_equal(y[:, 2], walk[:, 2])
+
+
+def test_column_specs_per_lead_override():
+    cfg = {"zero_phase": True, "default": SPEC, "leads": {"B": None, "C": {"lowpass": {"cutoff": 40}}}}
+    specs = column_filter_specs(cfg, ["A", "B", "C"])
+    assert specs[0] == {"zero_phase": True, **SPEC}
+    assert specs[1] is None
+    assert specs[2] == {"zero_phase": True, "lowpass": {"cutoff": 40}}
+    assert column_filter_specs({"default": None}, ["A"]) is None
+
+
+def test_cutoff_above_nyquist_rejected():
+    with pytest.raises(ValueError, match="cutoff"):
+        design_sos({"lowpass": {"cutoff": 600}}, FS)
+
+
+def test_conversion_writes_filtered_data(tmp_path):
+    cfg = json.loads((ROOT / "epycon" / "config" / "config.json").read_text(encoding="utf-8"))
+    cfg["entries"]["convert"] = False
+    convert_study(str(STUDY), "study01", str(tmp_path / "raw"), cfg, [])
+    cfg["data"]["filters"] = {"default": SPEC}
+    cfg["global_settings"]["processing"]["chunk_size"] = 1024
+    convert_study(str(STUDY), "study01", str(tmp_path / "flt"), cfg, [])
+
+    with h5py.File(tmp_path / "raw" / "00000000.h5", "r") as raw, \
+            h5py.File(tmp_path / "flt" / "00000000.h5", "r") as flt:
+        assert "Filters" not in raw.attrs
+        assert json.loads(flt.attrs["Filters"])["CH1"] == SPEC
+        ref = _causal_reference(raw["Data"][:].T.astype(np.float64))
+        np.testing.assert_allclose(flt["Data"][:].T, ref, rtol=1e-5, atol=1e-3)
+
+
+def test_extraction_rejects_filtered_merged_file(tmp_path):
+    cfg = json.loads((ROOT / "epycon" / "config" / "config.json").read_text(encoding="utf-8"))
+    cfg["data"]["merge_logs"] = True
+    cfg["data"]["filters"] = {"default": SPEC, "zero_phase": True}
+    convert_study(str(STUDY), "study01", str(tmp_path), cfg, [])
+    with h5py.File(tmp_path / "study01_merged.h5", "r") as f:
+        assert max(f["Data"].shape) == 2048
+    with pytest.raises(ExtractionError, match="滤波"):
+        load_h5_segments(str(tmp_path / "study01_merged.h5"))
+
+
+# ========================= 多相抽取 =========================
+
+@pytest.mark.parametrize("q", [2, 4, 5])
+@pytest.mark.parametrize("chunk", [7, 1000, 20000])
+def test_decimator_matches_resample_poly(walk, q, chunk):
+    y = _stream(StreamingDecimator(q), walk, chunk)
+    ref = signal.resample_poly(walk, 1, q, axis=0, padtype="edge")
+    assert y.shape == ref.shape == (-(-len(walk) // q), 3)
+    np.testing.assert_allclose(y, ref, rtol=0, atol=1e-9)
+
+
+def _cfg():
+    cfg = json.loads((ROOT / "epycon" / "config" / "config.json").read_text(encoding="utf-8"))
+    cfg["entries"]["convert"] = False
+    return cfg
+
+
+def test_conversion_output_rate_per_format(tmp_path):
+    from epycon.iou import readentries
+    entries = readentries(f_path=str(STUDY / "entries.log"), version="4.3.2")
+    cfg = _cfg()
+    cfg["data"]["output_format"] = [{"format": "h5", "sampling_freq": 250}, "csv"]
+    convert_study(str(STUDY), "study01", str(tmp_path), cfg, entries)
+
+    with h5py.File(tmp_path / "00000001.h5", "r") as f:
+        assert f["Data"].shape == (2, 256)
+        assert f.attrs["Fs"][0] == 250
+        assert f.attrs["sampling_freq"] == 250
+        assert f.attrs["NativeSamplingFreq"] == 1000
+        # 原生 50 号样本（+0.05 s）在 250 Hz 轴上落到 12/13 之间，取最近
+        assert [int(r["SampleLeft"]) for r in f["Marks"][:]] == [12]
+    assert len((tmp_path / "00000001.csv").read_text().splitlines()) == 1025
+
+
+def test_merged_output_rate_rescales_index_and_marks(tmp_path):
+    from epycon.core.timeindex import locate_epoch, read_segment_index
+    from epycon.iou import readentries
+    entries = readentries(f_path=str(STUDY / "entries.log"), version="4.3.2")
+    cfg = _cfg()
+    cfg["data"]["merge_logs"] = True
+    cfg["data"]["output_format"] = [{"format": "h5", "sampling_freq": 500}]
+    convert_study(str(STUDY), "study01", str(tmp_path), cfg, entries)
+    with h5py.File(tmp_path / "study01_merged.h5", "r") as f:
+        assert max(f["Data"].shape) == 1024
+        index = read_segment_index(f)
+        assert index["SampleOffset"].tolist() == [0, 512]
+        assert index["Fs"].tolist() == [500, 500]
+        assert [int(r["SampleLeft"]) for r in f["Marks"][:]] == [537]
+    assert locate_epoch(index, 1769608092.303).sample == 537
+    with pytest.raises(ExtractionError):
+        load_h5_segments(str(tmp_path / "study01_merged.h5"))
+
+
+def test_non_integer_ratio_rejected():
+    from epycon.conversion import output_rate
+    assert output_rate({"format": "h5"}, 1000) == (1, 1000)
+    with pytest.raises(ValueError, match="integer"):
+        output_rate({"format": "h5", "sampling_freq": 300}, 1000)
+
+
+def test_sel_rate_follows_h5_output_not_list_order():
+    from epycon.conversion import output_rate, sel_sampling_freq
+    for items in ([{"format": "csv", "sampling_freq": 250}, {"format": "h5", "sampling_freq": 500}],
+                  [{"format": "h5", "sampling_freq": 500}, {"format": "csv", "sampling_freq": 250}]):
+        assert sel_sampling_freq(items, [output_rate(spec, 1000) for spec in items], 1000) == 500
+    csv_only = [{"format": "csv", "sampling_freq": 250}]
+    assert sel_sampling_freq(csv_only, [output_rate(csv_only[0], 1000)], 1000) == 1000
@@ -29,6 +29,21 @@ def test_parse_arguments_custom_config():
         assert args.custom_config_path == '/config.json'
 
 
+def test_parse_arguments_windows():
+    """Window options map onto data.windows."""
+    from epycon.cli.batch import windows_from_args
+    with patch('sys.argv', ['epycon', '--epoch-range', '10', '20', '--elapsed-range', '0:01:00', '90',
+                            '--around-group', 'EVENT', '--before', '30']):
+        args = parse_arguments()
+    assert windows_from_args(args) == {
+        "epoch_ranges": [[10.0, 20.0]],
+        "elapsed_ranges": [[60.0, 90.0]],
+        "around_entries": {"groups": ["EVENT"], "before": 30.0},
+    }
+    with patch('sys.argv', ['epycon']):
+        assert windows_from_args(parse_arguments()) == {}
+
+
 from epycon.core.helpers import deep_override
 
 
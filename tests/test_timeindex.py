@@ -0,0 +1,91 @@
+"""段级墙钟时间索引测试（KNOWN_ISSUES #21）。
+
+纯逻辑层用手搭索引覆盖二分定位与空档 fail-closed；集成层断言 study01
+合并转换确实落盘了每段 (StartEpoch, SampleOffset, NumSamples, Fs)。
+"""
+import json
+from pathlib import Path
+
+import h5py
+import pytest
+
+from epycon.conversion import convert_study
+from epycon.core.timeindex import (
+    SEGMENT_INDEX_DNAME,
+    build_segment_index,
+    locate_epoch,
+    locate_elapsed,
+    locate_row,
+    read_segment_index,
+    sample_to_epoch,
+    segment_ids,
+)
+
+ROOT = Path(__file__).parent.parent
+STUDY = ROOT / "examples" / "data" / "study01"
+
+
+@pytest.fixture
+def index():
+    # 两段，中间 8 s 空档；第二段故意先给出，验证按 StartEpoch 排序
+    return build_segment_index([
+        ("00000001", 1010.0, 2000, 1000, 1000, 78),
+        ("00000000", 1000.0, 0, 2000, 1000, 78),
+    ])
+
+
+class TestLocate:
+    def test_sorted_by_start_epoch(self, index):
+        assert segment_ids(index) == ["00000000", "00000001"]
+
+    def test_first_segment(self, index):
+        loc = locate_epoch(index, 1000.5)
+        assert (loc.row, loc.local, loc.sample) == (0, 500, 500)
+
+    def test_second_segment_uses_offset(self, index):
+        loc = locate_epoch(index, 1010.25)
+        assert (loc.row, loc.local, loc.sample) == (1, 250, 2250)
+
+    def test_gap_returns_none(self, index):
+        # 段0 止于 1002.0（半开），段1 起于 1010.0
+        assert locate_epoch(index, 1002.0) is None
+        assert locate_epoch(index, 1005.0) is None
+
+    def test_before_first_and_after_last(self, index):
+        assert locate_epoch(index, 999.999) is None
+        assert locate_epoch(index, 1011.0) is None
+
+    def test_rounds_to_nearest_sample(self, index):
+        # 大数量级 epoch 相减的浮点误差不得截断成前一个采样点
+        idx = build_segment_index([("a", 1769608092.253, 0, 1024, 1000, 1)])
+        assert locate_epoch(idx, 1769608092.303).local == 50
+
+    def test_elapsed_zero_is_first_segment(self, index):
+        assert locate_elapsed(index, 10.25).sample == 2250
+
+    def test_locate_row_half_open(self, index):
+        starts = index["StartEpoch"]
+        duration = [2.0, 1.0].__getitem__
+        assert locate_row(starts, 1001.999, duration) == 0
+        assert locate_row(starts, 1002.0, duration) is None
+        assert locate_row(starts, 1010.0, duration) == 1
+        assert locate_row(starts, 999.0, duration) is None
+
+    def test_sample_to_epoch_roundtrip(self, index):
+        assert sample_to_epoch(index, 2250) == pytest.approx(1010.25)
+        assert sample_to_epoch(index, 3000) is None
+
+
+def test_merged_conversion_writes_index(tmp_path):
+    cfg = json.loads((ROOT / "epycon" / "config" / "config.json").read_text(encoding="utf-8"))
+    cfg["data"]["merge_logs"] = True
+    convert_study(str(STUDY), "study01", str(tmp_path), cfg, [])
+    with h5py.File(tmp_path / "study01_merged.h5", "r") as f:
+        assert SEGMENT_INDEX_DNAME in f
+        idx = read_segment_index(f)
+    assert segment_ids(idx) == ["00000000", "00000001"]
+    assert idx["SampleOffset"].tolist() == [0, 1024]
+    assert idx["NumSamples"].tolist() == [1024, 1024]
+    assert idx["StartEpoch"].tolist() == pytest.approx([1769608079.246, 1769608092.253])
+    # 段间 ~12 s 空档不在合并轴上，但索引能把墙钟时刻准确落到第二段
+    assert locate_epoch(idx, 1769608092.303).sample == 1074